@@ -4,24 +4,23 @@
 """
 
 import sys, psutil, math
-from random import randint
 from datetime import datetime
 
 from PyQt6 import uic
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QFileDialog, QDialog, 
-                             QMessageBox, QWidget, QVBoxLayout, QListWidgetItem, 
-                             QLabel, QProgressDialog)
-from PyQt6.QtGui import QPixmap, QIcon, QColor
-from PyQt6.QtCore import QRectF, Qt, QSize, QTimer
+                             QMessageBox, QWidget, QVBoxLayout, QProgressDialog)
+from PyQt6.QtGui import QPixmap, QIcon, QColor, QImage
+from PyQt6.QtCore import QRectF, Qt, QTimer, QThreadPool, QEventLoop
 
 from colorpicker import ColorPicker
 from document import Document
 from tools import Hand, Editor
-from file_logic import SaveDoc, OpenDoc, NotCorrectFolder
+from file_logic import SaveJob, OpenDoc, NotCorrectFolder
+from autosave import Autosave, find_recovery, restore, discard
+from tiles import PRECISIONS
 
 from ui.widgets.bar import MyBar
-from ui.widgets.layer_item import LayerItem
-from ui.widgets.forms import SecondForm, NewLayerForm, SettingsForm, AboutForm
+from ui.widgets.forms import SecondForm, NewLayerForm, SettingsForm, AboutForm, SliceForm
 
 
 class AppWindow(QMainWindow):
@@ -58,6 +57,13 @@ class AppWindow(QMainWindow):
         self.tabWidget.currentChanged.connect(self.on_tab_changed)
         self.tabWidget.tabCloseRequested.connect(self.close_doc)
 
+        # Автосохранение в фоне; несохранённое после сбоя - предложим вернуть
+        self.autosave = Autosave(self.documents, parent=self)
+        self.autosave.failed.connect(
+            lambda doc, error: self.statusBar().showMessage(f"Автосохранение «{doc.name}» не удалось: {error}", 10000))
+        self.saving = {}  # документ -> идущее сохранение (SaveJob)
+        QTimer.singleShot(0, self.offer_recovery)
+
         # кастомный колорпикер 
         self.picker = ColorPicker()
         self.picker.colorChanged.connect(self.set_color_to_active)
@@ -80,6 +86,8 @@ class AppWindow(QMainWindow):
         self.saveAct.triggered.connect(self.save_doc)
         self.openAct.triggered.connect(self.open_doc)
         self.actionExport.triggered.connect(self.export)
+        self.slicesAct.triggered.connect(self.edit_slices)
+        self.exportSlicesAct.triggered.connect(self.export_slices)
         self.addAct.triggered.connect(self.add_image_layer_to_active)
         self.newAct.triggered.connect(self.new_doc)
         self.actionClose.triggered.connect(lambda: self.close_doc(self.listLayers.currentRow()))
@@ -89,6 +97,13 @@ class AppWindow(QMainWindow):
         self.actionAddEmptyLayer.triggered.connect(self.add_empty_layer)
         self.newLayer.triggered.connect(self.add_layer_to_active)
         self.delAct.triggered.connect(self.delete_layer)
+        self.applyTransformAct.triggered.connect(self.bake_layers)
+        self.mergeDownAct.triggered.connect(self.bake_layers)
+        self.flattenAct.triggered.connect(self.bake_layers)
+        self.undoAct.triggered.connect(self.undo)
+        self.redoAct.triggered.connect(self.redo)
+        self.cachedViewAct.toggled.connect(self.set_cached_view)
+        self.rawLayersAct.toggled.connect(self.set_raw_layers)
         self.aboutAct.triggered.connect(self.open_about)
 
         # Инструменты
@@ -113,6 +128,7 @@ class AppWindow(QMainWindow):
 
         # Чтобы выделение слоя не пропадало
         self.listLayers.selectionModel().selectionChanged.connect(self.on_selection_changed)
+        self.listLayers.settingsRequested.connect(self.on_layer_settings)
 
         self.label_3.hide()
         self.brushSize.hide()
@@ -146,11 +162,16 @@ class AppWindow(QMainWindow):
             # Если выделение исчезло - вернуть предыдущее
             self.listLayers.setCurrentRow(0)
         doc = self.get_active_document()
-        if not doc:
+        layer = self.listLayers.current_layer()
+        if not doc or layer is None:
             return
-        layer = doc.get_layer(self.listLayers.currentRow())
-        self.spinBoxOpacity.setValue(int(layer.opacity*100))
+        # Показать свойства слоя, не меняя их (и не записывая в историю)
+        self.spinBoxOpacity.blockSignals(True)
+        self.spinBoxOpacity.setValue(round(layer.opacity*100))
+        self.spinBoxOpacity.blockSignals(False)
+        self.checkBoxLock.blockSignals(True)
         self.checkBoxLock.setChecked(layer.locked)
+        self.checkBoxLock.blockSignals(False)
         doc.active_layer = layer
 
     def resizeEvent(self, event):
@@ -169,7 +190,11 @@ class AppWindow(QMainWindow):
 
     def closeEvent(self, event):
         """если закрыл окно и не сохранил"""
+        # Начатые сохранения дописываются до выхода
+        for doc in list(self.saving):
+            self.wait_save(doc)
         if not self.documents:
+            self.autosave.stop()
             event.accept()
             return
 
@@ -188,13 +213,16 @@ class AppWindow(QMainWindow):
             button = dlg.exec()
 
             if button == QMessageBox.StandardButton.Save:
-                self.save_doc(self.documents[i])
+                if not self.save_doc(self.documents[i], wait=True):
+                    event.ignore()
+                    return
             elif button == QMessageBox.StandardButton.Cancel:
                 event.ignore()
                 return
 
-            self.documents.pop(i)
+            self.autosave.forget(self.documents.pop(i), closed=True)
             self.tabWidget.removeTab(i)
+        self.autosave.stop()
         event.accept()
 
     def open_about(self):
@@ -210,13 +238,17 @@ class AppWindow(QMainWindow):
         button = dlg.exec()
 
         if button == QMessageBox.StandardButton.Save:
-            self.save_doc(self.documents[index])
+            if not self.save_doc(self.documents[index], wait=True):
+                return
         elif button == QMessageBox.StandardButton.Close:
             return
         
-        self.documents.pop(index)
+        self.documents[index].strokes.stop()
+        if self.documents[index].loader is not None:
+            self.documents[index].loader.stop()
+        self.autosave.forget(self.documents.pop(index), closed=True)
         self.tabWidget.removeTab(index)
-        self.listLayers.clear()
+        self.listLayers.set_document(self.get_active_document())
 
     def open_doc(self):
         filename, _ = QFileDialog.getOpenFileName(self, "Выбрать проект", "", "PhotoLite (*.pld)")
@@ -242,12 +274,9 @@ class AppWindow(QMainWindow):
                 if button == QMessageBox.StandardButton.No:
                     return
             
-            self.documents.append(doc)
-            self.tabWidget.addTab(doc, doc.name)
-            self.tabWidget.setCurrentWidget(doc)
-            self.picker.setRGB(doc.color.getRgb()[:-1])
-            self.update_layer_list(doc)
             doc.filepath = filename
+            self.add_document_tab(doc)
+            self.autosave.forget(doc)
         except Exception:
             dlg = QMessageBox(self)
             dlg.setWindowTitle("Ошибка")
@@ -277,34 +306,97 @@ class AppWindow(QMainWindow):
                 data["height"]
             )
             doc = self.get_active_document()
+            doc.precision = data["precision"]
             doc.add_solid_layer("Bg", locked=True, color=bg_color)
+            doc.history.clear()
             self.update_layer_list(doc)
             self.listLayers.setCurrentRow(0)
 
-    def save_doc(self, doc=None):
-        doc = self.get_active_document()
-        if doc and doc.filepath:
+    def save_doc(self, doc=None, wait=False):
+        """
+        Сохраняет документ в фоне: пишется снимок слоёв, рисовать можно
+        сразу. Прогресс - по записанным слоям, отмена оставляет прежний
+        файл как был. wait=True - дождаться конца (закрытие документа),
+        возвращает, сохранён ли документ.
+        """
+        doc = doc or self.get_active_document()
+        if not doc:
+            return False
+        if doc in self.saving:  # уже сохраняется
+            return self.wait_save(doc) if wait else False
+        if doc.filepath:
             dirname = doc.filepath
         else:
             dirname, _ = QFileDialog.getSaveFileName(self, "Save as", ".", "PhotoLite (*.pld)")
             if not dirname:
-                return
-            doc.filepath = dirname
+                return False
 
-        dlg = QProgressDialog("Сохранение...", None, 0, 100, self)
+        job = SaveJob(doc, dirname)
+        changes = doc.changes
+        dlg = QProgressDialog(f"Сохранение «{doc.name}»...", "Отмена", 0, 1000, self)
         dlg.setWindowTitle("PhotoLite")
-        dlg.setCancelButton(None)
-        dlg.setWindowModality(Qt.WindowModality.ApplicationModal)
-        dlg.show()
-        dlg.setValue(randint(21, 37)) # Случайный прогресс. По-моему забавно :)
+        dlg.setWindowModality(Qt.WindowModality.NonModal)
+        dlg.setMinimumDuration(500)
+        dlg.setAutoReset(False)
+        dlg.setValue(0)
+        dlg.canceled.connect(job.cancel)
 
-        QApplication.processEvents()
+        def progress(done, total):
+            dlg.setValue(1000 * done // total if total else 1000)
 
-        SaveDoc(doc, dirname)
-        doc.modified = datetime.now().timestamp()
+        def finished(_):
+            doc.filepath = dirname
+            doc.modified = datetime.now().timestamp()
+            self.autosave.forget(doc, changes=changes)
+            self.statusBar().showMessage(f"Сохранено: {dirname}", 5000)
+
+        def failed(error):
+            box = QMessageBox(self)
+            box.setWindowTitle("Ошибка")
+            box.setText(f"PhotoLite не удалось сохранить «{doc.name}»: {error}\nПрежний файл не изменён.")
+            box.setStandardButtons(QMessageBox.StandardButton.Ok)
+            box.setIcon(QMessageBox.Icon.Critical)
+            box.exec()
+
+        def done():
+            self.saving.pop(doc, None)
+            dlg.close()
+
+        for signal in (job.signals.finished, job.signals.failed, job.signals.cancelled):
+            signal.connect(done)
+        job.signals.progress.connect(progress)
+        job.signals.finished.connect(finished)
+        job.signals.failed.connect(failed)
+        job.signals.cancelled.connect(lambda: self.statusBar().showMessage("Сохранение отменено", 5000))
+
+        self.saving[doc] = job
+        QThreadPool.globalInstance().start(job)
+        return self.wait_save(doc) if wait else True
+
+    def wait_save(self, doc):
+        """Ждёт конца сохранения документа (окно при этом отвечает), True - сохранён"""
+        job = self.saving[doc]
+        loop = QEventLoop()
+        for signal in (job.signals.finished, job.signals.failed, job.signals.cancelled):
+            signal.connect(loop.quit)
+        if doc in self.saving:
+            loop.exec()
+        return job.result is not None
+
+    def undo(self):
+        doc = self.get_active_document()
+        # Пока штрих дорисовывается в фоне, история ещё не полная
+        if not doc or not doc.strokes.idle():
+            return
+        if doc.history.undo():
+            self.update_layer_list(doc)
 
-        dlg.setValue(100)
-        dlg.close()
+    def redo(self):
+        doc = self.get_active_document()
+        if not doc or not doc.strokes.idle():
+            return
+        if doc.history.redo():
+            self.update_layer_list(doc)
 
     def export(self):
         doc = self.get_active_document()
@@ -315,6 +407,43 @@ class AppWindow(QMainWindow):
             return
         doc.export_area(filename, QRectF(0, 0, doc.width, doc.height))
 
+    def edit_slices(self):
+        doc = self.get_active_document()
+        if not doc:
+            return
+        dialog = SliceForm(self, doc.slices, doc.width, doc.height)
+        if dialog.exec() == QDialog.DialogCode.Accepted:
+            doc.slices = dialog.get_values()
+            doc.changes += 1
+
+    def export_slices(self):
+        doc = self.get_active_document()
+        if not doc:
+            return
+        if not doc.slices:
+            dlg = QMessageBox(self)
+            dlg.setWindowTitle("Экспорт срезов")
+            dlg.setText("В документе нет срезов. Добавьте их в «Файл - Срезы...».")
+            dlg.setStandardButtons(QMessageBox.StandardButton.Ok)
+            dlg.exec()
+            return
+        folder = QFileDialog.getExistingDirectory(self, "Export slices to", ".")
+        if not folder:
+            return
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            paths = doc.export_slices(folder)
+        except OSError as e:
+            QApplication.restoreOverrideCursor()
+            dlg = QMessageBox(self)
+            dlg.setWindowTitle("Ошибка")
+            dlg.setText(f"PhotoLite не удалось экспортировать срезы: {e}")
+            dlg.setStandardButtons(QMessageBox.StandardButton.Ok)
+            dlg.exec()
+            return
+        QApplication.restoreOverrideCursor()
+        self.statusBar().showMessage(f"Экспортировано срезов: {len(paths)}", 5000)
+
     def change_brush(self, value):
         doc = self.get_active_document()
         if not doc:
@@ -352,11 +481,60 @@ class AppWindow(QMainWindow):
     def add_new_document(self, name, w, h):
         """Создает и добавляет новый документ как вкладку."""
         doc = Document(name, w, h)
+        self.add_document_tab(doc)
+        self.autosave.forget(doc)
+
+    def add_document_tab(self, doc):
+        """Показывает документ в новой вкладке и делает его активным"""
         self.documents.append(doc)
-        self.tabWidget.addTab(doc, name)
+        doc.colorPicked.connect(self.on_color_picked)
+        doc.view.set_cached(self.cachedViewAct.isChecked())
+        self.tabWidget.addTab(doc, doc.name)
         self.tabWidget.setCurrentWidget(doc)
         self.picker.setRGB(doc.color.getRgb()[:-1])
         self.update_layer_list(doc)
+        if doc.loader is not None:
+            doc.loader.failed.connect(self.on_layer_failed)
+        for layer in doc.layers._layers:
+            if getattr(layer, "load_error", None):  # не прочитались ещё до вкладки
+                self.on_layer_failed(layer, layer.load_error)
+
+    def on_layer_failed(self, layer, error):
+        """Пиксели слоя не прочитались из файла проекта - слой остался пустым"""
+        self.statusBar().showMessage(f"Слой «{layer.name}» не прочитан из файла: {error}", 10000)
+
+    def offer_recovery(self):
+        """Предлагает восстановить документы, не сохранённые до сбоя"""
+        found = find_recovery()
+        if not found:
+            return
+        names = "\n".join(f"«{info['name']}» - {datetime.fromtimestamp(info['saved']).strftime('%Y-%m-%d %H:%M:%S')}"
+                          for _, info in found)
+        dlg = QMessageBox(self)
+        dlg.setWindowTitle("Восстановление")
+        dlg.setText(f"PhotoLite был закрыт аварийно. Восстановить несохранённые документы?\n\n{names}")
+        dlg.setStandardButtons(
+            QMessageBox.StandardButton.Yes |
+            QMessageBox.StandardButton.Discard |
+            QMessageBox.StandardButton.Cancel
+        )
+        dlg.setIcon(QMessageBox.Icon.Question)
+        button = dlg.exec()
+
+        if button == QMessageBox.StandardButton.Discard:
+            for path, _ in found:
+                discard(path)
+        elif button == QMessageBox.StandardButton.Yes:
+            for path, info in found:
+                try:
+                    self.add_document_tab(restore(path, info))
+                except Exception:
+                    dlg = QMessageBox(self)
+                    dlg.setWindowTitle("Ошибка")
+                    dlg.setText(f"PhotoLite не удалось восстановить «{info['name']}», так как файл поврежден.")
+                    dlg.setStandardButtons(QMessageBox.StandardButton.Ok)
+                    dlg.setIcon(QMessageBox.Icon.Critical)
+                    dlg.exec()
 
     def set_color_to_active(self):
         doc = self.get_active_document()
@@ -364,6 +542,20 @@ class AppWindow(QMainWindow):
             return
         doc.color = QColor(*list(map(int, self.picker.getRGB())))
 
+    def set_raw_layers(self, enabled):
+        """Как активный документ хранит пиксели слоёв: тайлы без сжатия или PNG"""
+        doc = self.get_active_document()
+        if doc:
+            doc.layer_encoding = "raw" if enabled else "png"
+
+    def set_cached_view(self, enabled):
+        """Кэширующий режим холста - для всех открытых документов"""
+        for doc in self.documents:
+            doc.view.set_cached(enabled)
+
+    def on_color_picked(self, color):
+        self.picker.setRGB(color.getRgb()[:-1])
+
     def add_empty_layer(self):
         doc = self.get_active_document()
         if not doc:
@@ -406,8 +598,11 @@ class AppWindow(QMainWindow):
             elif data["background"] == "Black":
                 bg_color = Qt.GlobalColor.black
 
-            pixmap = QPixmap(doc.width, doc.height)
-            pixmap.fill(bg_color)
+            # Прозрачный слой не занимает памяти, пока в нём не рисуют
+            pixmap = None
+            if bg_color != Qt.GlobalColor.transparent:
+                pixmap = QImage(doc.width, doc.height, PRECISIONS[doc.precision])
+                pixmap.fill(bg_color)
             doc.add_pixmap_layer(data["name"], pixmap)
             layer = doc.get_layer(0)
             layer.set_opacity(data["opacity"] / 100)
@@ -427,7 +622,7 @@ class AppWindow(QMainWindow):
         if not filename:
             return
         
-        pixmap = QPixmap(filename)
+        pixmap = QImage(filename)  # сразу QImage, без лишней конвертации через QPixmap
         if not doc:
             self.add_new_document(filename.split('/')[-1], pixmap.width(), pixmap.height())
         doc = self.get_active_document()
@@ -444,81 +639,44 @@ class AppWindow(QMainWindow):
 
         if result == QDialog.DialogCode.Accepted:
             data = dialog.get_values()
-            if data["name"]:
-                layer.set_name(data["name"])
-            layer.set_opacity((data["opacity"]+1)/100)
-            layer.set_visible(data["visible"])
-            layer.set_locked(data["locked"])
-            layer.set_scale(data["scale"]/100)
-            
-            try:
-                if data["text"]:
-                    layer.set_text(data["text"])
-                if data["font"]:
-                    layer.set_font(data["font"])
-                layer.set_color(data["color"])
-            except KeyError:
-                pass
+            # Всё, что поменяли в диалоге, отменяется одним шагом
+            with doc.history.macro():
+                if data["name"]:
+                    layer.set_name(data["name"])
+                layer.set_opacity((data["opacity"]+1)/100)
+                layer.set_visible(data["visible"])
+                layer.set_locked(data["locked"])
+                layer.set_scale(data["scale"]/100)
+                layer.set_blend_mode(data["blend_mode"])
+                if "precision" in data:
+                    layer.set_precision(data["precision"])
+
+                try:
+                    if data["text"]:
+                        layer.set_text(data["text"])
+                    if data["font"]:
+                        layer.set_font(data["font"])
+                    layer.set_color(data["color"])
+                except KeyError:
+                    pass
 
         self.update_layer_list(doc)
 
 
-    def update_layer_list(self, doc, direction=0):
-        """Обновляет список слоев (listLayers) в интерфейсе для конкретного документа."""
-        current = self.listLayers.currentRow()
-        self.listLayers.clear()
-        for layer in doc.layers._layers[::-1]:
-            if layer is doc.bg_layer:
-                continue
-            item = QListWidgetItem()
-            widget = LayerItem(layer.name, layer.visible, layer.locked)
-            item.setSizeHint(widget.sizeHint())
-            self.listLayers.addItem(item)
-            self.listLayers.setItemWidget(item, widget)
-            if hasattr(widget, "lock"):
-                widget.lock.setPixmap(QPixmap("ui\\icons\\lock.svg").scaledToHeight(13))
-            preview = layer.get_preview(QSize(32, 32))
-            widget.icon = QLabel()
-            widget.icon.setPixmap(preview)
-            widget.layout.insertWidget(1, widget.icon)
-            widget.toggled.connect(self.on_layer_toggled)
-            widget.nameChanged.connect(self.on_layer_renamed)
-            widget.settingsOpened.connect(self.on_layer_settings)
-
-        if current != -1 and current < self.listLayers.count():
-            self.listLayers.setCurrentRow(current+(direction*2)-1)
-        elif self.listLayers.count() > 0:
+    def update_layer_list(self, doc):
+        """Показывает в панели слоёв слои документа (строки рисует модель)"""
+        self.listLayers.set_document(doc)
+        layers = self.listLayers.model().layers
+        active = getattr(doc, "active_layer", None)
+        if active in layers:
+            self.listLayers.setCurrentRow(layers.index(active))
+        elif self.listLayers.currentRow() == -1 and layers:
             self.listLayers.setCurrentRow(0)
 
         self.textBrowser.setHtml(get_doc_html(doc))
 
-    def on_layer_toggled(self, widget, visible):
-        # находим элемент списка, которому принадлежит этот widget...
-        for i in range(self.listLayers.count()):
-            if self.listLayers.itemWidget(self.listLayers.item(i)) == widget:
-                self.listLayers.setCurrentRow(i)  # ...и выделяем его
-                break
-
-        # и теперь можно обновить видимость слоя
-        doc = self.get_active_document()
-        if not doc:
-            return
-        layer = doc.get_layer(self.listLayers.currentRow())
-        if layer.name != "Background":
-            layer.set_visible(visible)
-        else:
-            widget.checkbox.setChecked(True)
-
-    def on_layer_renamed(self, widget, new_name):
-        doc = self.get_active_document()
-        if not doc:
-            return
-        layer = doc.get_layer(self.listLayers.currentRow())
-        if layer.name != "Background":
-            layer.set_name(new_name)
-            self.update_layer_list(doc)
-
-    def on_layer_settings(self, widget):
+    def on_layer_settings(self, row):
+        self.listLayers.setCurrentRow(row)
         self.open_layer_settings()
 
     def opacity_layer(self, value):
@@ -529,10 +687,6 @@ class AppWindow(QMainWindow):
         layer = doc.get_layer(current)
         if layer.name != "Background":
             layer.set_opacity(value/100)
-        item = self.listLayers.item(current)
-        widget = self.listLayers.itemWidget(item)
-        preview = layer.get_preview(QSize(32, 32))
-        widget.icon.setPixmap(preview)
 
     def lock_layer(self, state):
         doc = self.get_active_document()
@@ -541,15 +695,6 @@ class AppWindow(QMainWindow):
         current = self.listLayers.currentRow()
         layer = doc.get_layer(current)
         layer.set_locked(state)
-            # обновляем только нужный item
-        item = self.listLayers.item(current)
-        widget = self.listLayers.itemWidget(item)
-        if state:
-            widget.lock.show()
-            widget.label.setStyleSheet("background: none; font-style: italic;")
-        else:
-            widget.lock.hide()
-            widget.label.setStyleSheet("background: none; font-style: normal;")
 
     def replace_layer(self):
         try:
@@ -558,7 +703,7 @@ class AppWindow(QMainWindow):
                 return
             direction = self.sender().text() == "Up"
             doc.move_layer(self.listLayers.currentRow(), direction)
-            self.update_layer_list(doc, 1-direction)
+            self.update_layer_list(doc)
         except IndexError:
             dlg = QMessageBox(self)
             dlg.setWindowTitle("Layer not selected!")
@@ -579,11 +724,30 @@ class AppWindow(QMainWindow):
             dlg.setText("Please select a layer first.")
             dlg.exec()
 
+    def bake_layers(self):
+        """Применить трансформацию / объединить с нижним / свести"""
+        doc = self.get_active_document()
+        if not doc or not doc.strokes.idle():
+            return
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        if self.sender() is self.applyTransformAct:
+            layer = doc.apply_transform()
+        elif self.sender() is self.mergeDownAct:
+            layer = doc.merge_down()
+        else:
+            layer = doc.flatten()
+        QApplication.restoreOverrideCursor()
+        if layer is not None:
+            self.update_layer_list(doc)
+
     def on_tab_changed(self, index):
         """Переключение вкладки - обновляем список слоев под новый документ."""
         doc = self.get_active_document()
         if doc:
             self.update_layer_list(doc)
+            self.rawLayersAct.blockSignals(True)
+            self.rawLayersAct.setChecked(doc.layer_encoding != "png")
+            self.rawLayersAct.blockSignals(False)
         
     def easter(self):
         self.easter_counter += 1
@@ -0,0 +1,184 @@
+"""
+Автосохранение и восстановление после сбоя.
+Раз в AUTOSAVE_INTERVAL изменившиеся документы пишутся в файлы
+восстановления. В GUI-потоке берётся только снимок (file_logic.DocSnapshot,
+тайлы - общие копии), сам файл пишет фоновый поток, так что рисование
+не останавливается даже на больших документах. Рядом с файлом лежит
+описание: чей он, от какого процесса. Файлы процесса, который уже не
+работает, при следующем запуске предлагается восстановить, а брошенные
+им недописанные временные файлы - удаляются.
+"""
+
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal
+
+from file_logic import DocSnapshot, SaveDoc, OpenDoc
+
+AUTOSAVE_INTERVAL = 2 * 60 * 1000  # мс
+RECOVERY_DIR = os.path.join(os.path.expanduser("~"), ".photolite", "recovery")
+# Файл восстановления - для скорости: тайлы, сжатые zlib на самом быстром уровне
+AUTOSAVE_ENCODING = "zlib"
+AUTOSAVE_COMPRESSION = 1
+
+
+def process_started(pid=None) -> float:
+    """Время запуска процесса (вместе с pid отличает его от процесса с тем же pid)"""
+    try:
+        return psutil.Process(pid).create_time()
+    except psutil.Error:
+        return 0.0
+
+
+class Autosave(QObject):
+    """Пишет файлы восстановления открытых документов в фоновом потоке"""
+    finished = pyqtSignal(object, object, int)  # документ, SaveDoc (None - ошибка), счётчик правок
+    failed = pyqtSignal(object, str)  # документ, ошибка записи
+
+    def __init__(self, documents, folder=RECOVERY_DIR, interval=AUTOSAVE_INTERVAL, parent=None):
+        super().__init__(parent)
+        self.documents = documents  # список открытых документов (общий с окном)
+        self.folder = folder
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.written = {}  # документ -> счётчик правок, который уже записан
+        self.busy = set()  # документы, чей файл сейчас пишется
+        self.closed = set()  # закрыты во время записи - файл удалить по её окончании
+        self.finished.connect(self.on_finished)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.tick)
+        self.timer.start()
+
+    def path(self, doc):
+        return os.path.join(self.folder, f"{os.getpid()}-{id(doc)}.pld")
+
+    def tick(self):
+        for doc in self.documents:
+            if doc in self.busy or self.written.get(doc) == doc.changes:
+                continue
+            # В GUI-потоке - только снимок, дальше всё в фоне
+            snapshot = DocSnapshot(doc, AUTOSAVE_ENCODING, sources=("autosaved", "saved"))
+            info = {
+                "name": doc.name,
+                "filepath": doc.filepath,
+                "saved": time.time(),
+                "pid": os.getpid(),
+                "started": process_started(),
+            }
+            self.busy.add(doc)
+            self.pool.submit(self.write, doc, snapshot, doc.changes, info)
+
+    def write(self, doc, snapshot, changes, info):
+        """Фоновый поток: файл восстановления и его описание"""
+        path = self.path(doc)
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            # Один поток кодирования - ядра остаются кисти
+            job = SaveDoc(snapshot, path, AUTOSAVE_COMPRESSION, workers=1)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(info, f)
+            os.replace(path + ".tmp", os.path.splitext(path)[0] + ".json")
+        except Exception as e:
+            self.failed.emit(doc, str(e))
+            job = None
+        self.finished.emit(doc, job, changes)
+
+    def on_finished(self, doc, job, changes):
+        self.busy.discard(doc)
+        if doc in self.closed:
+            self.closed.discard(doc)
+            self.remove(doc)
+            return
+        if job is not None:
+            job.apply("autosaved")
+            self.written[doc] = changes
+
+    def forget(self, doc, closed=False, changes=None):
+        """
+        Документ сохранён или закрыт: файл восстановления больше не нужен.
+        Следующий раз он пишется только после новых правок.
+        changes - счётчик правок, с которым документ сохранён (по умолчанию текущий).
+        """
+        if closed:
+            self.written.pop(doc, None)
+            if doc in self.busy:
+                self.closed.add(doc)
+                return
+        else:
+            self.written[doc] = doc.changes if changes is None else changes
+        self.remove(doc)
+
+    def remove(self, doc):
+        discard(self.path(doc))
+
+    def stop(self):
+        """Выход из программы: дописать начатое и убрать файлы этого сеанса"""
+        self.timer.stop()
+        self.pool.shutdown(wait=True)
+        prefix = f"{os.getpid()}-"
+        if os.path.isdir(self.folder):
+            for name in os.listdir(self.folder):
+                if name.startswith((prefix, ".~" + prefix)):
+                    os.remove(os.path.join(self.folder, name))
+
+
+def find_recovery(folder=RECOVERY_DIR):
+    """
+    Файлы восстановления завершившихся процессов: [(путь .pld, описание)].
+    Недописанные временные файлы этих процессов (.~<pid>-*.pld, *.tmp)
+    удаляются - восстанавливать из них нечего.
+    """
+    found = []
+    if not os.path.isdir(folder):
+        return found
+    for name in os.listdir(folder):
+        if not (name.startswith(".~") or name.endswith(".tmp")):
+            continue
+        pid = name.removeprefix(".~").split("-", 1)[0]
+        if pid.isdigit() and not psutil.pid_exists(int(pid)):
+            try:
+                os.remove(os.path.join(folder, name))
+            except OSError:
+                pass
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(folder, name[:-5] + ".pld")
+        try:
+            with open(os.path.join(folder, name), encoding="utf-8") as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            continue
+        alive = psutil.pid_exists(info["pid"]) and abs(process_started(info["pid"]) - info["started"]) < 1
+        if not alive and os.path.exists(path):
+            found.append((path, info))
+    return found
+
+
+def restore(path, info):
+    """
+    Открывает файл восстановления как новый несохранённый документ и
+    удаляет его: пиксели всех слоёв читаются сразу, в памяти.
+    Путь исходного файла не восстанавливается - первое сохранение идёт
+    через «Сохранить как» и не затирает файл без спроса.
+    """
+    doc, _ = OpenDoc(path).get_opened_document()
+    for layer in doc.layers._layers:
+        if layer.type == "Image":
+            layer.load()
+            layer.saved = None
+    doc.changes += 1  # документ изменён относительно сохранённого на диске
+    discard(path)
+    return doc
+
+
+def discard(path):
+    """Удаляет файл восстановления и его описание"""
+    for name in (path, os.path.splitext(path)[0] + ".json"):
+        if os.path.exists(name):
+            os.remove(name)
@@ -0,0 +1,81 @@
+"""
+Запекание слоёв: применить трансформацию, объединить с нижним, свести.
+Слои один раз пересэмплируются в новый Image-слой без трансформации -
+дальше ни отрисовка, ни открытие проекта не платят за масштаб и сдвиг.
+Тайлы результата сводятся параллельно, каждый в своём потоке.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt6.QtGui import QImage, QPainter
+from PyQt6.QtCore import Qt, QRectF
+
+from tiles import TileSurface, PRECISIONS, is_blank
+from composite import render_layers
+from blend import render_state
+from layer import Image
+
+
+def bake_tiles(surface: TileSurface, layers, keep_first=False, workers=None):
+    """
+    Сводит layers (снизу вверх) в тайлы surface, координаты сцены = слоя.
+    keep_first=True - первый слой кладётся как есть, без своей прозрачности
+    и режима наложения (их унаследует результат).
+    """
+    bounds = QRectF()
+    for layer in layers:
+        if layer.visible or (keep_first and layer is layers[0]):
+            bounds = bounds.united(layer.group.sceneBoundingRect())
+    base, rest = (layers[0], layers[1:]) if keep_first else (None, layers)
+    # Трансформации, прозрачность и режимы - здесь, в GUI-потоке: потоки
+    # пула QGraphicsItem не трогают, только тайлы слоёв
+    base_transform = render_state(base)[3] if base is not None else None
+    states = [render_state(layer) for layer in rest]
+
+    def render(key):
+        rect = surface.tile_rect(key)
+        tile = QImage(rect.width(), rect.height(), surface.format)
+        tile.fill(Qt.GlobalColor.transparent)
+        if base is not None:
+            painter = QPainter(tile)
+            painter.translate(-rect.x(), -rect.y())
+            painter.setClipRect(rect)
+            if base_transform is None:
+                base.render(painter, QRectF(rect))
+            else:
+                base.render(painter, QRectF(rect), transform=base_transform)
+            painter.end()
+        render_layers(tile, rect, rest, rect.topLeft(), states)
+        return key, None if is_blank(tile) else tile
+
+    # Текст и заливки рисуются элементами сцены - только в GUI-потоке
+    parallel = all(layer.type == "Image" for layer in layers)
+    keys = surface.keys_in_rect(bounds)
+    if parallel and len(keys) > 1:
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            results = list(pool.map(render, keys))
+    else:
+        results = [render(key) for key in keys]
+    surface.tiles.update((key, tile) for key, tile in results if tile is not None)
+
+
+def bake_layers(doc, layers, name, keep_first=False) -> Image:
+    """
+    Новый Image-слой размером с холст из layers, без трансформации.
+    Точность - наибольшая из Image-слоёв (иначе - точность документа).
+    """
+    for layer in layers:
+        if layer.type == "Image":
+            layer.load()
+    precision = max((layer.precision for layer in layers if layer.type == "Image"), default=doc.precision)
+    result = Image(name, doc.scene, None, doc.width, doc.height, precision=precision)
+    bake_tiles(result.surface, layers, keep_first)
+    if keep_first:
+        # Слой ещё не в документе - сеттеры в историю не пишут
+        first = layers[0]
+        result.set_visible(first.visible)
+        result.set_opacity(first.opacity)
+        result.set_blend_mode(first.blend_mode)
+    result.set_locked(False)
+    return result
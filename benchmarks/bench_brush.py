@@ -0,0 +1,194 @@
+"""
+Бенчмарк движка кисти без окна (QT_QPA_PLATFORM=offscreen).
+
+Строит Document заданного размера и прогоняет штрихи через Image.draw_line
+для всех сочетаний ширины, жёсткости и режима ластика. Считает мазки в
+секунду, перцентили задержки на событие мыши и пиковую память, результат
+пишет в JSON, чтобы сравнивать сборки.
+
+    python benchmarks/bench_brush.py --size 4000x3000 --out before.json
+    python benchmarks/bench_brush.py --replay strokes.json --widths 10,80
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import platform
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # ui/ и иконки ищутся относительно корня
+
+import psutil
+from PyQt6.QtWidgets import QApplication
+from PyQt6.QtGui import QColor
+from PyQt6.QtCore import QPointF, QT_VERSION_STR, PYQT_VERSION_STR
+
+from brush import stroke_dabs
+from tiles import np
+
+
+def synthetic_strokes(count, width, height, events=120, seed=0):
+    """Случайные плавные штрихи: шаг между событиями мыши 2..40 px"""
+    rnd = random.Random(seed)
+    strokes = []
+    for _ in range(count):
+        x, y = rnd.uniform(0, width), rnd.uniform(0, height)
+        angle = rnd.uniform(0, 6.283)
+        speed = rnd.uniform(2, 40)
+        points = [(x, y)]
+        for _ in range(events):
+            angle += rnd.uniform(-0.3, 0.3)
+            speed = min(40.0, max(2.0, speed + rnd.uniform(-3, 3)))
+            x = min(width - 1, max(0.0, x + speed * math.cos(angle)))
+            y = min(height - 1, max(0.0, y + speed * math.sin(angle)))
+            points.append((x, y))
+        strokes.append(points)
+    return strokes
+
+
+def load_strokes(path):
+    """Записанные штрихи: {"strokes": [[[x, y], ...], ...]}"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return [[tuple(p) for p in stroke] for stroke in data["strokes"]]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * q / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def run_case(doc, strokes, width, hardness, erase, wet, process):
+    """Один прогон: новый слой, все штрихи, замеры на каждое событие"""
+    doc.add_layer(f"bench {width}/{hardness}/{erase}")
+    layer = doc.active_layer
+    color = QColor(30, 120, 220)
+
+    if erase:
+        # Ластику нужно что стирать: сначала закрашиваем те же места
+        for stroke in strokes:
+            for p1, p2 in zip(stroke, stroke[1:]):
+                layer.draw_line(QPointF(*p1), QPointF(*p2), color, width=width, hardness=hardness)
+
+    latencies = []
+    dabs = 0
+    peak = process.memory_info().rss
+    started = time.perf_counter()
+    for stroke in strokes:
+        if wet:
+            layer.begin_stroke()
+        carry = None
+        for p1, p2 in zip(stroke, stroke[1:]):
+            t0 = time.perf_counter()
+            layer.draw_line(QPointF(*p1), QPointF(*p2), color, width=width, erase=erase, hardness=hardness)
+            latencies.append(time.perf_counter() - t0)
+            placed, carry = stroke_dabs([p1, p2], width, carry)
+            dabs += len(placed)
+        if wet:
+            t0 = time.perf_counter()
+            layer.end_stroke()
+            latencies[-1] += time.perf_counter() - t0
+        peak = max(peak, process.memory_info().rss)
+    total = time.perf_counter() - started
+
+    result = {
+        "width": width,
+        "hardness": hardness,
+        "erase": erase,
+        "wet": wet,
+        "events": len(latencies),
+        "dabs": dabs,
+        "seconds": round(total, 4),
+        "dabs_per_sec": round(dabs / total, 1) if total else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3),
+            "p90": round(percentile(latencies, 90) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+            "max": round(max(latencies) * 1000, 3) if latencies else 0.0,
+        },
+        "peak_rss_mb": round(peak / 2**20, 1),
+        "layer_tiles_mb": round(layer.surface.memory() / 2**20, 1),
+    }
+
+    # Слой больше не нужен - освобождаем память до следующего прогона
+    doc.layers.remove(doc.layers._layers.index(layer))
+    doc.history.clear()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PhotoLite brush benchmark")
+    parser.add_argument("--size", default="4000x3000", help="размер холста, WxH")
+    parser.add_argument("--widths", default="4,20,80", help="радиусы кисти через запятую")
+    parser.add_argument("--hardness", default="0,100", help="жёсткости через запятую")
+    parser.add_argument("--modes", default="paint,erase", help="paint, erase или оба")
+    parser.add_argument("--strokes", type=int, default=20, help="число синтетических штрихов")
+    parser.add_argument("--events", type=int, default=120, help="событий мыши на штрих")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replay", help="JSON с записанными штрихами")
+    parser.add_argument("--direct", action="store_true",
+                        help="рисовать прямо в слой, без буфера штриха")
+    parser.add_argument("--out", help="куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args(argv)
+
+    width, height = map(int, args.size.lower().split("x"))
+    app = QApplication.instance() or QApplication(sys.argv[:1])  # должен жить до конца прогона
+
+    from document import Document  # после QApplication
+    doc = Document("bench", width, height)
+
+    if args.replay:
+        strokes = load_strokes(args.replay)
+    else:
+        strokes = synthetic_strokes(args.strokes, width, height, args.events, args.seed)
+
+    process = psutil.Process()
+    results = []
+    for mode in args.modes.split(","):
+        for brush_width in map(int, args.widths.split(",")):
+            for hardness in map(int, args.hardness.split(",")):
+                result = run_case(doc, strokes, brush_width, hardness, mode == "erase",
+                                  not args.direct, process)
+                results.append(result)
+                print(f"{mode:5} w={brush_width:<4} h={hardness:<3} "
+                      f"{result['dabs_per_sec']:>10.0f} dabs/s  "
+                      f"p50 {result['latency_ms']['p50']:.2f} ms  "
+                      f"p99 {result['latency_ms']['p99']:.2f} ms", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "canvas": [width, height],
+            "strokes": len(strokes),
+            "source": args.replay or f"synthetic(seed={args.seed})",
+            "python": platform.python_version(),
+            "qt": QT_VERSION_STR,
+            "pyqt": PYQT_VERSION_STR,
+            "numpy": np.__version__ if np is not None else None,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=4)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    doc.strokes.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Режимы наложения слоёв.
+Формулы - раздельные режимы W3C Compositing для premultiplied-пикселей,
+те же, что у режимов композиции QPainter, поэтому NumPy-путь и путь
+через QPainter дают одинаковый результат (с точностью до округления).
+"""
+
+from PyQt6.QtGui import QPainter, QImage, QTransform
+from PyQt6.QtCore import QPoint, QRect, QRectF
+
+from tiles import np, image_array, ARRAY_FORMATS, PRECISIONS, TILE_SIZE
+
+_modes = QPainter.CompositionMode
+BLEND_MODES = {
+    "normal": _modes.CompositionMode_SourceOver,
+    "multiply": _modes.CompositionMode_Multiply,
+    "screen": _modes.CompositionMode_Screen,
+    "overlay": _modes.CompositionMode_Overlay,
+    "darken": _modes.CompositionMode_Darken,
+    "lighten": _modes.CompositionMode_Lighten,
+    "add": _modes.CompositionMode_Plus,
+    "difference": _modes.CompositionMode_Difference,
+}
+BLEND_NAMES = {
+    "normal": "Обычный",
+    "multiply": "Умножение",
+    "screen": "Экран",
+    "overlay": "Перекрытие",
+    "darken": "Затемнение",
+    "lighten": "Замена светлым",
+    "add": "Сложение",
+    "difference": "Разница",
+}
+DEFAULT_BLEND = "normal"
+
+
+def blend_arrays(dst, src, mode, opacity=1.0):
+    """
+    Накладывает src на dst в режиме mode с прозрачностью opacity, результат
+    пишется в dst. Массивы float32 (4, h, w): плоскости B, G, R, A,
+    premultiplied, 0..1. Плоский порядок каналов вместо (h, w, 4) держит
+    альфу непрерывной - без этого каждая операция с ней в разы медленнее.
+    """
+    color_d, da = dst[:3], dst[3]
+    if mode == "add":
+        # как у QPainter: насыщение, затем смешивание с исходным по opacity
+        total = np.minimum(dst + src, 1.0)
+        total -= dst
+        total *= opacity
+        dst += total
+        return dst
+
+    if opacity != 1.0:
+        src = src * opacity
+    color_s, sa = src[:3], src[3]
+    inv_sa, inv_da = 1.0 - sa, 1.0 - da
+    if mode == "multiply":
+        color = color_s * color_d
+    elif mode == "screen":
+        color = color_s * da + color_d * sa
+        color -= color_s * color_d
+    elif mode == "overlay":
+        both = sa * da
+        low = color_s * color_d
+        low *= 2.0
+        high = (da - color_d) * (sa - color_s)
+        high *= -2.0
+        high += both
+        color = np.where(2.0 * color_d <= da, low, high)
+    elif mode in ("darken", "lighten", "difference"):
+        one, other = color_s * da, color_d * sa
+        if mode == "darken":
+            color = np.minimum(one, other)
+        elif mode == "lighten":
+            color = np.maximum(one, other)
+        else:
+            color = one + other
+            color -= 2.0 * np.minimum(one, other)
+    else:  # normal
+        color = color_s * da
+    # Общая часть: то, что видно из-под непрозрачных областей друг друга
+    color += color_s * inv_da
+    color_d *= inv_sa
+    color_d += color
+    # альфа: sa + da - sa * da = sa + da * (1 - sa)
+    da *= inv_sa
+    da += sa
+    return dst
+
+
+def to_planes(array, order):
+    """uint-массив (h, w, 4) -> float32 (4, h, w) 0..1 в порядке B, G, R, A"""
+    top = float(np.iinfo(array.dtype).max)
+    planes = array.transpose(2, 0, 1)
+    if order != "BGRA":
+        planes = planes[[order.index(c) for c in "BGRA"]]
+    data = planes.astype(np.float32)
+    data *= 1.0 / top
+    return data
+
+
+def render_state(layer):
+    """
+    Что нужно для сведения слоя: (видимость, прозрачность, режим, трансформация
+    Image-слоя на сцене или None). Читается в GUI-потоке - QGraphicsItem не
+    потокобезопасен, потоки пула получают уже готовые значения.
+    """
+    transform = layer.item.sceneTransform() if layer.type == "Image" else None
+    return layer.visible, layer.opacity, layer.blend_mode, transform
+
+
+def blend_layer(image: QImage, rect: QRect, layer, origin=QPoint(0, 0), state=None) -> bool:
+    """
+    Накладывает Image-слой на image (ARGB32_Premultiplied, левый верхний
+    угол - точка сцены origin) в области сцены rect векторно, прямо из
+    тайлов слоя.
+    Возвращает False, если этот путь не подходит (нет NumPy, слой
+    повёрнут/масштабирован, 8-битный) - тогда рисует QPainter.
+    8-битные тайлы QPainter сводит по тем же формулам SIMD-кодом в разы
+    быстрее; здесь считаются 16-битные - без промежуточного округления
+    до 8 бит, которое делает QPainter перед наложением.
+    state - render_state(layer), прочитанный заранее (вызов не из GUI-потока).
+    """
+    if np is None or layer.type != "Image" or image.format() != QImage.Format.Format_ARGB32_Premultiplied:
+        return False
+    surface = layer.surface
+    if surface.format == PRECISIONS[8]:
+        return False
+    _, opacity, mode, transform = state or render_state(layer)
+    dx, dy = transform.dx(), transform.dy()
+    if (transform.type().value > QTransform.TransformationType.TxTranslate.value or dx != int(dx) or dy != int(dy)
+            or surface.format not in ARRAY_FORMATS):
+        return False
+    dx, dy = int(dx), int(dy)
+
+    _, order = ARRAY_FORMATS[surface.format]
+    view = image_array(image)
+    local = QRectF(rect.translated(-dx, -dy))
+    with surface.lock:
+        for key in surface.keys_in_rect(local):
+            tile = surface.tiles.get(key)
+            if tile is None:
+                continue  # прозрачный слой ни в одном режиме ничего не меняет
+            area = surface.tile_rect(key).translated(dx, dy).intersected(rect)
+            if area.isEmpty():
+                continue
+            ox, oy = area.x() - dx - key[0] * TILE_SIZE, area.y() - dy - key[1] * TILE_SIZE
+            pixels = image_array(tile, readonly=True)[oy:oy + area.height(), ox:ox + area.width()]
+            # Считаем только по рамке непрозрачных пикселей тайла
+            alpha = pixels[..., order.index("A")]
+            rows, cols = np.flatnonzero(alpha.any(axis=1)), np.flatnonzero(alpha.any(axis=0))
+            if not len(rows):
+                continue
+            top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+            src = to_planes(pixels[top:bottom, left:right], order)
+            y, x = area.top() + top - origin.y(), area.left() + left - origin.x()
+            target = view[y:y + bottom - top, x:x + right - left]
+            dst = to_planes(target, "BGRA")
+            blend_arrays(dst, src, mode, opacity)
+            dst *= 255.0
+            np.clip(dst, 0.0, 255.0, out=dst)
+            np.rint(dst, out=dst)
+            target[...] = dst.transpose(1, 2, 0)
+    return True
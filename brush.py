@@ -0,0 +1,214 @@
+"""
+Движок кисти: расстановка мазков, кэш отпечатков и растеризация в тайлы
+"""
+
+import math
+from collections import OrderedDict
+
+from PyQt6.QtGui import QImage, QPainter, QColor, QBrush, QRadialGradient
+from PyQt6.QtCore import Qt, QPointF, QRectF
+
+from tiles import np, image_array, ARRAY_FORMATS
+
+# Шаг между мазками - доля диаметра кисти
+SPACING = 0.25
+# Сколько float32 можно держать в памяти за один векторный проход
+NUMPY_CHUNK = 4_000_000
+
+
+class DabCache:
+    """
+    LRU-кэш заранее отрисованных отпечатков кисти.
+    Ключ - (ширина, жёсткость, цвет, ластик), значение - premultiplied QImage,
+    который при рисовании просто копируется на слой для каждого мазка.
+    """
+    def __init__(self, max_items=32):
+        self.max_items = max_items
+        self._dabs = OrderedDict()
+
+    def get(self, width, hardness, color: QColor, erase=False) -> QImage:
+        # Для ластика важна только альфа, цвет в ключ не входит
+        rgba = (0, 0, 0, color.alpha()) if erase else color.getRgb()
+        key = (width, hardness, rgba, erase)
+
+        dab = self._dabs.get(key)
+        if dab is not None:
+            self._dabs.move_to_end(key)
+            return dab
+
+        dab = self.render(width, hardness, QColor(*rgba))
+        self._dabs[key] = dab
+        if len(self._dabs) > self.max_items:
+            self._dabs.popitem(last=False)
+        return dab
+
+    def clear(self):
+        self._dabs.clear()
+
+    @staticmethod
+    def render(width, hardness, color: QColor) -> QImage:
+        """Растеризует круглый отпечаток радиусом width с мягким краем"""
+        h = hardness / 100.0
+        a0 = color.alpha()
+        a1 = int(a0 * h)  # альфа на краю
+
+        gradient = QRadialGradient(width, width, width)
+        gradient.setColorAt(0.0, QColor(color.red(), color.green(), color.blue(), a0))
+        gradient.setColorAt(h,   QColor(color.red(), color.green(), color.blue(), a0))
+        gradient.setColorAt(1.0, QColor(color.red(), color.green(), color.blue(), a1))
+
+        dab = QImage(width * 2, width * 2, QImage.Format.Format_ARGB32_Premultiplied)
+        dab.fill(Qt.GlobalColor.transparent)
+
+        painter = QPainter(dab)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(QBrush(gradient))
+        painter.drawEllipse(0, 0, width * 2, width * 2)
+        painter.end()
+        return dab
+
+
+# Общий кэш на всё приложение: отпечатки не зависят от слоя
+dab_cache = DabCache()
+
+
+def stroke_dabs(points, width, carry=None, spacing=SPACING):
+    """
+    Расставляет центры мазков вдоль ломаной points с шагом spacing * диаметр.
+    carry - путь, пройденный после последнего мазка предыдущего вызова
+    (None - начало штриха, мазок ставится в первую точку).
+    Возвращает (список (x, y), новый carry).
+    """
+    step = max(1.0, 2 * width * spacing)
+    dabs = []
+    if carry is None:
+        dabs.append((points[0][0], points[0][1]))
+        carry = 0.0
+
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        dist = math.hypot(x1 - x0, y1 - y0)
+        if dist == 0:
+            continue
+        # первый мазок сегмента - там, где набирается полный шаг
+        offset = step - carry
+        count = int((dist - offset) // step) + 1 if dist >= offset else 0
+        for i in range(count):
+            t = (offset + i * step) / dist
+            dabs.append((x0 + (x1 - x0) * t, y0 + (y1 - y0) * t))
+        carry = dist - (offset + (count - 1) * step) if count else carry + dist
+    return dabs, carry
+
+
+def dabs_bounds(dabs, width) -> QRectF:
+    """Общий bounding box мазков (+1px на сглаживание края)"""
+    xs = [x for x, _ in dabs]
+    ys = [y for _, y in dabs]
+    return QRectF(min(xs) - width - 1, min(ys) - width - 1,
+                  max(xs) - min(xs) + width * 2 + 2, max(ys) - min(ys) + width * 2 + 2)
+
+
+def paint_dabs(surface, dabs, width, hardness, color: QColor, erase=False, wet=False):
+    """
+    Рисует мазки (центры в координатах слоя) в тайлы поверхности.
+    wet=True - рисование в буфер штриха: мазки не накладываются друг на
+    друга, а берётся максимум альфы.
+    Возвращает ключи затронутых тайлов.
+    """
+    if not dabs:
+        return []
+    keys = surface.keys_in_rect(dabs_bounds(dabs, width))
+    use_numpy = np is not None and surface.format in ARRAY_FORMATS
+    if not use_numpy:
+        dab = dab_cache.get(width, hardness, color, erase)
+
+    touched = []
+    for key in keys:
+        # Замок берём на один тайл, чтобы GUI мог рисовать остальные
+        with surface.lock:
+            # Ластик новых тайлов не создаёт
+            tile = surface.tile(key, create=not erase)
+            if tile is None:
+                continue
+            origin = surface.tile_rect(key).topLeft()
+            if use_numpy:
+                _composite_numpy(tile, origin.x(), origin.y(), dabs, width, hardness, color, erase, wet)
+            else:
+                _composite_qt(tile, origin.x(), origin.y(), dabs, width, dab, erase, wet)
+        touched.append(key)
+    surface.touch(touched)
+    return touched
+
+
+def _composite_qt(tile, ox, oy, dabs, width, dab, erase, wet=False):
+    """Запасной путь без NumPy: копия отпечатка на каждый мазок"""
+    painter = QPainter(tile)
+    if wet:
+        # у premultiplied-пикселей одного цвета максимум по каналам = максимум альфы
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Lighten)
+    elif erase:
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_DestinationOut)
+    else:
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
+    for x, y in dabs:
+        painter.drawImage(QPointF(x - width - ox, y - width - oy), dab)
+    painter.end()
+
+
+def _composite_numpy(tile, ox, oy, dabs, width, hardness, color, erase, wet=False):
+    """
+    Все мазки сегмента за один векторный проход по буферу тайла.
+    Мазки одного цвета, поэтому их SourceOver сводится к одному наложению
+    с покрытием 1 - prod(1 - a_i); ластик - умножение на prod(1 - a_i).
+    В буфере штриха (wet) покрытие - max(a_i) и max с тем, что уже есть.
+    """
+    h, w = tile.height(), tile.width()
+    cx = np.array([x for x, _ in dabs], np.float32) - ox
+    cy = np.array([y for _, y in dabs], np.float32) - oy
+
+    # Только мазки, задевающие тайл, и только их общий прямоугольник
+    near = (cx + width > 0) & (cx - width < w) & (cy + width > 0) & (cy - width < h)
+    if not near.any():
+        return
+    cx, cy = cx[near], cy[near]
+    x0, x1 = max(0, int(cx.min() - width)), min(w, int(math.ceil(cx.max() + width)) + 1)
+    y0, y1 = max(0, int(cy.min() - width)), min(h, int(math.ceil(cy.max() + width)) + 1)
+    px = np.arange(x0, x1, dtype=np.float32) + 0.5
+    py = np.arange(y0, y1, dtype=np.float32) + 0.5
+
+    # keep - доля пикселя, оставшаяся после мазков; для wet - пиковое покрытие
+    keep = np.full((y1 - y0, x1 - x0), 0.0 if wet else 1.0, np.float32)
+    chunk = max(1, NUMPY_CHUNK // keep.size)
+    alpha = color.alphaF()
+    for i in range(0, len(cx), chunk):
+        dist = np.hypot(px[None, None, :] - cx[i:i + chunk, None, None],
+                        py[None, :, None] - cy[i:i + chunk, None, None])
+        cover = alpha * dab_profile(dist, width, hardness)
+        if wet:
+            np.maximum(keep, cover.max(axis=0), out=keep)
+        else:
+            keep *= np.prod(1.0 - cover, axis=0)
+
+    dtype, order = ARRAY_FORMATS[tile.format()]
+    view = image_array(tile)[y0:y1, x0:x1]
+    top = float(np.iinfo(dtype).max)
+    rgba = {"R": color.redF(), "G": color.greenF(), "B": color.blueF(), "A": 1.0}
+    src = np.array([rgba[c] * top for c in order], np.float32)
+    if wet:
+        dst = np.maximum(view, src * keep[..., None])
+    else:
+        dst = view.astype(np.float32) * keep[..., None]
+        if not erase:
+            dst += src * (1.0 - keep)[..., None]
+    view[...] = np.rint(dst).astype(dtype)
+
+
+def dab_profile(dist, width, hardness):
+    """
+    Покрытие отпечатка на расстоянии dist от центра, тот же профиль, что у
+    градиента в DabCache.render: плато до hardness, затем спад к краю.
+    """
+    h = hardness / 100.0
+    cover = np.clip(1.0 + h - dist / width, h, 1.0)
+    # сглаживание края на один пиксель
+    return cover * np.clip(width - dist + 0.5, 0.0, 1.0)
@@ -3,9 +3,58 @@
 Обработка мыши
 """
 
-from PyQt6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsEllipseItem
-from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QWheelEvent, QPainter, QBrush, QColor, QPen, QCursor, QPixmap
+from collections import OrderedDict
+
+from PyQt6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsEllipseItem, QGraphicsItem
+from PyQt6.QtCore import Qt, QRect, QRectF
+from PyQt6.QtGui import QWheelEvent, QPainter, QBrush, QColor, QPen, QCursor, QPixmap, QImage
+
+VIEW_TILE = 256  # сторона экранного тайла кэша, px
+VIEW_CACHE_TILES = 256  # тайлов в кэше (256 * 256 КБ = 64 МБ)
+
+
+class ViewCache:
+    """
+    Сведённый холст в экранных тайлах VIEW_TILE x VIEW_TILE для каждого
+    масштаба. Тайл (zoom, tx, ty) покрывает область сцены
+    [tx, tx + 1) * VIEW_TILE / zoom по x (и так же по y). LRU по числу тайлов.
+    """
+    def __init__(self, max_tiles=VIEW_CACHE_TILES):
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()  # (zoom, tx, ty) -> QImage
+
+    @staticmethod
+    def keys(rect: QRectF, zoom):
+        """Ключи тайлов масштаба zoom, покрывающих область сцены rect"""
+        r = QRectF(rect.x() * zoom, rect.y() * zoom, rect.width() * zoom, rect.height() * zoom).toAlignedRect()
+        return [(zoom, tx, ty)
+                for ty in range(r.top() // VIEW_TILE, r.bottom() // VIEW_TILE + 1)
+                for tx in range(r.left() // VIEW_TILE, r.right() // VIEW_TILE + 1)]
+
+    @staticmethod
+    def scene_rect(key) -> QRectF:
+        zoom, tx, ty = key
+        size = VIEW_TILE / zoom
+        return QRectF(tx * size, ty * size, size, size)
+
+    def get(self, key, render):
+        tile = self.tiles.get(key)
+        if tile is None:
+            tile = render(key)
+            self.tiles[key] = tile
+            if len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+        else:
+            self.tiles.move_to_end(key)
+        return tile
+
+    def invalidate(self, rect=None):
+        """Выбрасывает тайлы всех масштабов, задевающие rect (None - все)"""
+        if rect is None:
+            self.tiles.clear()
+            return
+        for key in [key for key in self.tiles if self.scene_rect(key).intersects(rect)]:
+            del self.tiles[key]
 
 
 class CanvasView(QGraphicsView):
@@ -28,6 +77,75 @@ class CanvasView(QGraphicsView):
 
         self.cursor_default = QCursor(QPixmap("ui\\icons\\cross.svg").scaledToHeight(18), -8, -8)
 
+        # Режим кэша: слои рисуются не сценой, а из экранных тайлов в drawBackground
+        self.cached = False
+        self.cache = ViewCache()
+
+    def set_cached(self, enabled):
+        """
+        Включает/выключает кэширующий режим отрисовки.
+        Тайлы сбрасываются только сигналами слоёв, поэтому движение курсора
+        кисти (или любого другого элемента не из слоёв) не пересобирает холст.
+        """
+        if enabled == self.cached:
+            return
+        self.cached = enabled
+        layers = self.doc.layers
+        if enabled:
+            layers.layerChanged.connect(self.on_layer_changed)
+            layers.layersChanged.connect(self.on_layers_changed)
+        else:
+            layers.layerChanged.disconnect(self.on_layer_changed)
+            layers.layersChanged.disconnect(self.on_layers_changed)
+        self.on_layers_changed()
+
+    def on_layers_changed(self):
+        # сцена не должна рисовать слои сама, пока работает кэш (в том числе новые)
+        for layer in self.doc.layers._layers:
+            for item in layer.group.childItems():
+                item.setFlag(QGraphicsItem.GraphicsItemFlag.ItemHasNoContents, self.cached)
+        self.cache.invalidate()
+        self.viewport().update()
+
+    def on_layer_changed(self, layer, rect=None):
+        rect = self.sceneRect() if rect is None else QRectF(rect)
+        self.cache.invalidate(rect)
+        self.viewport().update(self.mapFromScene(rect).boundingRect().adjusted(-1, -1, 1, 1))
+
+    def drawBackground(self, painter, rect):
+        super().drawBackground(painter, rect)
+        if not self.cached:
+            return
+        rect = rect.intersected(self.sceneRect())
+        if rect.isEmpty():
+            return
+        zoom = self.transform().m11()
+        painter.save()
+        painter.scale(1 / zoom, 1 / zoom)
+        for key in self.cache.keys(rect, zoom):
+            _, tx, ty = key
+            painter.drawImage(tx * VIEW_TILE, ty * VIEW_TILE, self.cache.get(key, self.render_tile))
+        painter.restore()
+
+    def render_tile(self, key) -> QImage:
+        """Сводит все слои (с фоном-шахматкой) в один экранный тайл"""
+        zoom, tx, ty = key
+        rect = self.cache.scene_rect(key)
+        tile = QImage(VIEW_TILE, VIEW_TILE, QImage.Format.Format_ARGB32_Premultiplied)
+        tile.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(tile)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        painter.translate(-tx * VIEW_TILE, -ty * VIEW_TILE)
+        painter.scale(zoom, zoom)
+        painter.setClipRect(rect)
+        for layer in self.doc.layers._layers:
+            if layer.visible:
+                painter.setOpacity(layer.opacity)
+                layer.render(painter, rect, live=True)
+        painter.end()
+        return tile
+
 
     def wheelEvent(self, event):
         """Scaling by Ctrl+Alt+Wheel"""
@@ -50,9 +168,17 @@ class CanvasView(QGraphicsView):
             self.setDragMode(QGraphicsView.DragMode.NoDrag)
     
     def mousePressEvent(self, event):
+        if (event.button() == Qt.MouseButton.LeftButton and self.doc.activeTool.type == "Brush"
+                and event.modifiers() & Qt.KeyboardModifier.AltModifier):
+            # Alt+клик кистью - пипетка по сведённому изображению
+            self.doc.pick_color(self.mapToScene(event.pos()))
+            return
         if event.button() == Qt.MouseButton.LeftButton and self.doc.active_layer:
             self.drawing = True
             self.last_pos = self.mapToScene(event.pos()).toPoint()
+            if self.doc.active_layer.type == "Image" and self.doc.activeTool.type == "Brush":
+                self.doc.strokes.begin(self.doc.active_layer, self.last_pos, QColor(self.doc.color),
+                                       self.doc.brush.width, self.doc.erasier, self.doc.brush.hardness)
         super().mousePressEvent(event)
 
     def mouseMoveEvent(self, event):
@@ -60,7 +186,6 @@ class CanvasView(QGraphicsView):
             return
         if self.doc.active_layer.type == "Image" and self.doc.activeTool.type == "Brush":
             self.setCursor(self.cursor_default)
-            color = self.doc.color
             pos = self.mapToScene(event.pos()).toPoint()
             width = self.doc.brush.width
             r = width / 2
@@ -73,7 +198,8 @@ class CanvasView(QGraphicsView):
             else:
                 self.brush_preview.setPen(QPen(Qt.GlobalColor.darkGray, 2, Qt.PenStyle.DashLine))
             if self.drawing:
-                self.doc.active_layer.draw_line(self.last_pos, pos, color, width=self.doc.brush.width, erase=self.doc.erasier, hardness=self.doc.brush.hardness)
+                # Рисует фоновый поток, здесь только ставим точку в очередь
+                self.doc.strokes.add_point(pos)
                 self.last_pos = pos  # продолжение линии без перерисовки
         elif self.doc.activeTool.type == "Editor":
             super().mouseMoveEvent(event)
@@ -86,6 +212,7 @@ class CanvasView(QGraphicsView):
     def mouseReleaseEvent(self, event):
         if event.button() == Qt.MouseButton.LeftButton:
             self.drawing = False
+            self.doc.strokes.end()
         super().mouseReleaseEvent(event)
 
 
@@ -0,0 +1,179 @@
+"""
+Кэш сведённого изображения документа.
+Хранит результат наложения всех видимых слоёв и отдельно сведённые стопки
+под активным слоем и над ним: правка активного слоя пересобирает только
+изменившуюся область из трёх картинок, а не весь стек слоёв.
+"""
+
+from PyQt6.QtGui import QImage, QPainter, QRegion
+from PyQt6.QtCore import Qt, QPoint, QRect, QRectF
+
+from blend import BLEND_MODES, blend_layer, render_state
+
+COMPOSITE_FORMAT = QImage.Format.Format_ARGB32_Premultiplied
+
+
+class Stack:
+    """Сведённое изображение нескольких слоёв и его устаревшая область"""
+    def __init__(self, width, height):
+        self.image = None  # выделяется при первой сборке
+        self.full = QRect(0, 0, width, height)
+        self.dirty = QRegion(self.full)
+        self.layers = []
+
+    def invalidate(self, rect=None):
+        """rect=None - устарело всё изображение"""
+        rect = self.full if rect is None else rect.intersected(self.full)
+        self.dirty = self.dirty.united(QRegion(rect))
+
+    def update(self, rect: QRect, render):
+        """
+        Пересобирает устаревшую часть rect; render(image, area) рисует
+        содержимое в прямоугольник area (он целиком очищается заранее).
+        """
+        if self.image is None:
+            self.image = QImage(self.full.width(), self.full.height(), COMPOSITE_FORMAT)
+            self.image.fill(Qt.GlobalColor.transparent)
+        region = self.dirty.intersected(QRegion(rect))
+        if region.isEmpty():
+            return
+        area = region.boundingRect()
+        painter = QPainter(self.image)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        painter.fillRect(area, Qt.GlobalColor.transparent)
+        painter.end()
+        render(self.image, area)
+        self.dirty = self.dirty.subtracted(QRegion(area))
+
+
+class CompositeCache:
+    """
+    Сведённое изображение документа = стопка под активным слоем + активный
+    слой + стопка над ним. Изменения приходят сигналами LayerManager и
+    помечают устаревшие области; пересборка ленивая, при запросе картинки.
+    """
+    def __init__(self, doc):
+        self.doc = doc
+        self.rect = QRect(0, 0, doc.width, doc.height)
+        self.flat = Stack(doc.width, doc.height)
+        self.below = Stack(doc.width, doc.height)
+        self.above = Stack(doc.width, doc.height)
+        self.active = None
+        self._state = None  # порядок и положение слоёв на момент сборки
+
+        doc.layers.layerChanged.connect(self.on_layer_changed)
+        doc.layers.layersChanged.connect(self.invalidate)
+
+    def layers(self):
+        """Слои, участвующие в сведении (шахматный фон не в счёт)"""
+        bg = getattr(self.doc, "bg_layer", None)
+        return [layer for layer in self.doc.layers._layers if layer is not bg]
+
+    def invalidate(self, rect=None):
+        """Сбрасывает кэш целиком или в области rect (координаты сцены)"""
+        rect = None if rect is None else QRectF(rect).toAlignedRect()
+        for stack in (self.flat, self.below, self.above):
+            stack.invalidate(rect)
+
+    def on_layer_changed(self, layer, rect=None):
+        rect = None if rect is None else QRectF(rect).toAlignedRect()
+        self.flat.invalidate(rect)
+        if layer in self.below.layers:
+            self.below.invalidate(rect)
+        elif layer in self.above.layers:
+            self.above.invalidate(rect)
+
+    def image(self, rect=None) -> QImage:
+        """
+        Сведённое изображение холста. Пересобирается только устаревшая часть
+        области rect, остальное берётся из кэша. Возвращает общую (неявно
+        разделяемую) копию - следующее обновление кэша её не испортит.
+        """
+        self._sync()
+        rect = self.rect if rect is None else QRectF(rect).toAlignedRect().intersected(self.rect)
+        self.flat.update(rect, self._render_flat)
+        return QImage(self.flat.image)
+
+    def pixel(self, x, y):
+        """Цвет сведённого изображения в точке (пересобирается один пиксель)"""
+        if not self.rect.contains(x, y):
+            return None
+        return self.image(QRect(x, y, 1, 1)).pixelColor(x, y)
+
+    def _sync(self):
+        """Сверяет порядок, активный слой и положение слоёв с прошлой сборкой"""
+        layers = self.layers()
+        active = getattr(self.doc, "active_layer", None)
+        if active not in layers:
+            active = None
+        # Перетаскивание слоя мышью не проходит через сеттеры - ловим здесь
+        state = [(layer, layer.pos().x(), layer.pos().y(), layer.group.scale()) for layer in layers]
+        if self._state is None or [s[0] for s in state] != [s[0] for s in self._state]:
+            self.invalidate()
+        else:
+            for old, new in zip(self._state, state):
+                if old != new:
+                    self.on_layer_changed(new[0])
+        self._state = state
+
+        if active is not self.active or self.below.layers + self.above.layers != [l for l in layers if l is not active]:
+            # Стопки вокруг нового активного слоя собираются лениво, по запросу
+            self.active = active
+            index = layers.index(active) if active is not None else len(layers)
+            self.below.layers = layers[:index]
+            self.above.layers = layers[index + 1:]
+            self.below.invalidate()
+            self.above.invalidate()
+
+    def _render_flat(self, image, rect):
+        self.below.update(rect, self._render_below)
+        painter = QPainter(image)
+        painter.drawImage(rect, self.below.image, rect)
+        painter.end()
+        if self.active is not None:
+            render_layers(image, rect, [self.active])
+
+        # Готовую стопку сверху можно просто положить, только если все её
+        # слои обычные: остальные режимы зависят от того, что под ними
+        if all(layer.blend_mode == "normal" for layer in self.above.layers if layer.visible):
+            self.above.update(rect, self._render_above)
+            painter = QPainter(image)
+            painter.drawImage(rect, self.above.image, rect)
+            painter.end()
+        else:
+            render_layers(image, rect, self.above.layers)
+
+    def _render_below(self, image, rect):
+        render_layers(image, rect, self.below.layers)
+
+    def _render_above(self, image, rect):
+        render_layers(image, rect, self.above.layers)
+
+
+def render_layers(image, rect, layers, origin=QPoint(0, 0), states=None):
+    """
+    Накладывает видимые слои снизу вверх на image, только область rect.
+    origin - точка сцены, которой соответствует левый верхний угол image.
+    Особые режимы наложения 16-битных Image-слоёв считаются векторно по
+    тайлам, остальное рисует QPainter в соответствующем режиме композиции.
+    states - render_state слоёв, прочитанные в GUI-потоке: с ними слои
+    Image можно сводить в потоках пула.
+    """
+    if states is None:
+        states = [render_state(layer) for layer in layers]
+    for layer, state in zip(layers, states):
+        visible, opacity, mode, transform = state
+        if not visible:
+            continue
+        if mode != "normal" and blend_layer(image, rect, layer, origin, state):
+            continue
+        painter = QPainter(image)
+        painter.translate(-origin.x(), -origin.y())
+        painter.setClipRect(rect)
+        painter.setCompositionMode(BLEND_MODES[mode])
+        painter.setOpacity(opacity)
+        if transform is None:
+            layer.render(painter, QRectF(rect))
+        else:
+            layer.render(painter, QRectF(rect), transform=transform)
+        painter.end()
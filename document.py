@@ -5,15 +5,23 @@
 from datetime import datetime
 
 from PyQt6.QtWidgets import QWidget, QVBoxLayout, QGraphicsRectItem
-from PyQt6.QtCore import Qt, QRectF, QSize
+from PyQt6.QtCore import Qt, QRect, QRectF, pyqtSignal
 from PyQt6.QtGui import QPixmap, QPainter, QBrush, QColor
 
 from tools import BrushTool, Editor
 from canvas import CanvasScene, CanvasView
 from layer import LayerManager, Layer, Solid, Image, Text
+from stroke import StrokePipeline
+from history import History, ReleaseTilesCommand
+from tiles import DEFAULT_PRECISION
+from composite import CompositeCache
+from export import export_png, export_slices, STREAM_PIXELS
+from bake import bake_layers
 
 
 class Document(QWidget):
+    colorPicked = pyqtSignal(QColor)  # пипетка взяла цвет с холста
+
     def __init__(self, name="Новый документ", width=1280, height=720):
         super().__init__()
         self.sys_version = "1.0"
@@ -29,15 +37,32 @@ class Document(QWidget):
         self.modified = None
         self.filepath = None
         self.dsc = "<i>No discription</i>"
+        self.precision = DEFAULT_PRECISION  # бит на канал у новых Image-слоёв
+        self.slices = []  # именованные области экспорта (export.Slice)
+        self.loader = None  # фоновое декодирование слоёв открытого проекта
+        self.layer_encoding = "png"  # как хранить пиксели слоёв в .pld (file_logic.LAYER_ENCODINGS)
 
         # Сцена и вью
         self.scene = CanvasScene()
         self.view = CanvasView(self.scene, self)
         self.scene.setSceneRect(0, 0, width, height)
 
-        # Менеджер слоёв
-        self.layers = LayerManager(self.scene)
+        # Штрихи кисти рисуются в фоновом потоке
+        self.strokes = StrokePipeline(self)
+
+        # История и менеджер слоёв
+        self.history = History()
+        self.layers = LayerManager(self.scene, self.history)
         self.add_bg_layer()
+        self.history.clear()  # создание документа не отменяется
+
+        # Счётчик правок: автосохранение пишет только изменившиеся документы
+        self.changes = 0
+        for signal in (self.layers.layerChanged, self.layers.layerUpdated, self.layers.layersChanged):
+            signal.connect(self.count_change)
+
+        # Сведённое изображение (сведение слоёв, экспорт, пипетка)
+        self.composite = CompositeCache(self)
 
         layout = QVBoxLayout(self)
         layout.addWidget(self.view)
@@ -46,6 +71,12 @@ class Document(QWidget):
 
         #self.export_area("part.png", QRectF(100, 100, 400, 300))
 
+    def count_change(self, layer=None, rect=None):
+        # Пиксели, пришедшие из файла проекта, - не правка; layersChanged
+        # (добавление, удаление, порядок) приходит без слоя - всегда правка
+        if layer is None or self.loader is None or self.loader.filling is not layer:
+            self.changes += 1
+
     def move_layer(self, index, direction):
         index = len(self.layers._layers) - index - 1
         self.layers.move(index, direction)
@@ -81,8 +112,8 @@ class Document(QWidget):
         lyr.set_locked(locked)
         self.layers.add_layer(layer=lyr)
 
-    def add_pixmap_layer(self, name, pixmap):
-        lyr = Image(name, self.scene, pixmap, self.width, self.height)
+    def add_pixmap_layer(self, name, pixmap, precision=None):
+        lyr = Image(name, self.scene, pixmap, self.width, self.height, precision=precision or self.precision)
         lyr.set_locked(False)
         self.layers.add_layer(layer=lyr)
 
@@ -117,42 +148,111 @@ class Document(QWidget):
         self.bg_item = rect_item  # храним ссылку, чтобы скрывать при экспорте
 
     def add_layer(self, name, color=None):
-        empty = QPixmap(QSize(self.width, self.height))
-        empty.fill(Qt.GlobalColor.transparent)
-        layer = Image(name, self.scene, empty, self.width, self.height)
+        layer = Image(name, self.scene, None, self.width, self.height, precision=self.precision)
         self.layers.add_layer(layer=layer)
         self.active_layer = layer
 
-    def export_area(self, filename: str, rect: QRectF = None):
-        """Экспортирует область сцены в PNG с прозрачным фоном"""
-        if rect is None:
-            rect = self.scene.sceneRect()
+    def replace_layers(self, old_layers, layer):
+        """
+        Ставит layer на место old_layers одним шагом истории. Тайлы убранных
+        слоёв освобождаются сразу, для отмены они сжаты в журнал истории.
+        """
+        indexes = sorted(self.layers._layers.index(old) for old in old_layers)
+        with self.history.macro():
+            for index in reversed(indexes):
+                old = self.layers._layers[index]
+                self.layers.remove(index)
+                if old.type == "Image":
+                    self.release_layer(old)
+            self.layers.insert(indexes[0], layer)
+        self.layers.active_layer = layer
+        self.active_layer = layer
 
-        if hasattr(self, "bg_item"):
-            self.bg_item.setVisible(False)  # скрываем фон
+    def release_layer(self, layer):
+        """Освобождает пиксели убранного Image-слоя, сохранив их для отмены"""
+        layer.load()
+        states = {}
+        if self.history.recording:
+            journal = self.history.get_journal()
+            with layer.surface.lock:
+                states = {key: journal.write(tile) for key, tile in layer.surface.tiles.items()}
+        layer.surface.release()
+        self.history.push(ReleaseTilesCommand(layer, states))
 
-        width, height = int(rect.width()), int(rect.height())
-        pixmap = QPixmap(width, height)
-        pixmap.fill(Qt.GlobalColor.transparent)  # прозрачный фон
+    def apply_transform(self, layer=None):
+        """Запекает масштаб и сдвиг слоя в пиксели нового Image-слоя"""
+        layer = layer or self.active_layer
+        if layer is None or layer not in self.composite.layers():
+            return None
+        baked = bake_layers(self, [layer], layer.name, keep_first=True)
+        self.replace_layers([layer], baked)
+        return baked
 
-        painter = QPainter(pixmap)
-        self.scene.render(painter, target=QRectF(pixmap.rect()), source=rect)
-        painter.end()
+    def merge_down(self, layer=None):
+        """
+        Объединяет слой с нижним: верхний накладывается в своём режиме только
+        на пиксели нижнего. Картинка не меняется, если оба слоя обычные (нижний
+        запекается со своей прозрачностью). Иначе может измениться: особый
+        режим верхнего считается по нижнему слою, а не по всему, что под ним
+        (и не действует там, где нижний прозрачен); нижний с особым режимом
+        отдаёт результату свои режим и прозрачность - они применяются уже к
+        объединённым пикселям.
+        """
+        layer = layer or self.active_layer
+        layers = self.composite.layers()
+        if layer not in layers or layers.index(layer) == 0:
+            return None
+        lower = layers[layers.index(layer) - 1]
+        baked = bake_layers(self, [lower, layer], lower.name, keep_first=lower.blend_mode != "normal")
+        self.replace_layers([lower, layer], baked)
+        return baked
+
+    def flatten(self):
+        """Сводит все видимые слои в один; скрытые слои отбрасываются"""
+        layers = self.composite.layers()
+        if not layers:
+            return None
+        baked = bake_layers(self, [layer for layer in layers if layer.visible], "Сведённый слой")
+        self.replace_layers(layers, baked)
+        return baked
 
-        if hasattr(self, "bg_item"):
-            self.bg_item.setVisible(True)  # возвращаем видимость
+    def export_area(self, filename: str, rect: QRectF = None, streaming=None):
+        """
+        Экспортирует область холста в файл с прозрачным фоном.
+        streaming=True - PNG сводится и пишется полосами, без картинки
+        целиком в памяти; None - так экспортируются большие области в PNG.
+        """
+        if rect is None:
+            rect = self.scene.sceneRect()
+        rect = rect.toAlignedRect().intersected(QRect(0, 0, self.width, self.height))
+        self.load_layers()
+        if streaming is None:
+            streaming = filename.lower().endswith(".png") and rect.width() * rect.height() > STREAM_PIXELS
+        if streaming:
+            export_png(self, filename, rect)
+        else:
+            self.composite.image(rect).copy(rect).save(filename)
 
-        pixmap.save(filename)
+    def export_slices(self, folder: str):
+        """Экспортирует все срезы документа в папку, возвращает пути файлов"""
+        self.load_layers()
+        return export_slices(self, folder)
 
     def get_composite(self):
         """Объединённое изображение всех видимых слоёв"""
-        result = QPixmap(self.width, self.height)
-        result.fill(Qt.GlobalColor.transparent)
-
-        painter = QPainter(result)
-        for layer in self.layers._layers:
-            if layer.visible:
-                painter.setOpacity(layer.opacity)
-                painter.drawPixmap(0, 0, layer.get_preview(QSize(self.width, self.height)))
-        painter.end()
-        return result
\ No newline at end of file
+        self.load_layers()
+        return self.composite.image()
+
+    def load_layers(self):
+        """Дожидается пикселей видимых слоёв, ещё не декодированных после открытия"""
+        for layer in self.composite.layers():
+            if layer.visible and layer.type == "Image":
+                layer.load()
+
+    def pick_color(self, pos):
+        """Пипетка: цвет сведённого изображения в точке сцены"""
+        color = self.composite.pixel(int(pos.x()), int(pos.y()))
+        if color is not None and color.alpha():
+            self.color = QColor(color.red(), color.green(), color.blue())
+            self.colorPicked.emit(self.color)
+        return color
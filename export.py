@@ -0,0 +1,181 @@
+"""
+Экспорт: потоковый PNG и срезы.
+Большой холст сводится горизонтальными полосами, и каждая полоса сразу
+уходит в zlib и в файл: в памяти одновременно живёт одна полоса, а не всё
+изображение. Срезы (именованные области документа) вырезаются из одного
+сведённого снимка и кодируются параллельно.
+"""
+
+import os
+import re
+import shutil
+import struct
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt6.QtGui import QImage
+from PyQt6.QtCore import Qt, QRect
+
+from tiles import np, TILE_SIZE
+from composite import COMPOSITE_FORMAT, render_layers
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+STRIP_HEIGHT = TILE_SIZE        # полоса = ряд тайлов слоёв
+IDAT_SIZE = 1 << 20             # сжатые данные пишутся чанками до 1 МБ
+STREAM_PIXELS = 4096 * 4096     # с этой площади export_area пишет полосами
+
+
+class PngWriter:
+    """
+    Пишет 8-битный RGBA PNG построчно. Строки сжимаются по мере
+    поступления, готовые данные сразу уходят в файл чанками IDAT.
+    """
+    def __init__(self, file, width, height, level=6):
+        self.file = file
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self.compressor = zlib.compressobj(level)
+        self.pending = []
+        self.pending_size = 0
+
+        file.write(PNG_SIGNATURE)
+        # 8 бит на канал, тип цвета 6 (RGBA), без чересстрочности
+        self.chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+
+    def chunk(self, kind, data):
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(kind)
+        self.file.write(data)
+        self.file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+    def write_rows(self, image: QImage):
+        """Дописывает строки картинки (Format_RGBA8888, ширина - как у PNG)"""
+        if image.format() != QImage.Format.Format_RGBA8888:
+            image = image.convertToFormat(QImage.Format.Format_RGBA8888)
+        width, height, stride = image.width(), image.height(), image.bytesPerLine()
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+        if np is not None:
+            # Фильтр Sub (разность с левым пикселем) - сжимается заметно лучше
+            rows = np.frombuffer(bits, np.uint8).reshape(height, stride)[:, :width * 4]
+            data = np.empty((height, width * 4 + 1), np.uint8)
+            data[:, 0] = 1
+            data[:, 1:5] = rows[:, :4]
+            np.subtract(rows[:, 4:], rows[:, :-4], out=data[:, 5:])
+            self.feed(data.tobytes())
+        else:
+            raw = bits.asstring()
+            for y in range(height):
+                self.feed(b"\x00" + raw[y * stride:y * stride + width * 4])
+        self.rows += height
+
+    def feed(self, data):
+        compressed = self.compressor.compress(data)
+        if compressed:
+            self.pending.append(compressed)
+            self.pending_size += len(compressed)
+        if self.pending_size >= IDAT_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.chunk(b"IDAT", b"".join(self.pending))
+            self.pending, self.pending_size = [], 0
+
+    def close(self):
+        if self.rows != self.height:
+            raise ValueError(f"PNG: записано {self.rows} строк из {self.height}")
+        self.pending.append(self.compressor.flush())
+        self.flush()
+        self.chunk(b"IEND", b"")
+
+
+def export_png(doc, filename, rect: QRect, strip_height=STRIP_HEIGHT):
+    """
+    Сводит область rect документа полосами высотой strip_height и пишет
+    в PNG. Кэш сведённого изображения не используется и не строится.
+    Файл пишется во временный рядом и подменяет прежний только целиком.
+    """
+    if rect.isEmpty():
+        raise ValueError("Экспорт: пустая область")
+    layers = doc.composite.layers()
+    bottom = rect.bottom() + 1
+    fd, tmp_path = tempfile.mkstemp(prefix=f".~{os.path.basename(filename)}.",
+                                    dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            writer = PngWriter(f, rect.width(), rect.height())
+            y = rect.top()
+            while y < bottom:
+                # Границы полос - по рядам тайлов, тогда каждый тайл читается один раз
+                end = min((y // strip_height + 1) * strip_height, bottom)
+                area = QRect(rect.left(), y, rect.width(), end - y)
+                strip = QImage(area.width(), area.height(), COMPOSITE_FORMAT)
+                strip.fill(Qt.GlobalColor.transparent)
+                render_layers(strip, area, layers, area.topLeft())
+                writer.write_rows(strip)
+                y = end
+            writer.close()
+        # mkstemp создаёт файл только для владельца - права берём у прежнего
+        if os.path.exists(filename):
+            shutil.copymode(filename, tmp_path)
+        else:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class Slice:
+    """Именованная область экспорта (координаты сцены)"""
+    def __init__(self, name, rect: QRect):
+        self.name = name
+        self.rect = QRect(rect)
+
+
+def slice_filenames(slices, folder, ext="png"):
+    """Имена файлов срезов: недопустимые символы заменяются, повторы нумеруются"""
+    names, used = [], set()
+    for i, item in enumerate(slices):
+        base = re.sub(r'[\\/:*?"<>|]', "_", item.name).strip(" .") or f"slice_{i}"
+        name, n = base, 1
+        while name.lower() in used:
+            n += 1
+            name = f"{base}_{n}"
+        used.add(name.lower())
+        names.append(os.path.join(folder, f"{name}.{ext}"))
+    return names
+
+
+def export_slices(doc, folder, slices=None, workers=None):
+    """
+    Экспортирует срезы документа в PNG в папку folder, возвращает пути.
+    Сведение делается один раз (кэш пересобирает только область срезов),
+    затем вырезка и кодирование идут в пуле потоков: QImage.save отпускает
+    GIL, а снимок только читается, так что потоки друг другу не мешают.
+    """
+    slices = doc.slices if slices is None else slices
+    if not slices:
+        return []
+    bounds = doc.composite.rect
+    rects = [item.rect.intersected(bounds) for item in slices]
+    area = QRect()
+    for rect in rects:
+        area = area.united(rect)
+    snapshot = doc.composite.image(area)
+    paths = slice_filenames(slices, folder)
+
+    def save(job):
+        rect, path = job
+        if rect.isEmpty():
+            return None
+        if not snapshot.copy(rect).save(path, "PNG"):
+            raise OSError(f"Не удалось записать {path}")
+        return path
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        return [path for path in pool.map(save, zip(rects, paths)) if path]
@@ -5,117 +5,246 @@
 import os
 import shutil
 import json
+import struct
 import sqlite3
 import zipfile
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-from PyQt6.QtGui import QPixmap, QColor, QFont
-from PyQt6.QtCore import QPointF
+from PyQt6.QtGui import QImage, QColor, QFont
+from PyQt6.QtCore import QObject, QRunnable, QPointF, QRect, QBuffer, QIODevice, pyqtSignal
 
 from document import Document
+from layer import Image
+from tiles import DEFAULT_PRECISION, TILE_SIZE, TileSurface
+from blend import DEFAULT_BLEND
+from export import Slice, PNG_SIGNATURE
+from rawtiles import encode_tiles, read_tiles, write_aligned
 
 
-def pack(project_dir: str, zip_path: str):
-    """
-    Упаковывает содержимое prj (layers/, manifest.json, project.db)
-    в zip-архив .pld (по сути zip).
-    """
-    prj_dir = project_dir
-    layers_dir = os.path.join(prj_dir, "layers")
-    manifest_file = os.path.join(prj_dir, "manifest.json")
-    db_file = os.path.join(prj_dir, "project.db")
-
-    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
-        # layers/
-        if os.path.isdir(layers_dir):
-            for root, dirs, files in os.walk(layers_dir):
-                for file in files:
-                    full_path = os.path.join(root, file)
-                    rel = os.path.relpath(full_path, prj_dir)
-                    zf.write(full_path, rel)
-
-        # manifest.json
-        if os.path.isfile(manifest_file):
-            zf.write(manifest_file, "manifest.json")
-
-        # project.db
-        if os.path.isfile(db_file):
-            zf.write(db_file, "project.db")
-
-
-def unpack(zip_path: str, project_dir: str):
+PNG_COMPRESSION = 6  # уровень zlib для PNG слоёв: 1 - быстрее, 9 - меньше файл
+# Как хранятся пиксели Image-слоёв (Document.layer_encoding) -> расширение записи:
+# PNG - компактно; raw - тайлы как есть, без кодирования (rawtiles);
+# zlib - те же тайлы, каждый сжат zlib
+LAYER_ENCODINGS = {"png": ".png", "raw": ".tiles", "zlib": ".ztiles"}
+# Чтение слоёв в фоне и подмена файла при сохранении не пересекаются:
+# на Windows открытый файл не подменить
+ARCHIVE_LOCK = threading.Lock()
+
+
+def png_header(data: bytes):
+    """Ширина, высота и бит на канал из заголовка PNG - без декодирования"""
+    if data[:8] != PNG_SIGNATURE or data[12:16] != b"IHDR":
+        raise NotCorrectFolder("Layer image is not a PNG")
+    return struct.unpack(">IIB", data[16:25])
+
+
+def entry_stamp(info: zipfile.ZipInfo):
+    """CRC32 и размер записи архива - по ним видно, что запись та же, что была"""
+    return info.CRC, info.file_size
+
+
+def decode_layer(layer) -> TileSurface:
+    """Читает пиксели слоя из его .pld (layer.saved)"""
+    while True:
+        record = layer.saved
+        _, _, path, entry, stamp = record
+        surface = read_layer(path, entry, layer.surface.format, stamp)
+        # Файл подменило сохранение (оно же сменило запись) - читаем заново
+        if layer.saved is record:
+            return surface
+
+
+def read_layer(path, entry, fmt, stamp=None) -> TileSurface:
     """
-    Распаковывает содержимое архива (.pld/.zip) в prj/
+    Тайлы записи слоя в архиве path: PNG декодируется и нарезается на тайлы.
+    stamp - ожидаемый entry_stamp: если файл с тех пор перезаписали и в записи
+    уже другие данные, чужие пиксели не читаются - OSError.
     """
-    prj_dir = project_dir
-
-    with zipfile.ZipFile(zip_path, "r") as zf:
-        for member in zf.namelist():
-            if (member.startswith("layers/") or 
-                member == "manifest.json" or 
-                member == "project.db"):
-                zf.extract(member, prj_dir)
-
-def clear_folder(folder_path):
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path) 
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-        except Exception as e:
-            print(f'Не удалось удалить {file_path}. Причина: {e}')
+    with ARCHIVE_LOCK:
+        with zipfile.ZipFile(path, "r") as zf:
+            if stamp is not None and entry_stamp(zf.getinfo(entry)) != stamp:
+                raise OSError(f"{entry} в {os.path.basename(path)} перезаписан после открытия")
+            if entry.endswith(".png"):
+                data = zf.read(entry)
+        if not entry.endswith(".png"):
+            return read_tiles(path, entry, fmt)
+    image = QImage.fromData(data, "PNG")
+    if image.isNull():
+        raise OSError(f"Не удалось декодировать {entry}")
+    return TileSurface.from_image(image, fmt)
 
 
 class NotCorrectFolder(Exception):
     pass
 
 
-class SaveDoc:
-    def __init__(self, document, folder_path):
-        self.doc = document
-        self.tmp_folder = os.path.dirname(os.path.abspath(__file__))
-        self.tmp_folder = os.path.join(self.tmp_folder, "prj")
+class SaveCancelled(Exception):
+    """Сохранение отменено до подмены файла - прежний файл не тронут"""
 
-        os.makedirs(self.tmp_folder, exist_ok=True)
-        clear_folder(self.tmp_folder)
 
-        self.save_manifest()
+class DocSnapshot:
+    """
+    Снимок документа для записи в любом потоке. Берётся в GUI-потоке и
+    почти ничего не стоит: свойства копируются, пиксели изменившихся слоёв -
+    общие копии тайлов (copy-on-write, рисование дальше их не испортит),
+    а нетронутые слои - ссылкой на запись, где их пиксели уже лежат.
+    sources - какие записи о сохранённых пикселях слоя можно взять как есть.
+    """
+    def __init__(self, doc, encoding=None, sources=("saved",)):
+        self.encoding = encoding or doc.layer_encoding
+        self.manifest = {
+            "version": doc.sys_version,
+            "discription": doc.dsc,
+            "project_name": doc.name,
+            "canvas_width": doc.width,
+            "canvas_height": doc.height,
 
-        self.db_path = os.path.join(self.tmp_folder, "project.db")
-        self.conn = sqlite3.connect(self.db_path)
-        self.create_tables()
+            "precision": doc.precision,
+            "layer_encoding": self.encoding,
 
-        self.save_layers()
+            "instrument": doc.activeTool.type,
+            "color": tuple(doc.color.getRgb()[:3]),
 
-        self.conn.commit()
-        self.conn.close()
+            "current_layer": 0,#doc.active_layer_index,
 
-        pack(self.tmp_folder, folder_path)
-        clear_folder(self.tmp_folder)
+            "created": doc.created,
+            "modified": datetime.now().timestamp()
+        }
 
+        self.layers = []  # строки таблицы layers
+        self.images = []  # (id, слой, точность, ширина, высота, формат, ревизия, записи, снимок)
+        self.solids = []
+        self.texts = []
+        for i, layer in enumerate(doc.layers._layers):
+            self.layers.append((
+                i,
+                layer.name,
+                layer.type,
+                int(layer.visible),
+                int(layer.locked),
+                layer.opacity,
+                layer.z_value,
+                layer.scale,
+                layer.pos().x(),
+                layer.pos().y(),
+                layer.blend_mode
+            ))
 
-    # === 1. MANIFEST ===
-    def save_manifest(self):
-        data = {
-            "version": self.doc.sys_version,
-            "discription": self.doc.dsc,
-            "project_name": self.doc.name,
-            "canvas_width": self.doc.width,
-            "canvas_height": self.doc.height,
+            if layer.type == "Image":
+                records = [r for r in (getattr(layer, name, None) for name in sources) if r is not None]
+                with layer.surface.lock:
+                    revision = layer.surface.revision
+                    # Тайлы нужны только изменившимся слоям: нетронутый слой в том
+                    # же виде или ещё не декодированный берётся из своей записи
+                    clean = layer.loader is not None or any(
+                        r[0] == revision and r[3].endswith(LAYER_ENCODINGS[self.encoding]) for r in records)
+                    snapshot = None if clean else layer.surface.snapshot()
+                self.images.append((i, layer, layer.precision, layer.width, layer.height, layer.surface.format,
+                                    revision, records, snapshot))
 
-            "instrument": self.doc.activeTool.type,
-            "color": tuple(self.doc.color.getRgb()[:3]),
+            elif layer.type == "Solid":
+                r, g, b, _ = layer.solid_color.getRgb()
+                self.solids.append((i, r, g, b))
 
-            "current_layer": 0,#self.doc.active_layer_index,
+            elif layer.type == "Text":
+                r, g, b, _ = layer.text_color.getRgb()
+                self.texts.append((i, layer.text, layer.font.family(), layer.font.pixelSize(), r, g, b))
 
-            "created": self.doc.created,
-            "modified": datetime.now().timestamp()
-        }
+        self.slices = [(i, item.name, item.rect.x(), item.rect.y(), item.rect.width(), item.rect.height())
+                       for i, item in enumerate(doc.slices)]
+
+
+class SaveDoc:
+    """
+    Пишет проект прямо в архив .pld, без промежуточных файлов: база
+    собирается в памяти, пиксели слоёв кодируются в буферы (encoding - см.
+    LAYER_ENCODINGS, None - как задано в документе). Архив пишется во
+    временный файл рядом с целевым и подменяет его атомарно - при ошибке
+    прежний файл остаётся целым.
+    document - Document или готовый DocSnapshot: со снимком сохранение
+    можно вести в другом потоке, а потом отметить слоям apply() в GUI.
+    attr - атрибут слоёв, который отмечается вместе с подменой файла, пока
+    его не читает никто другой (для Document - "saved").
+    progress(готово, всего) вызывается после каждого записанного слоя
+    (в байтах пикселей), cancel - threading.Event для отмены.
+    """
+    def __init__(self, document, folder_path, compression=PNG_COMPRESSION, workers=None, encoding=None,
+                 progress=None, cancel=None, attr=None):
+        if isinstance(document, DocSnapshot):
+            self.snap = document
+        else:
+            self.snap = DocSnapshot(document, encoding)
+            attr = attr or "saved"
+        self.compression = compression  # уровень zlib для PNG и тайлов zlib, 0..9
+        self.encoding = self.snap.encoding
+        self.workers = workers  # потоков кодирования (None - по числу ядер)
+        self.zip_path = os.path.abspath(folder_path)
+        self.progress = progress
+        self.cancel = cancel
+        # байт на пиксель: 4 при 8 битах на канал, 8 - при 16
+        self.total = sum(width * height * precision // 2 for _, _, precision, width, height, *_ in self.snap.images)
+        self.done = 0
+
+        self.conn = sqlite3.connect(":memory:")
+        self.create_tables()
+
+        self.saved = []  # (слой, запись о сохранённых пикселях)
+        self.jobs = []  # слои, которые надо перекодировать
+
+        # Имя временного файла начинается с имени проекта - видно, чей он
+        fd, tmp_path = tempfile.mkstemp(prefix=f".~{os.path.basename(self.zip_path)}.", suffix=".pld",
+                                        dir=os.path.dirname(self.zip_path))
+        os.close(fd)
+        try:
+            # mkstemp создаёт файл только для владельца - права берём у прежнего
+            if os.path.exists(self.zip_path):
+                shutil.copymode(self.zip_path, tmp_path)
+            else:
+                os.chmod(tmp_path, 0o644)
+            with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as self.zf:
+                self.save_layers()
+                self.encode_layers()
+                self.save_slices()
+                self.conn.commit()
+                self.zf.writestr("project.db", self.conn.serialize())
+                self.save_manifest()
+            self.check_cancel()  # последний шанс - дальше файл подменяется
+            with ARCHIVE_LOCK:
+                os.replace(tmp_path, self.zip_path)
+                if attr is not None:
+                    self.apply(attr)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            self.conn.close()
+
+    def check_cancel(self):
+        if self.cancel is not None and self.cancel.is_set():
+            raise SaveCancelled()
+
+    def step(self, image):
+        """Слой записан: сдвигает прогресс на его размер в байтах"""
+        _, _, precision, width, height, *_ = image
+        self.done += width * height * precision // 2
+        if self.progress is not None:
+            self.progress(self.done, self.total)
+        self.check_cancel()
+
+    def apply(self, attr="saved"):
+        """Файл записан - отмечает слоям, что их пиксели лежат в нём"""
+        for layer, (revision, digest, entry, stamp) in self.saved:
+            setattr(layer, attr, (revision, digest, self.zip_path, entry, stamp))
 
-        with open(os.path.join(self.tmp_folder, "manifest.json"), "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4)
+
+    # === 1. MANIFEST ===
+    def save_manifest(self):
+        self.zf.writestr("manifest.json", json.dumps(self.snap.manifest, indent=4))
 
 
     def create_tables(self):
@@ -132,14 +261,21 @@ class SaveDoc:
             z_value INTEGER,
             scale REAL,
             pos_x INTEGER,
-            pos_y INTEGER
+            pos_y INTEGER,
+            blend_mode TEXT
         )
         """)
 
         c.execute("""
         CREATE TABLE layer_image (
             layer_id INTEGER PRIMARY KEY,
-            pixmap_path TEXT
+            pixmap_path TEXT,
+            precision INTEGER,
+            encoding TEXT,
+            format INTEGER,
+            width INTEGER,
+            height INTEGER,
+            tile_size INTEGER
         )
         """)
 
@@ -164,80 +300,317 @@ class SaveDoc:
         )
         """)
 
+        c.execute("""
+        CREATE TABLE slices (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            x INTEGER,
+            y INTEGER,
+            width INTEGER,
+            height INTEGER
+        )
+        """)
+
 
     # === 3. СОХРАНЕНИЕ СЛОЁВ ===
     def save_layers(self):
         c = self.conn.cursor()
 
-        # Каталог для изображений
-        layers_dir = os.path.join(self.tmp_folder, "layers")
-        os.makedirs(layers_dir, exist_ok=True)
+        c.executemany("""
+            INSERT INTO layers (id, name, type, visible, locked, opacity, z_value, scale, pos_x, pos_y, blend_mode)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, self.snap.layers)
+
+        # Формат пикселей и размер тайла описывают только тайловые записи
+        tiled = self.encoding != "png"
+        for image in self.snap.images:
+            i, layer, precision, width, height, fmt = image[:6]
+            entry = f"layers/layer_{i}{LAYER_ENCODINGS[self.encoding]}"
+            self.save_layer_pixels(image, entry)
 
-        for i, layer in enumerate(self.doc.layers._layers):
-            # === Запись в layers ===
             c.execute("""
-                INSERT INTO layers (id, name, type, visible, locked, opacity, z_value, scale, pos_x, pos_y)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO layer_image (layer_id, pixmap_path, precision, encoding, format, width, height, tile_size)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             """, (
-                i,
-                layer.name,
-                layer.type,
-                int(layer.visible),
-                int(layer.locked),
-                layer.opacity,
-                layer.z_value,
-                layer.scale,
-                layer.pos().x(),
-                layer.pos().y()
+                i, entry, precision, self.encoding,
+                fmt.value if tiled else None,
+                width, height,
+                TILE_SIZE if tiled else None
             ))
 
-            if layer.type == "Image":
-                filename = f"layer_{i}.png"
-                save_path = os.path.join(layers_dir, filename)
-                layer.pixmap.save(save_path, "PNG")
+        c.executemany("INSERT INTO layer_solid (layer_id, color_r, color_g, color_b) VALUES (?, ?, ?, ?)",
+                      self.snap.solids)
+        c.executemany("""
+            INSERT INTO layer_text(layer_id, text, font_family, font_size, color_r, color_g, color_b)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, self.snap.texts)
+
+
+    def save_layer_pixels(self, image, entry):
+        """
+        Пишет пиксели слоя в архив. Если они не менялись с прошлого сохранения
+        или открытия и лежат там в том же виде, готовая запись копируется из
+        прошлого .pld без перекодирования, иначе слой ставится в очередь.
+        """
+        self.check_cancel()
+        _, layer, _, _, _, fmt, revision, records, snapshot = image
+        digest = None
+        for saved_revision, saved_digest, source, saved_entry, stamp in records:
+            if os.path.splitext(saved_entry)[1] != os.path.splitext(entry)[1]:
+                continue
+            if saved_revision != revision:
+                if saved_digest is None or snapshot is None:
+                    continue
+                # Ревизия сменилась, но содержимое могло вернуться (отмена)
+                digest = digest or snapshot.digest()
+                if digest != saved_digest:
+                    continue
+            data = self.read_entry(source, saved_entry, stamp)
+            if data is not None:
+                stamp = self.write_layer(entry, [data], len(data))
+                self.saved.append((layer, (revision, saved_digest, entry, stamp)))
+                self.step(image)
+                return
+
+        # Кодируется позже, в пуле потоков (encode_layers) - со снимка тайлов;
+        # недекодированный слой перекодируется из своей прошлой записи
+        self.jobs.append((image, snapshot, records, fmt, revision, entry))
+
+    def encode_layers(self):
+        """
+        Кодирует отложенные слои параллельно в буферы памяти, готовые
+        сразу дописываются в архив (он пишется только из этого потока).
+        Снимки тайлов общие (неявно разделяемые) и только читаются,
+        QImage.save и zlib отпускают GIL. В памяти ждут записи не больше
+        двух готовых слоёв на поток.
+        """
+        quality = 100 - 11 * self.compression  # так Qt переводит quality в уровень zlib
+        workers = self.workers or os.cpu_count()
+
+        def encode(job):
+            image, snapshot, records, fmt, revision, entry = job
+            layer = image[1]
+            if snapshot is None and layer.loader is None:
+                # Слой в памяти, но его запись в файле уже не та (файл перезаписан):
+                # кодируем пиксели самого слоя - поверхность защищена своим замком
+                with layer.surface.lock:
+                    revision = layer.surface.revision
+                    snapshot = layer.surface.snapshot()
+            for _, _, source, saved_entry, stamp in records if snapshot is None else ():
+                try:
+                    snapshot = read_layer(source, saved_entry, fmt, stamp)
+                    break
+                except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+                    continue  # файла уже нет - следующая запись
+            if snapshot is None:
+                raise OSError(f"Нет пикселей для {entry}")
+            digest = snapshot.digest()
+            if self.encoding != "png":
+                # Куски ссылаются на пиксели снимка - он едет вместе с ними
+                level = self.compression if self.encoding == "zlib" else None
+                chunks, size = encode_tiles(snapshot, level)
+                return image, (revision, digest, entry), (chunks, size, snapshot)
+            buffer = QBuffer()
+            buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+            if not snapshot.to_image().save(buffer, "PNG", quality):
+                raise OSError(f"Не удалось закодировать {entry}")
+            data = buffer.data().data()
+            return image, (revision, digest, entry), ([data], len(data), None)
+
+        def write(future):
+            image, (revision, digest, entry), (chunks, size, _) = future.result()
+            stamp = self.write_layer(entry, chunks, size)
+            self.saved.append((image[1], (revision, digest, entry, stamp)))
+            self.step(image)
+
+        pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            pending = deque()
+            for job in self.jobs:
+                pending.append(pool.submit(encode, job))
+                if len(pending) >= 2 * workers:
+                    write(pending.popleft())
+            while pending:
+                write(pending.popleft())
+        finally:
+            # При отмене или ошибке очередь бросается, дожидаемся только начатых
+            pool.shutdown(cancel_futures=True)
+        self.jobs = []
+
+    def write_layer(self, entry, chunks, size):
+        """
+        Запись слоя без сжатия: PNG уже сжат, повторный deflate только тратит
+        время; тайлы кладутся с выравниванием, чтобы открывать их через mmap.
+        Возвращает отпечаток записи (entry_stamp).
+        """
+        if entry.endswith(".png"):
+            self.zf.writestr(entry, b"".join(chunks), zipfile.ZIP_STORED)
+        else:
+            write_aligned(self.zf, entry, chunks, size)
+        return entry_stamp(self.zf.getinfo(entry))
+
+    def read_entry(self, path, entry, stamp):
+        """
+        Байты записи прошлого .pld или None, если файла/записи уже нет или
+        в ней уже другие данные (файл перезаписали из другого документа)
+        """
+        try:
+            # Файл не держится открытым: его может подменить другое сохранение
+            with ARCHIVE_LOCK, zipfile.ZipFile(path, "r") as zf:
+                if entry_stamp(zf.getinfo(entry)) != stamp:
+                    return None
+                return zf.read(entry)
+        except (OSError, KeyError, zipfile.BadZipFile):
+            return None
+
+    # === 4. СРЕЗЫ ЭКСПОРТА ===
+    def save_slices(self):
+        c = self.conn.cursor()
+        c.executemany("INSERT INTO slices (id, name, x, y, width, height) VALUES (?, ?, ?, ?, ?, ?)",
+                      self.snap.slices)
 
-                c.execute("INSERT INTO layer_image (layer_id, pixmap_path) VALUES (?, ?)",
-                          (i, f"layers/{filename}"))
 
-            elif layer.type == "Solid":
-                r, g, b, _ = layer.solid_color.getRgb()
-                c.execute("INSERT INTO layer_solid (layer_id, color_r, color_g, color_b) VALUES (?, ?, ?, ?)",
-                          (i, r, g, b))
+class SaveSignals(QObject):
+    progress = pyqtSignal("qint64", "qint64")  # готово, всего (байт пикселей)
+    finished = pyqtSignal(object)  # SaveDoc
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
 
-            elif layer.type == "Text":
-                r, g, b, _ = layer.text_color.getRgb()
-                c.execute("""
-                INSERT INTO layer_text(layer_id, text, font_family, font_size, color_r, color_g, color_b)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    i,
-                    layer.text,
-                    layer.font.family(),
-                    layer.font.pixelSize(),
-                    r, g, b
-                ))
 
+class SaveJob(QRunnable):
+    """
+    Сохранение в пуле потоков Qt. Снимок документа берётся при создании
+    (в GUI-потоке), дальше документ можно менять: в файл попадёт снимок.
+    Записи слоям отмечаются вместе с подменой файла, по окончании - finished(SaveDoc).
+    """
+    def __init__(self, document, folder_path, **options):
+        super().__init__()
+        options.setdefault("attr", "saved")
+        # Одно ядро остаётся кисти - пока идёт сохранение, пользователь рисует
+        options.setdefault("workers", max(1, (os.cpu_count() or 1) - 1))
+        self.setAutoDelete(False)  # сигналы живут, пока задание хранит окно
+        self.snapshot = DocSnapshot(document, options.pop("encoding", None))
+        self.folder_path = folder_path
+        self.options = options
+        self.signals = SaveSignals()
+        self.cancel_event = threading.Event()
+        self.result = None  # SaveDoc, когда файл записан
+
+    def run(self):
+        try:
+            self.result = SaveDoc(self.snapshot, self.folder_path, progress=self.signals.progress.emit,
+                                  cancel=self.cancel_event, **self.options)
+        except SaveCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(self.result)
 
-class OpenDoc:
-    def __init__(self, file_path):
-        self.tmp_folder = os.path.dirname(os.path.abspath(__file__))
-        self.tmp_folder = os.path.join(self.tmp_folder, "prj")
+    def cancel(self):
+        self.cancel_event.set()
 
-        unpack(file_path, self.tmp_folder)
 
+class LayerLoader(QObject):
+    """
+    Декодирует PNG слоёв открытого проекта в пуле потоков, верхние слои
+    первыми; готовые тайлы отдаются слоям в GUI-потоке. Скрытые слои ждут
+    первого показа, а нужные прямо сейчас (штрих, экспорт) - декодируются
+    сразу, без очереди. Слой, чью запись прочитать не удалось, остаётся
+    пустым с сообщением в load_error, об этом сообщает failed.
+    """
+    decoded = pyqtSignal(object, object)  # слой, TileSurface или исключение
+    failed = pyqtSignal(object, str)  # слой, ошибка чтения
+
+    def __init__(self, workers=None):
+        super().__init__()
+        self.pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+        self.futures = {}  # слой -> Future
+        self.filling = None  # слой, которому сейчас отдаются пиксели
+        self.decoded.connect(self.on_decoded)
+
+    def start(self, layers):
+        """Ставит слои (снизу вверх) в очередь: видимые - сразу, сверху вниз"""
+        for layer in layers:
+            layer.loader = self
+        for layer in reversed(layers):
+            if layer.visible:
+                self.request(layer)
+
+    def request(self, layer):
+        if layer in self.futures:
+            return
+        future = self.pool.submit(decode_layer, layer)
+        self.futures[layer] = future
+        # Сигнал из потока пула доходит до GUI-потока через очередь событий
+        # (уже готовый future зовёт колбэк сразу, здесь же)
+        future.add_done_callback(
+            lambda f: f.cancelled() or self.decoded.emit(layer, f.exception() or f.result()))
+
+    def load(self, layer):
+        """Пиксели слоя нужны сейчас: дожидается декодирования или декодирует сам"""
+        future = self.futures.get(layer)
         try:
-            self.db_path = os.path.join(self.tmp_folder, "project.db")
-            self.manifest_path = os.path.join(self.tmp_folder, "manifest.json")
-        except FileNotFoundError:
-            raise NotCorrectFolder("Please select correct folder")
+            if future is not None and not future.cancel():
+                surface = future.result()
+            else:
+                surface = decode_layer(layer)
+        except Exception as e:
+            surface = e
+        self.on_decoded(layer, surface)
+
+    def on_decoded(self, layer, surface):
+        self.futures.pop(layer, None)
+        if layer.loader is not self:  # слой мог дождаться своих пикселей раньше сигнала
+            return
+        if isinstance(surface, Exception):
+            # Запись повреждена или файла нет: слой остаётся пустым, его запись
+            # в layer.saved не трогаем - при сохранении она копируется как есть
+            layer.loader = None
+            layer.load_error = str(surface) or type(surface).__name__
+            self.failed.emit(layer, layer.load_error)
+        else:
+            self.filling = layer
+            try:
+                layer.fill(surface)
+            finally:
+                self.filling = None
+
+    def stop(self):
+        """Бросает очередь (при закрытии документа)"""
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class OpenDoc:
+    """
+    Открывает .pld без распаковки: manifest и база читаются прямо из архива,
+    документ со всеми слоями собирается сразу, а пиксели Image-слоёв потом
+    декодирует в фоне LayerLoader.
+    """
+    def __init__(self, file_path, workers=None):
+        self.file_path = os.path.abspath(file_path)
+        self.workers = workers  # потоков декодирования (None - по числу ядер)
+
+        with zipfile.ZipFile(self.file_path, "r") as zf:
+            try:
+                self.manifest = zf.read("manifest.json")
+                self.db = zf.read("project.db")
+            except KeyError:
+                raise NotCorrectFolder("Please select correct folder")
+            # Размер и глубина PNG-слоёв - из заголовков, сами картинки не читаются
+            self.headers = {}
+            self.stamps = {}  # запись слоя -> entry_stamp
+            for info in zf.infolist():
+                name = info.filename
+                if name.startswith("layers/"):
+                    self.stamps[name] = entry_stamp(info)
+                if name.startswith("layers/") and name.endswith(".png"):
+                    with zf.open(name) as f:
+                        self.headers[name] = png_header(f.read(25))
 
     def get_opened_document(self):
         # Чтение manifest
-        try:
-            with open(self.manifest_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except FileNotFoundError:
-            raise NotCorrectFolder("Please select correct folder")
+        data = json.loads(self.manifest)
 
         doc = Document(
             name=data["project_name"],
@@ -245,20 +618,28 @@ class OpenDoc:
             height=data["canvas_height"]
         )
         doc.color = QColor(*data["color"])
+        doc.precision = data.get("precision", DEFAULT_PRECISION)
+        doc.layer_encoding = data.get("layer_encoding", "png")
         doc.created = data["created"]
         doc.modified = data["modified"]
         doc.version = data["version"]
         if data["discription"]:
             doc.dsc = data["discription"]
 
-        conn = sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(":memory:")
+        conn.deserialize(self.db)
         c = conn.cursor()
+        images = []  # Image-слои, чьи пиксели ещё в архиве
 
         #  layers
-        c.execute("SELECT id, name, type, visible, locked, opacity, z_value, scale, pos_x, pos_y FROM layers")
-        layers = c.fetchall()
+        try:
+            c.execute("SELECT id, name, type, visible, locked, opacity, z_value, scale, pos_x, pos_y, blend_mode FROM layers")
+            layers = c.fetchall()
+        except sqlite3.OperationalError:  # проекты до появления режимов наложения
+            c.execute("SELECT id, name, type, visible, locked, opacity, z_value, scale, pos_x, pos_y FROM layers")
+            layers = [row + (DEFAULT_BLEND,) for row in c.fetchall()]
 
-        for layer_id, name, ltype, visible, locked, opacity, z_value, scale, pos_x, pos_y in layers:
+        for layer_id, name, ltype, visible, locked, opacity, z_value, scale, pos_x, pos_y, blend_mode in layers:
             if ltype == "Layer":
                 continue
 
@@ -269,11 +650,25 @@ class OpenDoc:
                 layer = doc.layers.get_active_layer()
 
             elif ltype == "Image":
-                c.execute("SELECT pixmap_path FROM layer_image WHERE layer_id=?", (layer_id,))
-                (pixmap_path,) = c.fetchone()
-                pixmap = QPixmap(os.path.join(self.tmp_folder, pixmap_path))
-                doc.add_pixmap_layer(name, pixmap)
-                layer = doc.layers.get_active_layer()
+                try:
+                    c.execute("SELECT pixmap_path, precision FROM layer_image WHERE layer_id=?", (layer_id,))
+                    pixmap_path, precision = c.fetchone()
+                except sqlite3.OperationalError:  # проекты до появления точности
+                    c.execute("SELECT pixmap_path FROM layer_image WHERE layer_id=?", (layer_id,))
+                    (pixmap_path,), precision = c.fetchone(), None
+                if pixmap_path.endswith(".png"):
+                    width, height, depth = self.headers[pixmap_path]
+                    # Без указанной точности берём ту, что в самом PNG - тогда конвертации нет
+                    precision = precision or (16 if depth > 8 else 8)
+                else:
+                    c.execute("SELECT width, height FROM layer_image WHERE layer_id=?", (layer_id,))
+                    width, height = c.fetchone()
+                layer = Image(name, doc.scene, None, width, height, precision=precision)
+                layer.set_locked(False)
+                doc.layers.add_layer(layer=layer)
+                # Пока слой не тронут, сохранение возьмёт эту запись как есть
+                layer.saved = (layer.surface.revision, None, self.file_path, pixmap_path, self.stamps.get(pixmap_path))
+                images.append(layer)
 
             elif ltype == "Text":
                 c.execute("SELECT text, font_family, font_size, color_r, color_g, color_b FROM layer_text WHERE layer_id=?", (layer_id,))
@@ -292,9 +687,21 @@ class OpenDoc:
             layer.group.setZValue(z_value)
             layer.group.setPos(QPointF(pos_x, pos_y))
             layer.set_scale(scale / 100)
+            layer.set_blend_mode(blend_mode or DEFAULT_BLEND)
+
+        #  slices
+        try:
+            c.execute("SELECT name, x, y, width, height FROM slices ORDER BY id")
+            doc.slices = [Slice(name, QRect(x, y, w, h)) for name, x, y, w, h in c.fetchall()]
+        except sqlite3.OperationalError:  # проекты до появления срезов
+            pass
 
         conn.close()
-        clear_folder(self.tmp_folder)
         for i, layer in enumerate(doc.layers._layers):
             layer.set_z(i)
+        doc.history.clear()  # загрузка проекта не отменяется
+
+        if images:
+            doc.loader = LayerLoader(self.workers)
+            doc.loader.start(images)
         return doc, data["version"]
@@ -0,0 +1,318 @@
+"""
+История изменений (undo/redo).
+Штрихи хранятся потайлово, старые записи при нехватке памяти уходят в
+сжатый журнал на диске.
+"""
+
+import time
+import tempfile
+import threading
+import zlib
+from contextlib import contextmanager
+
+from PyQt6.QtGui import QImage
+
+DEFAULT_BUDGET = 512 * 1024 * 1024  # байт в памяти на историю одного документа
+MAX_DEPTH = 500
+# Шаги ползунка или счётчика склеиваются в одно действие, если идут подряд
+# не дольше MERGE_INTERVAL секунд; свойства-переключатели не склеиваются
+MERGE_INTERVAL = 1.0
+MERGED_SETTERS = {"set_opacity", "set_scale"}
+
+
+class Journal:
+    """Сжатые тайлы в анонимном временном файле (удаляется сам при закрытии)"""
+    def __init__(self):
+        self.file = tempfile.TemporaryFile(prefix="photolite-history-")
+        self.lock = threading.Lock()
+
+    def write(self, image: QImage):
+        data = image.constBits().asstring(image.sizeInBytes())
+        packed = zlib.compress(data, 1)
+        with self.lock:
+            self.file.seek(0, 2)
+            offset = self.file.tell()
+            self.file.write(packed)
+        return JournalTile(self, offset, len(packed), image.width(), image.height(),
+                           image.bytesPerLine(), image.format())
+
+    def read(self, offset, length):
+        with self.lock:
+            self.file.seek(offset)
+            return zlib.decompress(self.file.read(length))
+
+    def close(self):
+        self.file.close()
+
+
+class JournalTile:
+    """Ссылка на тайл, выгруженный в журнал"""
+    def __init__(self, journal, offset, length, width, height, bpl, fmt):
+        self.journal = journal
+        self.offset = offset
+        self.length = length
+        self.size = (width, height, bpl)
+        self.format = fmt
+
+    def load(self) -> QImage:
+        width, height, bpl = self.size
+        data = self.journal.read(self.offset, self.length)
+        # copy() - чтобы картинка не ссылалась на временный буфер
+        return QImage(data, width, height, bpl, self.format).copy()
+
+
+class Command:
+    """Одно действие в истории"""
+    nbytes = 0  # сколько памяти держит запись
+
+    def undo(self):
+        pass
+
+    def redo(self):
+        pass
+
+    def merge(self, other) -> bool:
+        """Пытается поглотить следующую команду (например, шаги ползунка)"""
+        return False
+
+    def empty(self) -> bool:
+        """Ничего не меняет (после склейки вернулись к исходному)"""
+        return False
+
+    def spill(self, journal):
+        """Выгружает тяжёлые данные в журнал"""
+        pass
+
+
+class TilesCommand(Command):
+    """Изменение пикселей слоя: состояния затронутых тайлов до и после"""
+    def __init__(self, layer, before: dict, after: dict):
+        self.layer = layer
+        self.before = before  # key -> QImage | JournalTile | None
+        self.after = after
+        self.nbytes = sum(t.sizeInBytes() for t in list(before.values()) + list(after.values())
+                          if isinstance(t, QImage))
+
+    def undo(self):
+        self.layer.set_tiles(self._load(self.before))
+
+    def redo(self):
+        self.layer.set_tiles(self._load(self.after))
+
+    @staticmethod
+    def _load(states):
+        return {key: t.load() if isinstance(t, JournalTile) else t for key, t in states.items()}
+
+    def spill(self, journal):
+        for states in (self.before, self.after):
+            for key, tile in states.items():
+                if isinstance(tile, QImage):
+                    states[key] = journal.write(tile)
+        self.nbytes = 0
+
+
+class ReleaseTilesCommand(Command):
+    """
+    Тайлы слоя, убранного из документа (слияние, сведение), освобождены
+    сразу; для отмены они лежат в журнале, states: key -> JournalTile.
+    """
+    def __init__(self, layer, states: dict):
+        self.layer = layer
+        self.states = states
+
+    def undo(self):
+        self.layer.set_tiles(TilesCommand._load(self.states))
+
+    def redo(self):
+        self.layer.surface.release()
+
+
+class AddLayerCommand(Command):
+    def __init__(self, manager, layer, index):
+        self.manager = manager
+        self.layer = layer
+        self.index = index
+
+    def undo(self):
+        self.manager.remove(self.index)
+
+    def redo(self):
+        self.manager.insert(self.index, self.layer)
+
+
+class RemoveLayerCommand(AddLayerCommand):
+    def undo(self):
+        super().redo()
+
+    def redo(self):
+        super().undo()
+
+
+class SwapLayersCommand(Command):
+    def __init__(self, manager, i, j):
+        self.manager = manager
+        self.i = i
+        self.j = j
+
+    def undo(self):
+        self.manager.swap(self.i, self.j)
+
+    redo = undo
+
+
+class PropertyCommand(Command):
+    """Изменение свойства слоя через его сеттер (set_opacity, set_name, ...)"""
+    def __init__(self, layer, setter, old, new):
+        self.layer = layer
+        self.setter = setter
+        self.old = old
+        self.new = new
+        self.time = time.monotonic()
+
+    def undo(self):
+        getattr(self.layer, self.setter)(self.old)
+
+    def redo(self):
+        getattr(self.layer, self.setter)(self.new)
+
+    def merge(self, other):
+        if (isinstance(other, PropertyCommand) and other.layer is self.layer
+                and other.setter == self.setter and self.setter in MERGED_SETTERS
+                and other.time - self.time < MERGE_INTERVAL):
+            self.new = other.new
+            self.time = other.time
+            return True
+        return False
+
+    def empty(self):
+        return self.old == self.new
+
+
+class MacroCommand(Command):
+    """Несколько команд как одно действие"""
+    def __init__(self, commands):
+        self.commands = commands
+        self.nbytes = sum(c.nbytes for c in commands)
+
+    def undo(self):
+        for command in reversed(self.commands):
+            command.undo()
+
+    def redo(self):
+        for command in self.commands:
+            command.redo()
+
+    def spill(self, journal):
+        for command in self.commands:
+            command.spill(journal)
+        self.nbytes = 0
+
+
+class History:
+    """
+    Стеки undo/redo документа с бюджетом памяти.
+    Команды могут приходить из потока кисти, поэтому всё под замком.
+    """
+    def __init__(self, budget=DEFAULT_BUDGET, max_depth=MAX_DEPTH):
+        self.budget = budget
+        self.max_depth = max_depth
+        self.undo_stack = []
+        self.redo_stack = []
+        self.recording = True
+        self.journal = None
+        self.lock = threading.RLock()
+        self._macro = None
+
+    @contextmanager
+    def paused(self):
+        """Действия внутри блока не записываются (откат, загрузка проекта)"""
+        recording, self.recording = self.recording, False
+        try:
+            yield
+        finally:
+            self.recording = recording
+
+    @contextmanager
+    def macro(self):
+        """Всё, что записано внутри блока, откатывается одним шагом"""
+        with self.lock:
+            outer, self._macro = self._macro, []
+        try:
+            yield
+        finally:
+            with self.lock:
+                commands, self._macro = self._macro, outer
+            if commands:
+                self.push(MacroCommand(commands))
+
+    def get_journal(self) -> Journal:
+        """Журнал на диске (создаётся при первой выгрузке)"""
+        with self.lock:
+            if self.journal is None:
+                self.journal = Journal()
+            return self.journal
+
+    def push(self, command: Command):
+        if not self.recording:
+            return
+        with self.lock:
+            if self._macro is not None:
+                self._macro.append(command)
+                return
+            self.redo_stack.clear()
+            if self.undo_stack and self.undo_stack[-1].merge(command):
+                if self.undo_stack[-1].empty():
+                    self.undo_stack.pop()
+                return
+            self.undo_stack.append(command)
+            if len(self.undo_stack) > self.max_depth:
+                self.undo_stack.pop(0)
+            self._enforce_budget()
+
+    def undo(self):
+        with self.lock:
+            if not self.undo_stack:
+                return False
+            command = self.undo_stack.pop()
+            with self.paused():
+                command.undo()
+            self.redo_stack.append(command)
+            return True
+
+    def redo(self):
+        with self.lock:
+            if not self.redo_stack:
+                return False
+            command = self.redo_stack.pop()
+            with self.paused():
+                command.redo()
+            self.undo_stack.append(command)
+            return True
+
+    def can_undo(self):
+        return bool(self.undo_stack)
+
+    def can_redo(self):
+        return bool(self.redo_stack)
+
+    def memory(self) -> int:
+        with self.lock:
+            return sum(c.nbytes for c in self.undo_stack + self.redo_stack)
+
+    def clear(self):
+        with self.lock:
+            self.undo_stack.clear()
+            self.redo_stack.clear()
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+
+    def _enforce_budget(self):
+        """Самые старые записи уходят в журнал, пока не уложимся в бюджет"""
+        used = self.memory()
+        for command in self.undo_stack:
+            if used <= self.budget:
+                break
+            if command.nbytes:
+                used -= command.nbytes
+                command.spill(self.get_journal())
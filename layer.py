@@ -2,11 +2,70 @@
 Слои и менеджер слоев
 """
 
-import math
-
-from PyQt6.QtWidgets import QGraphicsItemGroup, QGraphicsRectItem, QGraphicsTextItem, QGraphicsPixmapItem
-from PyQt6.QtGui import QBrush, QPen, QPainter, QColor, QFont, QRadialGradient, QPixmap, QImage
-from PyQt6.QtCore import Qt, QSize
+from contextlib import nullcontext
+
+from PyQt6.QtWidgets import (QGraphicsItemGroup, QGraphicsRectItem, QGraphicsTextItem, QGraphicsPixmapItem,
+                             QStyleOptionGraphicsItem)
+from PyQt6.QtGui import QBrush, QPen, QPainter, QColor, QFont, QPixmap, QImage
+from PyQt6.QtCore import Qt, QSize, QPointF, QRectF, QObject, pyqtSignal
+
+from tiles import TileSurface, TiledItem, PRECISIONS, DEFAULT_PRECISION
+from brush import stroke_dabs, dabs_bounds, paint_dabs
+from blend import BLEND_MODES, DEFAULT_BLEND
+from history import TilesCommand, PropertyCommand, AddLayerCommand, RemoveLayerCommand, SwapLayersCommand
+
+
+class Blended:
+    """Примесь для элементов слоя: рисуются в режиме наложения своего слоя"""
+    composition = QPainter.CompositionMode.CompositionMode_SourceOver
+
+    def paint(self, painter, option, widget=None):
+        painter.save()
+        painter.setCompositionMode(self.composition)
+        super().paint(painter, option, widget)
+        painter.restore()
+
+
+class BlendedRectItem(Blended, QGraphicsRectItem):
+    pass
+
+
+class BlendedTextItem(Blended, QGraphicsTextItem):
+    pass
+
+
+class LayerGroup(QGraphicsItemGroup):
+    """
+    Группа объектов слоя; перетаскивание мышью сообщается как изменение слоя
+    и по отпускании кнопки записывается в историю (все сдвинутые слои - одним шагом)
+    """
+    def __init__(self, layer):
+        super().__init__()
+        self.layer = layer
+        self._before = QRectF()
+        self._start = None  # положение до перетаскивания мышью
+        self.setFlag(QGraphicsItemGroup.GraphicsItemFlag.ItemSendsGeometryChanges)
+
+    def itemChange(self, change, value):
+        if change == QGraphicsItemGroup.GraphicsItemChange.ItemPositionChange:
+            self._before = self.sceneBoundingRect()
+            # Сдвиг без мыши (отмена, открытие проекта) сюда не попадает
+            if self._start is None and self.scene() is not None and self.scene().mouseGrabberItem() is not None:
+                self._start = self.pos()
+        elif change == QGraphicsItemGroup.GraphicsItemChange.ItemPositionHasChanged:
+            if self.layer.manager is not None:
+                self.layer.manager.layerChanged.emit(self.layer, self.sceneBoundingRect().united(self._before))
+        return super().itemChange(change, value)
+
+    def mouseReleaseEvent(self, event):
+        super().mouseReleaseEvent(event)
+        # Вместе с этим слоем могли ехать и другие выделенные
+        moved = [item for item in self.scene().items() if isinstance(item, LayerGroup) and item._start is not None]
+        history = self.layer.history
+        with history.macro() if history is not None else nullcontext():
+            for group in moved:
+                start, group._start = group._start, None
+                group.layer.record("set_pos", start, group.pos())
 
 
 class Layer:
@@ -20,9 +79,12 @@ class Layer:
         self.type = "Layer"
         self.z_value = z_value
         self.scale = 100
+        self.blend_mode = DEFAULT_BLEND
+        self.history = None  # история документа, выставляет LayerManager
+        self.manager = None
 
         # Создаём группу, добавляем её на сцену
-        self.group = QGraphicsItemGroup()
+        self.group = LayerGroup(self)
         self.group.setZValue(z_value)
         self.scene.addItem(self.group)
 
@@ -30,34 +92,80 @@ class Layer:
     def delete(self):
         self.scene.removeItem(self.group)
 
+    def restore(self):
+        """Вернуть удалённый слой на сцену (для отмены удаления)"""
+        self.scene.addItem(self.group)
+
+    def record(self, setter, old, new):
+        """Записать изменение свойства в историю"""
+        if self.history is not None and old != new:
+            self.history.push(PropertyCommand(self, setter, old, new))
+
+    def changed(self, rect=None):
+        """Сообщить, что изменилось содержимое слоя (rect - область слоя, None - весь)"""
+        if self.manager is not None:
+            if rect is not None:
+                rect = self.group.mapRectToScene(QRectF(rect))
+            self.manager.layerChanged.emit(self, rect)
+
+    def notify(self):
+        """Сообщить об изменении свойств, не влияющих на пиксели (имя, блокировка)"""
+        if self.manager is not None:
+            self.manager.layerUpdated.emit(self)
+
     def pos(self):
         return self.group.pos()
+
+    def set_pos(self, pos: QPointF):
+        """Сдвинуть слой (точка сцены левого верхнего угла)"""
+        self.record("set_pos", self.pos(), pos)
+        self.group.setPos(pos)
         
     def set_scale(self, scale):
+        self.record("set_scale", self.scale / 100, scale)
         self.group.setScale(scale)
         self.scale = scale * 100
+        self.changed()
 
     def set_name(self, name):
+        self.record("set_name", self.name, name)
         self.name = name
+        self.notify()
 
     def set_z(self, z_value):
         self.group.setZValue(z_value)
 
     def set_visible(self, state: bool):
         """Показать/скрыть слой"""
+        self.record("set_visible", self.visible, state)
         self.visible = state
         self.group.setVisible(state)
+        self.changed()
 
     def set_opacity(self, value: float):
         """Изменить прозрачность слоя (0.0–1.0)"""
+        self.record("set_opacity", self.opacity, value)
         self.opacity = value
         self.group.setOpacity(value)
+        self.changed()
+
+    def set_blend_mode(self, mode: str):
+        """Режим наложения слоя на нижние (см. blend.BLEND_MODES)"""
+        self.record("set_blend_mode", self.blend_mode, mode)
+        self.blend_mode = mode
+        for item in self.group.childItems():
+            if hasattr(item, "composition"):
+                item.composition = BLEND_MODES[mode]
+                item.update()
+        self.changed()
 
     def set_locked(self, state: bool):
         """Заблокировать или разблокировать слой (отключает интерактивность)"""
+        self.record("set_locked", self.locked, state)
         self.locked = state
         self.group.setFlag(self.group.GraphicsItemFlag.ItemIsSelectable, not state)
         self.group.setFlag(self.group.GraphicsItemFlag.ItemIsMovable, not state)
+        self.notify()
 
     def add_item(self, item):
         """Добавить объект на слой"""
@@ -69,21 +177,43 @@ class Layer:
         self.group.removeFromGroup(item)
         self.scene.removeItem(item)
 
+    def render(self, painter: QPainter, rect: QRectF, live=False):
+        """
+        Рисует содержимое слоя в координатах сцены, только область rect
+        (для сведения). Прозрачность слоя не применяется - это делает вызывающий.
+        live=True - как на экране, вместе с незавершённым штрихом.
+        """
+        option = QStyleOptionGraphicsItem()
+        for item in sorted(self.group.childItems(), key=lambda i: i.zValue()):
+            if not item.isVisibleTo(self.group):
+                continue
+            transform = item.sceneTransform()
+            option.exposedRect = transform.inverted()[0].mapRect(rect).intersected(item.boundingRect())
+            if option.exposedRect.isEmpty():
+                continue
+            painter.save()
+            painter.setTransform(transform, True)
+            item.paint(painter, option, None)
+            painter.restore()
+
     def get_preview(self, size: QSize = QSize(64, 64)) -> QPixmap:
         """Создает миниатюру слоя в виде QPixmap (для списка слоев)."""
-        preview = QPixmap(size)
-        preview.fill(Qt.GlobalColor.transparent)
-
+        if self.type == "Text" and self.text:
+            return QPixmap("ui\\icons\\text.svg").scaledToHeight(size.height() - 10)
+        return QPixmap.fromImage(self.preview_image(size))
+
+    def preview_image(self, size: QSize, surface=None) -> QImage:
+        """
+        Миниатюра слоя в QImage. Без QPixmap, поэтому для Image-слоя её можно
+        рисовать в фоновом потоке по снимку тайлов surface.
+        """
+        preview = QImage(size, QImage.Format.Format_ARGB32_Premultiplied)
         painter = QPainter(preview)
         painter.setRenderHint(QPainter.RenderHint.Antialiasing)
         painter.setRenderHint(QPainter.RenderHint.TextAntialiasing)
 
-        # Шахматный фон (для прозрачных областей)
-        cell = 8
-        for y in range(0, size.height(), cell):
-            for x in range(0, size.width(), cell):
-                color = QColor(200, 200, 200) if (x // cell + y // cell) % 2 == 0 else QColor(240, 240, 240)
-                painter.fillRect(x, y, cell, cell, color)
+        # Шахматный фон (для прозрачных областей) - одной заливкой текстурой
+        painter.fillRect(preview.rect(), QBrush(checker_image()))
 
         # Если слой невидим - делаем полупрозрачный
         if not self.visible:
@@ -96,21 +226,29 @@ class Layer:
             painter.fillRect(preview.rect(), self.solid_color)
 
         # --- Тип слоя: Image ---
-        elif self.type == "Image" and self.pixmap:
-            scaled = self.pixmap.scaled(size, Qt.AspectRatioMode.KeepAspectRatio,
-                                        Qt.TransformationMode.SmoothTransformation)
-            x = (size.width() - scaled.width()) // 2
-            y = (size.height() - scaled.height()) // 2
-            painter.drawPixmap(x, y, scaled)
-
-        # --- Тип слоя: Text ---
-        elif self.type == "Text" and self.text:
-            painter.end()
-            return QPixmap("ui\\icons\\text.svg").scaledToHeight(size.height() - 10)
+        elif self.type == "Image":
+            # Масштабируем прямо тайлы, не собирая слой целиком
+            surface = surface or self.surface
+            k = min(size.width() / surface.width, size.height() / surface.height)
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+            painter.translate((size.width() - surface.width * k) / 2, (size.height() - surface.height * k) / 2)
+            painter.scale(k, k)
+            surface.paint(painter)
 
         painter.end()
         return preview
 
+
+def checker_image(cell=8) -> QImage:
+    """Клетка 2x2 шахматного фона миниатюр"""
+    image = QImage(cell * 2, cell * 2, QImage.Format.Format_ARGB32_Premultiplied)
+    image.fill(QColor(240, 240, 240))
+    painter = QPainter(image)
+    painter.fillRect(0, 0, cell, cell, QColor(200, 200, 200))
+    painter.fillRect(cell, cell, cell, cell, QColor(200, 200, 200))
+    painter.end()
+    return image
+
 class Solid(Layer):
     def __init__(self, name, scene, bgcolor=Qt.GlobalColor.white, width=1920, height=1080, z_value=0):
         super().__init__(name, scene, bgcolor, width, height, z_value)
@@ -121,90 +259,214 @@ class Solid(Layer):
         self.solid_color = QColor(bgcolor)
 
         # Добавляем фоновый прямоугольник
-        rect_item = QGraphicsRectItem(0, 0, self.width, self.height)
+        rect_item = BlendedRectItem(0, 0, self.width, self.height)
         rect_item.setBrush(QBrush(bgcolor))
         rect_item.setPen(QPen(Qt.GlobalColor.black, 1))
         rect_item.setZValue(100000)  # чтобы фон был под всем остальным
         self.add_item(rect_item)
 
-from PyQt6.QtGui import QPainter, QPen, QColor
-from PyQt6.QtCore import Qt
-
-
 class Image(Layer):
-    def __init__(self, name, scene, pixmap, width=1920, height=1080, z_value=1):
+    def __init__(self, name, scene, pixmap=None, width=1920, height=1080, z_value=1, precision=DEFAULT_PRECISION):
         super().__init__(name, scene, None, width, height, z_value)
         self.type = "Image"
-        self.pixmap = pixmap
+        self.precision = precision
 
-        print(self.pixmap.hasAlphaChannel())
-        img = self.pixmap.toImage()
-        if img.format() != QImage.Format.Format_RGBA64:
-            img = img.convertToFormat(QImage.Format.Format_RGBA64)
-            self.pixmap = QPixmap.fromImage(img)
-        print(img.format() == QImage.Format.Format_RGBA64)
+        # Пиксели храним тайлами: память растёт с закрашенной площадью, а не с холстом
+        if pixmap is None:
+            self.surface = TileSurface(width, height, PRECISIONS[precision])
+        else:
+            img = pixmap.toImage() if isinstance(pixmap, QPixmap) else pixmap
+            self.surface = TileSurface.from_image(img, PRECISIONS[precision])
+        self.width = self.surface.width
+        self.height = self.surface.height
 
-        self.item = QGraphicsPixmapItem(self.pixmap)
+        self.item = TiledItem(self.surface)
         self.item.setFlags(QGraphicsPixmapItem.GraphicsItemFlag.ItemIsMovable |
-                           QGraphicsPixmapItem.GraphicsItemFlag.ItemIsSelectable)
+                           QGraphicsPixmapItem.GraphicsItemFlag.ItemIsSelectable |
+                           QGraphicsPixmapItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
         self.add_item(self.item)
 
-    def draw_line(self, p1, p2, color: QColor, width=20, erase=False, hardness=0, start_alpha=255):
-        """Плавное рисование кистью или ластиком с регулируемой жёсткостью и альфой."""
-        if self.locked:
-            return
-
-        # Подготовка цвета
-        r, g, b = color.red(), color.green(), color.blue()
-        h = hardness / 100.0
-        a0 = start_alpha
-        a1 = int(a0 * h)  # альфа на краю
-
-        # Создание радиального градиента
-        gradient = QRadialGradient(width, width, width)
-        if erase:
-            gradient.setColorAt(0.0, QColor(0, 0, 0, a0))
-            gradient.setColorAt(h,   QColor(0, 0, 0, a0))
-            gradient.setColorAt(1.0, QColor(0, 0, 0, a1))
-        else:
-            gradient.setColorAt(0.0, QColor(r, g, b, a0))
-            gradient.setColorAt(h,   QColor(r, g, b, a0))
-            gradient.setColorAt(1.0, QColor(r, g, b, a1))
+        self._carry = None  # путь после последнего мазка
+        self._last_point = None
+        # Где пиксели уже лежат в файле: (ревизия поверхности, хэш, путь .pld,
+        # запись в архиве, её CRC32 и размер). Пока ревизия та же и запись в
+        # файле не сменилась, сохранение берёт готовый PNG
+        self.saved = None
+        self.autosaved = None  # то же для файла восстановления (autosave)
+        # Пиксели ещё декодируются из открытого проекта (file_logic.LayerLoader)
+        self.loader = None
+        self.load_error = None  # почему пиксели не прочитались из файла проекта
+
+    def load(self):
+        """Дожидается пикселей слоя, если они ещё не декодированы из файла проекта"""
+        if self.loader is not None:
+            self.loader.load(self)
+
+    def fill(self, surface: TileSurface):
+        """
+        Кладёт декодированные тайлы слоя. Ревизия не растёт: пиксели те же,
+        что в файле, и сохранение по-прежнему возьмёт готовый PNG.
+        """
+        with self.surface.lock:
+            self.surface.tiles = surface.tiles
+            self.surface.mips.clear()
+            self.surface.mips_valid.clear()
+        self.loader = None
+        self.item.update()
+        self.changed()
 
-        brush = QBrush(gradient)
-
-        # Настраиваем painter
-        painter = QPainter(self.pixmap)
-        #painter.setOpacity(start_alpha / 255)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-        painter.setPen(Qt.PenStyle.NoPen)
+    def set_visible(self, state: bool):
+        super().set_visible(state)
+        if state and self.loader is not None:
+            self.loader.request(self)  # скрытый слой декодируется при первом показе
+
+    def set_precision(self, precision):
+        """8 или 16 бит на канал"""
+        self.load()
+        self.record("set_precision", self.precision, precision)
+        self.precision = precision
+        self.surface.convert(PRECISIONS[precision])
+        self.item.update()
+        self.changed()
+
+    def render(self, painter: QPainter, rect: QRectF, live=False, transform=None):
+        """
+        Рисует тайлы прямо с поверхности, без буфера незавершённого штриха.
+        Уменьшенный слой берётся с подходящего уровня пирамиды - без муара.
+        transform - трансформация слоя на сцене, прочитанная заранее в GUI-потоке
+        (тогда рисовать можно из другого потока).
+        """
+        if live:
+            return super().render(painter, rect)
+        if transform is None:
+            transform = self.item.sceneTransform()
+        painter.save()
+        painter.setTransform(transform, True)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        zoom = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        self.surface.paint(painter, transform.inverted()[0].mapRect(rect), self.surface.level_for(zoom))
+        painter.restore()
+
+    def to_image(self, rect=None) -> QImage:
+        """Собирает слой в одно изображение (для сохранения/экспорта)"""
+        return self.surface.to_image(rect)
+
+    def begin_stroke(self):
+        """
+        Начало нового штриха: следующий мазок ставится прямо в первую точку,
+        а сами мазки копятся в буфере штриха, который показывается поверх слоя.
+        """
+        self._carry = None
+        self._last_point = None
+        self.item.wet = TileSurface(self.width, self.height, self.surface.format)
+        self.item.wet_erase = False
+
+    def end_stroke(self):
+        """
+        Конец штриха: буфер штриха один раз сливается со слоем, затронутые
+        тайлы уходят в историю одной записью. Возвращает изменившуюся область.
+        """
+        self._carry = None
+        self._last_point = None
+        wet, erase = self.item.wet, self.item.wet_erase
+        if wet is None:
+            return QRectF()
 
         if erase:
-            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_DestinationOut)
+            mode = QPainter.CompositionMode.CompositionMode_DestinationOut
         else:
-            painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_SourceOver)
-
-        # Расстояние между точками
-        dx = p2.x() - p1.x()
-        dy = p2.y() - p1.y()
-        dist = math.hypot(dx, dy)
-        steps = int(dist / 100) + 1
-
-        # Рисуем плавно
-        for i in range(steps):
-            t = i / steps
-            x = p1.x() + dx * t - self.pos().x()
-            y = p1.y() + dy * t - self.pos().y()
-            painter.save()
-            painter.translate(x - width, y - width)
-            painter.setBrush(brush)
-            painter.drawEllipse(0, 0, width * 2, width * 2)
-            painter.restore()
+            mode = QPainter.CompositionMode.CompositionMode_SourceOver
+
+        before = {}
+        rect = QRectF()
+        # Слияние и снятие буфера под одним замком - GUI не увидит штрих дважды
+        with self.surface.lock, wet.lock:
+            for key, stroke in wet.tiles.items():
+                old = self.surface.tiles.get(key)
+                before[key] = QImage(old) if old is not None else None
+                tile = self.surface.tile(key, create=not erase)
+                if tile is not None:
+                    painter = QPainter(tile)
+                    painter.setCompositionMode(mode)
+                    painter.drawImage(0, 0, stroke)
+                    painter.end()
+                rect = rect.united(QRectF(self.surface.tile_rect(key)))
+            if erase:
+                self.surface.compact(before)
+            self.surface.touch(before)
+            self.item.wet = None
+
+            # QImage(tile) - общая копия, следующий штрих её не испортит
+            after = {key: QImage(self.surface.tiles[key]) if key in self.surface.tiles else None
+                     for key in before}
+        if before and self.history is not None:
+            self.history.push(TilesCommand(self, before, after))
+        return rect
+
+    def set_tiles(self, states: dict):
+        """Подменяет тайлы (None - удалить тайл), например при отмене штриха"""
+        rect = QRectF()
+        with self.surface.lock:
+            for key, tile in states.items():
+                if tile is None:
+                    self.surface.tiles.pop(key, None)
+                else:
+                    self.surface.tiles[key] = QImage(tile)
+                rect = rect.united(QRectF(self.surface.tile_rect(key)))
+            self.surface.touch(states)
+        self.item.update(rect)
+        self.changed(rect)
 
-        painter.end()
-
-        if self.item:
-            self.item.setPixmap(self.pixmap)
+    def draw_line(self, p1, p2, color: QColor, width=20, erase=False, hardness=0, start_alpha=255):
+        """
+        Плавное рисование кистью или ластиком с регулируемой жёсткостью и альфой.
+        Возвращает прямоугольник, который реально изменился (в координатах слоя).
+        """
+        return self.draw_polyline([p1, p2], color, width, erase, hardness, start_alpha)
+
+    def draw_polyline(self, points, color: QColor, width=20, erase=False, hardness=0, start_alpha=255):
+        """Рисует штрих по ломаной (точки в координатах сцены) и обновляет сцену"""
+        bounds = self.rasterize(points, color, width, erase, hardness, start_alpha)
+        if not bounds.isEmpty():
+            # Перерисовываем только изменившуюся область, а не весь слой
+            self.item.update(bounds)
+            self.changed(bounds)
+        return bounds
+
+    def rasterize(self, points, color: QColor, width=20, erase=False, hardness=0, start_alpha=255):
+        """
+        Растеризует штрих по ломаной в тайлы, не трогая сцену (можно звать
+        из фонового потока). Мазки ставятся с шагом, пропорциональным ширине
+        кисти; шаг продолжается между вызовами, если новая ломаная начинается
+        там, где кончилась старая. Возвращает изменившийся прямоугольник.
+        """
+        if self.locked or not points:
+            return QRectF()
+
+        pos = self.pos()
+        points = [(p.x() - pos.x(), p.y() - pos.y()) for p in points]
+        if points[0] != self._last_point:
+            self._carry = None
+        dabs, self._carry = stroke_dabs(points, width, self._carry)
+        self._last_point = points[-1]
+        if not dabs:
+            return QRectF()
+
+        bounds = dabs_bounds(dabs, width).intersected(QRectF(self.surface.rect()))
+
+        wet = self.item.wet
+        if wet is not None:
+            # Внутри штриха рисуем в буфер; для ластика в нём копится только альфа
+            self.item.wet_erase = erase
+            color = QColor(0, 0, 0, start_alpha) if erase else QColor(color.red(), color.green(), color.blue(), start_alpha)
+            paint_dabs(wet, dabs, width, hardness, color, wet=True)
+            return bounds
+
+        color = QColor(color.red(), color.green(), color.blue(), start_alpha)
+        keys = paint_dabs(self.surface, dabs, width, hardness, color, erase)
+        if erase:
+            self.surface.compact(keys)
+        return bounds
 
 class Text(Layer):
     def __init__(self, name, scene, color=QColor(0, 0, 0), text="Lorem ipsum", z_value=0):
@@ -217,7 +479,7 @@ class Text(Layer):
         self.font.setPixelSize(150)
         self.text_color = QColor(color)
 
-        self.item = QGraphicsTextItem(self.text)
+        self.item = BlendedTextItem(self.text)
         self.item.setFont(self.font)
         self.item.setFlags(QGraphicsPixmapItem.GraphicsItemFlag.ItemIsMovable |
                     QGraphicsPixmapItem.GraphicsItemFlag.ItemIsSelectable)
@@ -225,32 +487,61 @@ class Text(Layer):
         self.add_item(self.item)
 
     def set_text(self, text):
+        self.record("set_text", self.text, text)
         self.text = text
         self.item.setPlainText(self.text)
+        self.changed()
 
     def set_font(self, font):
+        self.record("set_font", self.font, font)
         self.font = font
         self.item.setFont(self.font)
+        self.changed()
 
     def set_color(self, color):
+        self.record("set_color", self.text_color, color)
         self.text_color = color
         self.item.setDefaultTextColor(self.text_color)
+        self.changed()
 
-class LayerManager:
+class LayerManager(QObject):
     """Управляет всеми слоями документа"""
-    def __init__(self, scene):
+    # (слой, QRectF области сцены или None - весь слой): изменилось содержимое
+    layerChanged = pyqtSignal(object, object)
+    # (слой): изменились свойства без пикселей - имя, блокировка
+    layerUpdated = pyqtSignal(object)
+    # добавление, удаление или перестановка слоёв
+    layersChanged = pyqtSignal()
+
+    def __init__(self, scene, history=None):
+        super().__init__()
         self.scene = scene
+        self.history = history
         self._layers = []
         self.active_layer = None
 
     def add_layer(self, name=None, layer: Layer=None):
         if not layer:
             layer = Layer(name, self.scene)
-        layer.set_z(len(self._layers))
-        self._layers.append(layer)
+        self.insert(len(self._layers), layer)
         self.active_layer = layer
         return layer
 
+    def insert(self, index, layer: Layer):
+        if layer.group.scene() is None:
+            layer.restore()
+        layer.history = self.history
+        layer.manager = self
+        self._layers.insert(index, layer)
+        self.update_z()
+        self.layersChanged.emit()
+        if self.history is not None:
+            self.history.push(AddLayerCommand(self, layer, index))
+
+    def update_z(self):
+        for i, layer in enumerate(self._layers):
+            layer.set_z(i)
+
     def list_layers(self):
         return [layer.name for layer in reversed(self._layers)]  # сверху вниз
 
@@ -258,8 +549,14 @@ class LayerManager:
         return self.active_layer
     
     def remove(self, index):
-        self._layers[index].delete()
-        self._layers.pop(index)
+        layer = self._layers.pop(index)
+        layer.delete()
+        if self.active_layer is layer:
+            self.active_layer = None
+        self.update_z()
+        self.layersChanged.emit()
+        if self.history is not None:
+            self.history.push(RemoveLayerCommand(self, layer, index))
 
     def move(self, index, direction):
         if direction:
@@ -267,7 +564,11 @@ class LayerManager:
         else:
             vector = 1
 
-        self._layers[index-vector], self._layers[index] = self._layers[index], self._layers[index-vector]
+        self.swap(index - vector, index)
 
-        for i, layer in enumerate(self._layers):
-            layer.set_z(i)
+    def swap(self, i, j):
+        self._layers[i], self._layers[j] = self._layers[j], self._layers[i]
+        self.update_z()
+        self.layersChanged.emit()
+        if self.history is not None:
+            self.history.push(SwapLayersCommand(self, i, j))
@@ -0,0 +1,133 @@
+"""
+Хранение пикселей слоя в .pld без PNG: тайлы как есть, в том формате,
+в котором они лежат в памяти (premultiplied), по желанию - каждый сжат
+zlib отдельно. Запись в архиве хранится без сжатия (ZIP_STORED) и
+выровнена по странице, так что при открытии файл отображается в память
+(mmap) и тайлы копируются прямо из него, без распаковки и декодирования.
+
+Формат записи: заголовок HEADER, оглавление INDEX (по строке на тайл),
+дальше тайлы - каждый с выровненного смещения от начала записи.
+"""
+
+import mmap
+import time
+import struct
+import zipfile
+import zlib
+
+from PyQt6.QtGui import QImage, QPainter
+from PyQt6.QtCore import Qt
+
+from tiles import TileSurface, TILE_SIZE
+
+TILES_MAGIC = b"PLT1"
+# магия, формат QImage, ширина, высота, размер тайла, сжат ли zlib, число тайлов
+HEADER = struct.Struct("<4sIIIIII")
+INDEX = struct.Struct("<iiQQ")  # tx, ty, смещение от начала записи, длина
+ALIGN = 4096  # выравнивание данных записи и тайлов - страница памяти
+ALIGN_EXTRA = 0xD935  # id поля extra с отступом (так же выравнивает zipalign)
+
+
+def align(offset):
+    return -offset % ALIGN
+
+
+def encode_tiles(surface: TileSurface, level=None):
+    """
+    Запись тайлов поверхности: (куски байт, общий размер). level - уровень
+    zlib, None - без сжатия. Куски без сжатия ссылаются прямо на пиксели
+    тайлов - surface (снимок) должна жить, пока они не записаны.
+    """
+    keys = sorted(surface.tiles)
+    header_size = HEADER.size + INDEX.size * len(keys)
+    offset = header_size + align(header_size)
+    index, data = [], []
+    for key in keys:
+        tile = surface.tiles[key]
+        bits = tile.constBits()
+        bits.setsize(tile.sizeInBytes())
+        chunk = memoryview(bits) if level is None else zlib.compress(bits, level)
+        index.append(INDEX.pack(key[0], key[1], offset, len(chunk)))
+        data.append(chunk)
+        offset += len(chunk) + align(len(chunk))
+
+    head = HEADER.pack(TILES_MAGIC, surface.format.value, surface.width, surface.height,
+                       TILE_SIZE, level is not None, len(keys)) + b"".join(index)
+    chunks = [head, bytes(align(len(head)))]
+    for chunk in data:
+        chunks.append(chunk)
+        chunks.append(bytes(align(len(chunk))))
+    return chunks, offset
+
+
+def decode_tiles(data, fmt=None) -> TileSurface:
+    """Поверхность из записи тайлов (bytes или memoryview), fmt - нужный формат"""
+    magic, stored, width, height, tile_size, compressed, count = HEADER.unpack_from(data)
+    if magic != TILES_MAGIC:
+        raise ValueError("Запись не содержит тайлов слоя")
+    stored = QImage.Format(stored)
+    surface = TileSurface(width, height, stored)
+    full = None
+    if tile_size != TILE_SIZE:
+        # Файл из сборки с другим размером тайла - собираем картинку целиком
+        full = QImage(width, height, stored)
+        full.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(full)
+
+    for i in range(count):
+        tx, ty, offset, length = INDEX.unpack_from(data, HEADER.size + i * INDEX.size)
+        x, y = tx * tile_size, ty * tile_size
+        tile = QImage(min(tile_size, width - x), min(tile_size, height - y), stored)
+        chunk = data[offset:offset + length]
+        if compressed:
+            chunk = zlib.decompress(chunk)
+        if len(chunk) != tile.sizeInBytes():
+            raise ValueError(f"Тайл {tx}, {ty}: неверный размер данных")
+        bits = tile.bits()
+        bits.setsize(tile.sizeInBytes())
+        bits[:len(chunk)] = chunk
+        if full is None:
+            surface.tiles[(tx, ty)] = tile
+        else:
+            painter.drawImage(x, y, tile)
+
+    if full is not None:
+        painter.end()
+        surface = TileSurface.from_image(full, stored)
+    if fmt is not None and fmt != stored:
+        surface.convert(fmt)
+    return surface
+
+
+def write_aligned(zf: zipfile.ZipFile, name, chunks, size):
+    """
+    Пишет запись без сжатия так, чтобы её данные начинались с выровненного
+    смещения в файле: отступ добирается полем extra локального заголовка.
+    """
+    info = zipfile.ZipInfo(name, time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    info.file_size = size
+    # То же правило, что у zipfile для записи с известным размером (запас 5%)
+    zip64 = size * 1.05 > zipfile.ZIP64_LIMIT
+    # Локальный заголовок: 30 байт, имя, поле zip64 (20 байт), наш extra (4 + отступ)
+    start = zf.fp.tell() + 30 + len(name.encode()) + (20 if zip64 else 0) + 4
+    pad = align(start)
+    info.extra = struct.pack("<HH", ALIGN_EXTRA, pad) + bytes(pad)
+    with zf.open(info, "w", force_zip64=zip64) as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+
+def read_tiles(path, entry, fmt=None) -> TileSurface:
+    """Тайлы записи entry архива path; несжатая запись читается через mmap"""
+    with open(path, "rb") as f:
+        with zipfile.ZipFile(f) as zf:
+            info = zf.getinfo(entry)
+            if info.compress_type != zipfile.ZIP_STORED:  # архив пересжат сторонней программой
+                return decode_tiles(zf.read(entry), fmt)
+        f.seek(info.header_offset)
+        name_length, extra_length = struct.unpack("<HH", f.read(30)[26:30])
+        start = info.header_offset + 30 + name_length + extra_length
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            with view[start:start + info.file_size] as data:
+                return decode_tiles(data, fmt)
@@ -0,0 +1,134 @@
+"""
+Конвейер штрихов: ввод мыши -> очередь -> фоновый поток -> перерисовка раз в кадр
+"""
+
+import queue
+import threading
+
+from PyQt6.QtCore import QObject, QTimer, QRectF
+from PyQt6.QtGui import QGuiApplication
+
+
+class StrokeWorker(threading.Thread):
+    """
+    Фоновый поток растеризации.
+    Забирает из очереди всё накопившееся разом, так что при медленной кисти
+    точки не теряются, а склеиваются в одну ломаную.
+    """
+    def __init__(self, commands: queue.Queue, on_dirty):
+        super().__init__(daemon=True)
+        self.commands = commands
+        self.on_dirty = on_dirty
+        self.layer = None
+        self.params = None
+        self.last_point = None
+
+    def run(self):
+        while True:
+            batch = [self.commands.get()]
+            while True:
+                try:
+                    batch.append(self.commands.get_nowait())
+                except queue.Empty:
+                    break
+
+            points = []
+            for kind, data in batch:
+                if kind == "point":
+                    points.append(data)
+                    continue
+                self.flush(points)
+                points = []
+                if kind == "begin":
+                    self.layer, self.params, self.last_point = data
+                    self.layer.begin_stroke()
+                elif kind == "end":
+                    if self.layer is not None:
+                        # слияние буфера штриха со слоем - тоже здесь, в фоне
+                        rect = self.layer.end_stroke()
+                        if not rect.isEmpty():
+                            self.on_dirty(self.layer, rect)
+                    self.layer = None
+                elif kind == "stop":
+                    return
+            self.flush(points)
+            # Только после отрисовки: по unfinished_tasks GUI понимает, что всё готово
+            for _ in batch:
+                self.commands.task_done()
+
+    def flush(self, points):
+        if not points or self.layer is None:
+            return
+        rect = self.layer.rasterize([self.last_point] + points, **self.params)
+        self.last_point = points[-1]
+        if not rect.isEmpty():
+            self.on_dirty(self.layer, rect)
+
+
+class StrokePipeline(QObject):
+    """
+    Принимает точки штриха в GUI-потоке, рисует их в фоне и не чаще раза
+    в кадр дисплея передаёт сцене накопленную грязную область.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.commands = queue.Queue()
+        self.worker = None
+        self.active = False
+
+        self._dirty = {}  # layer -> QRectF в координатах слоя
+        self._dirty_lock = threading.Lock()
+
+        screen = QGuiApplication.primaryScreen()
+        rate = screen.refreshRate() if screen else 60
+        self.timer = QTimer(self)
+        self.timer.setInterval(max(1, int(1000 / (rate or 60))))
+        self.timer.timeout.connect(self.refresh)
+
+    def begin(self, layer, pos, color, width, erase=False, hardness=0):
+        """Начало штриха в точке pos (координаты сцены)"""
+        layer.load()  # пиксели открытого проекта могут ещё декодироваться
+        if self.worker is None:
+            self.worker = StrokeWorker(self.commands, self.mark_dirty)
+            self.worker.start()
+        params = {"color": color, "width": width, "erase": erase, "hardness": hardness}
+        self.commands.put(("begin", (layer, params, pos)))
+        self.active = True
+        self.timer.start()
+
+    def add_point(self, pos):
+        if self.active:
+            self.commands.put(("point", pos))
+
+    def end(self):
+        if self.active:
+            self.commands.put(("end", None))
+            self.active = False
+
+    def stop(self):
+        """Останавливает фоновый поток (при закрытии документа)"""
+        if self.worker is not None:
+            self.commands.put(("stop", None))
+            self.worker = None
+        self.timer.stop()
+
+    def mark_dirty(self, layer, rect):
+        """Вызывается из фонового потока"""
+        with self._dirty_lock:
+            self._dirty[layer] = self._dirty.get(layer, QRectF()).united(rect)
+
+    def idle(self):
+        """Все команды обработаны и новых не будет до следующего штриха"""
+        with self.commands.mutex:
+            return not self.active and self.commands.unfinished_tasks == 0
+
+    def refresh(self):
+        """Тик кадра: одна перерисовка на накопленную область каждого слоя"""
+        idle = self.idle()  # проверяем до того, как забрать область
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, {}
+        for layer, rect in dirty.items():
+            layer.item.update(rect)
+            layer.changed(rect)
+        if idle and not dirty:
+            self.timer.stop()
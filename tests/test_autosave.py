@@ -0,0 +1,104 @@
+import json
+import os
+import tempfile
+import unittest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtWidgets import QApplication
+
+app = QApplication.instance() or QApplication([])
+
+from document import Document
+from file_logic import SaveDoc, OpenDoc
+from autosave import Autosave, find_recovery, restore
+
+
+class OpenedDocumentChangesTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        path = os.path.join(self.folder, "test.pld")
+        doc = Document("test", 64, 64)
+        doc.add_layer("a")
+        SaveDoc(doc, path)
+        doc.strokes.stop()
+        self.doc, _ = OpenDoc(path).get_opened_document()
+        for layer in self.doc.layers._layers:
+            if layer.type == "Image":
+                layer.load()
+        self.autosave = Autosave([self.doc], folder=os.path.join(self.folder, "recovery"), interval=10 ** 9)
+        self.autosave.forget(self.doc)
+
+    def tearDown(self):
+        self.autosave.stop()
+        self.doc.loader.stop()
+        self.doc.strokes.stop()
+
+    def test_structure_edits_count(self):
+        changes = self.doc.changes
+        self.doc.add_layer("b")
+        self.assertGreater(self.doc.changes, changes)
+        changes = self.doc.changes
+        self.doc.move_layer(0, 0)
+        self.assertGreater(self.doc.changes, changes)
+
+    def test_tick_writes_recovery(self):
+        self.autosave.tick()
+        self.assertFalse(self.autosave.busy)  # без правок файл не пишется
+        self.doc.add_layer("b")
+        self.autosave.tick()
+        self.assertIn(self.doc, self.autosave.busy)
+        while self.autosave.busy:
+            app.processEvents()
+        self.assertTrue(os.path.exists(self.autosave.path(self.doc)))
+
+    def test_restore_is_unsaved(self):
+        self.doc.filepath = os.path.join(self.folder, "test.pld")
+        self.doc.add_layer("b")
+        self.autosave.tick()
+        while self.autosave.busy:
+            app.processEvents()
+        path = self.autosave.path(self.doc)
+        with open(os.path.splitext(path)[0] + ".json", encoding="utf-8") as f:
+            info = json.load(f)  # find_recovery живой процесс пропускает
+        self.assertEqual(info["filepath"], self.doc.filepath)
+        doc = restore(path, info)
+        self.assertIsNone(doc.filepath)  # первое сохранение - через «Сохранить как»
+        self.assertGreater(doc.changes, 0)
+        self.assertEqual([layer.name for layer in doc.layers._layers][-1], "b")
+        self.assertFalse(os.path.exists(path))
+        doc.loader.stop()
+        doc.strokes.stop()
+
+
+class RecoveryFolderTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def touch(self, name):
+        with open(os.path.join(self.folder, name), "wb"):
+            pass
+
+    def test_stale_temp_files_removed(self):
+        dead, alive = "999999999-1.pld", f"{os.getpid()}-1.pld"
+        for name in (f".~{dead}.x.pld", f"{dead}.tmp", f".~{alive}.x.pld", f"{alive}.tmp"):
+            self.touch(name)
+        self.assertEqual(find_recovery(self.folder), [])
+        self.assertEqual(sorted(os.listdir(self.folder)), sorted([f".~{alive}.x.pld", f"{alive}.tmp"]))
+
+    def test_write_error_reported(self):
+        self.touch("file")
+        doc = Document("test", 64, 64)
+        autosave = Autosave([doc], folder=os.path.join(self.folder, "file", "recovery"), interval=10 ** 9)
+        errors = []
+        autosave.failed.connect(lambda failed_doc, error: errors.append(failed_doc))
+        autosave.tick()
+        while autosave.busy:
+            app.processEvents()
+        self.assertEqual(errors, [doc])
+        autosave.stop()
+        doc.strokes.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import os
+import unittest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtWidgets import QApplication
+from PyQt6.QtCore import QPointF
+from PyQt6.QtGui import QColor
+
+app = QApplication.instance() or QApplication([])
+
+from tiles import image_array
+from document import Document
+
+
+class MergeDownTest(unittest.TestCase):
+    def setUp(self):
+        self.doc = Document("test", 96, 96)
+        for i, (color, opacity) in enumerate(((QColor(200, 40, 40), 1.0), (QColor(40, 200, 40), 0.5),
+                                              (QColor(40, 40, 200), 0.7))):
+            self.doc.add_layer(f"l{i}")
+            layer = self.doc.active_layer
+            layer.begin_stroke()
+            layer.draw_line(QPointF(0, i * 30), QPointF(96, 96 - i * 30), color, width=40)
+            layer.end_stroke()
+            layer.set_opacity(opacity)
+
+    def tearDown(self):
+        self.doc.strokes.stop()
+
+    def test_normal_over_normal_keeps_picture(self):
+        image = self.doc.get_composite()  # массив - вид на пиксели картинки, держим её
+        before = image_array(image).astype(int)
+        upper = self.doc.composite.layers()[-1]
+        self.assertIsNotNone(self.doc.merge_down(upper))
+        self.assertEqual(len(self.doc.composite.layers()), 2)
+        image = self.doc.get_composite()
+        after = image_array(image).astype(int)
+        self.assertLessEqual(abs(before - after).max(), 2)  # округление при запекании
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtWidgets import QApplication
+from PyQt6.QtCore import QPointF, QRect
+from PyQt6.QtGui import QColor, QImage
+
+app = QApplication.instance() or QApplication([])
+
+import export
+from document import Document
+
+
+class ExportPngTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "out.png")
+        self.doc = Document("test", 64, 64)
+        self.doc.add_layer("a")
+        layer = self.doc.active_layer
+        layer.begin_stroke()
+        layer.draw_line(QPointF(0, 0), QPointF(64, 64), QColor(200, 40, 40), width=20)
+        layer.end_stroke()
+
+    def tearDown(self):
+        self.doc.strokes.stop()
+        self.dir.cleanup()
+
+    def test_export(self):
+        export.export_png(self.doc, self.path, QRect(0, 0, 64, 64), strip_height=16)
+        image = QImage(self.path)
+        self.assertEqual((image.width(), image.height()), (64, 64))
+        self.assertEqual(os.listdir(self.dir.name), ["out.png"])
+
+    def test_failure_keeps_old_file(self):
+        with open(self.path, "wb") as f:
+            f.write(b"old")
+        with mock.patch.object(export, "render_layers", side_effect=MemoryError):
+            with self.assertRaises(MemoryError):
+                export.export_png(self.doc, self.path, QRect(0, 0, 64, 64))
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b"old")
+        self.assertEqual(os.listdir(self.dir.name), ["out.png"])
+
+    def test_empty_rect(self):
+        with self.assertRaises(ValueError):
+            export.export_png(self.doc, self.path, QRect(10, 10, 0, 5))
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
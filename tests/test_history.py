@@ -0,0 +1,96 @@
+import os
+import unittest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtWidgets import QApplication
+from PyQt6.QtCore import Qt, QPoint, QPointF
+from PyQt6.QtGui import QColor
+from PyQt6.QtTest import QTest
+
+app = QApplication.instance() or QApplication([])
+
+import history
+from document import Document
+from tools import Editor
+
+
+class PropertyHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.doc = Document("test", 64, 64)
+        self.doc.add_layer("a")
+        self.layer = self.doc.active_layer
+        self.doc.history.clear()
+
+    def tearDown(self):
+        self.doc.strokes.stop()
+
+    def test_toggle_twice(self):
+        self.layer.set_visible(False)
+        self.layer.set_visible(True)
+        self.assertEqual(len(self.doc.history.undo_stack), 2)
+        self.doc.history.undo()
+        self.assertFalse(self.layer.visible)
+        self.doc.history.undo()
+        self.assertTrue(self.layer.visible)
+
+    def test_rename_twice(self):
+        self.layer.set_name("b")
+        self.layer.set_name("c")
+        self.doc.history.undo()
+        self.assertEqual(self.layer.name, "b")
+        self.doc.history.undo()
+        self.assertEqual(self.layer.name, "a")
+
+    def test_slider_merges(self):
+        for value in (0.9, 0.7, 0.5):
+            self.layer.set_opacity(value)
+        self.assertEqual(len(self.doc.history.undo_stack), 1)
+        self.doc.history.undo()
+        self.assertEqual(self.layer.opacity, 1)
+
+    def test_slider_back_to_start_is_dropped(self):
+        self.layer.set_opacity(0.5)
+        self.layer.set_opacity(1)
+        self.assertEqual(self.doc.history.undo_stack, [])
+
+    def test_slider_pause_splits(self):
+        self.layer.set_opacity(0.5)
+        self.doc.history.undo_stack[-1].time -= history.MERGE_INTERVAL
+        self.layer.set_opacity(0.3)
+        self.assertEqual(len(self.doc.history.undo_stack), 2)
+
+    def test_drag_move_is_undoable(self):
+        self.layer.begin_stroke()  # пустой слой не ловит мышь
+        self.layer.draw_line(QPointF(0, 0), QPointF(64, 64), QColor(255, 0, 0), width=40)
+        self.layer.end_stroke()
+        self.doc.history.clear()
+        self.doc.changeTool(Editor())
+        self.doc.resize(200, 200)
+        self.doc.show()
+        app.processEvents()
+        viewport = self.doc.view.viewport()
+        start = self.doc.view.mapFromScene(QPointF(32, 32))
+        QTest.mousePress(viewport, Qt.MouseButton.LeftButton, Qt.KeyboardModifier.NoModifier, start)
+        for step in range(1, 4):
+            QTest.mouseMove(viewport, start + QPoint(4 * step, 2 * step))
+        QTest.mouseRelease(viewport, Qt.MouseButton.LeftButton, Qt.KeyboardModifier.NoModifier, start + QPoint(12, 6))
+        self.assertEqual(self.layer.pos(), QPointF(12, 6))
+        self.assertEqual(len(self.doc.history.undo_stack), 1)
+        self.doc.history.undo()
+        self.assertEqual(self.layer.pos(), QPointF(0, 0))
+        self.doc.history.redo()
+        self.assertEqual(self.layer.pos(), QPointF(12, 6))
+
+    def test_settings_in_one_step(self):
+        with self.doc.history.macro():
+            self.layer.set_name("b")
+            self.layer.set_visible(False)
+            self.layer.set_opacity(0.5)
+        self.assertEqual(len(self.doc.history.undo_stack), 1)
+        self.doc.history.undo()
+        self.assertEqual((self.layer.name, self.layer.visible, self.layer.opacity), ("a", True, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
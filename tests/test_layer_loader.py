@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+import zipfile
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtWidgets import QApplication
+
+app = QApplication.instance() or QApplication([])
+
+from document import Document
+from file_logic import SaveDoc, OpenDoc
+
+
+class BrokenLayerTest(unittest.TestCase):
+    def test_corrupt_entry_marks_layer(self):
+        folder = tempfile.mkdtemp()
+        path, broken = os.path.join(folder, "ok.pld"), os.path.join(folder, "broken.pld")
+        doc = Document("test", 64, 64)
+        doc.add_layer("a")
+        SaveDoc(doc, path)
+        doc.strokes.stop()
+        with zipfile.ZipFile(path) as src, zipfile.ZipFile(broken, "w") as dst:
+            for info in src.infolist():
+                data = src.read(info.filename)
+                if info.filename.endswith("layer_1.png"):
+                    data = data[:40] + b"\0" * 64  # заголовок цел, данные испорчены
+                dst.writestr(info, data)
+
+        opened, _ = OpenDoc(broken).get_opened_document()
+        layer = opened.layers._layers[1]
+        layer.load()  # не бросает исключение в вызывающий код
+        self.assertIsNotNone(layer.load_error)
+        self.assertIsNone(layer.loader)
+        opened.loader.stop()
+        opened.strokes.stop()
+
+    def test_overwritten_file_marks_layer(self):
+        path = os.path.join(tempfile.mkdtemp(), "shared.pld")
+        doc = Document("test", 64, 64)
+        doc.add_layer("a")
+        doc.active_layer.set_visible(False)  # скрытый слой ждёт первого показа
+        SaveDoc(doc, path)
+        doc.strokes.stop()
+
+        opened, _ = OpenDoc(path).get_opened_document()
+        layer = opened.layers._layers[1]
+        self.assertIsNotNone(layer.loader)
+        other = Document("other", 32, 32)
+        other.add_layer("b")
+        SaveDoc(other, path)  # файл перезаписан другим документом
+        other.strokes.stop()
+
+        layer.load()
+        self.assertIsNotNone(layer.load_error)
+        self.assertEqual(layer.width, 64)
+        opened.loader.stop()
+        opened.strokes.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import unittest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtWidgets import QApplication
+from PyQt6.QtCore import QPointF
+from PyQt6.QtGui import QColor
+
+app = QApplication.instance() or QApplication([])
+
+from document import Document
+from ui.widgets.layer_model import LayerListModel
+
+
+class ThumbnailCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.model = LayerListModel()
+        self.docs = []
+        for name in ("one", "two"):
+            doc = Document(name, 64, 64)
+            doc.add_layer("a")
+            doc.add_layer("b")
+            self.docs.append(doc)
+
+    def tearDown(self):
+        for doc in self.docs:
+            doc.strokes.stop()
+
+    def show(self, doc):
+        """Показывает документ и дожидается его миниатюр"""
+        self.model.set_document(doc)
+        pixmaps = {layer: self.model.thumbnail(layer) for layer in self.model.layers}
+        self.model.pool.waitForDone()
+        app.processEvents()
+        return {layer: self.model.thumbnails[layer] for layer in pixmaps}
+
+    def test_tab_switch_keeps_thumbnails(self):
+        one, two = self.docs
+        before = self.show(one)
+        self.show(two)
+        # правка слоя в фоновой вкладке сбрасывает только его миниатюру
+        layer = one.layers._layers[-1]
+        layer.begin_stroke()
+        layer.draw_line(QPointF(0, 0), QPointF(64, 64), QColor(255, 0, 0), width=10)
+        layer.end_stroke()
+        self.assertNotIn(layer, self.model.thumbnails)
+        self.model.set_document(one)
+        for other, pixmap in before.items():
+            if other is not layer:
+                self.assertIs(self.model.thumbnail(other), pixmap)
+
+
+if __name__ == "__main__":
+    unittest.main()
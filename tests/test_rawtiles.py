@@ -0,0 +1,32 @@
+import io
+import unittest
+import zipfile
+from unittest import mock
+
+from rawtiles import ALIGN, write_aligned
+
+
+class WriteAlignedTest(unittest.TestCase):
+    def data_offset(self, size):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as zf:
+            zf.writestr("manifest.json", "{}")
+            write_aligned(zf, "layers/layer_0.raw", [b"x" * size], size)
+        with zipfile.ZipFile(buf) as zf:
+            info = zf.getinfo("layers/layer_0.raw")
+            self.assertEqual(zf.read(info), b"x" * size)
+        buf.seek(info.header_offset + 26)
+        name_len, extra_len = (int.from_bytes(buf.read(2), "little") for _ in range(2))
+        return info.header_offset + 30 + name_len + extra_len
+
+    def test_aligned(self):
+        self.assertEqual(self.data_offset(100) % ALIGN, 0)
+
+    def test_aligned_near_zip64_limit(self):
+        # размер чуть меньше предела, но zipfile уже пишет поле zip64
+        with mock.patch.object(zipfile, "ZIP64_LIMIT", 1020):
+            self.assertEqual(self.data_offset(1000) % ALIGN, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtWidgets import QApplication
+from PyQt6.QtCore import QPointF
+from PyQt6.QtGui import QColor
+
+app = QApplication.instance() or QApplication([])
+
+from document import Document
+from file_logic import SaveDoc, OpenDoc
+
+
+def painted(color):
+    doc = Document("test", 64, 64)
+    doc.add_layer("a")
+    layer = doc.active_layer
+    layer.begin_stroke()
+    layer.draw_line(QPointF(0, 0), QPointF(64, 64), color, width=20)
+    layer.end_stroke()
+    return doc, layer
+
+
+def saved_digest(path):
+    doc, _ = OpenDoc(path).get_opened_document()
+    layer = doc.layers._layers[1]
+    layer.load()
+    digest = layer.surface.digest()
+    doc.loader.stop()
+    doc.strokes.stop()
+    return digest
+
+
+class SaveReuseTest(unittest.TestCase):
+    def test_overwritten_source_is_not_reused(self):
+        path = os.path.join(tempfile.mkdtemp(), "shared.pld")
+        first, _ = painted(QColor(255, 0, 0))
+        SaveDoc(first, path)
+        expected = saved_digest(path)
+        other, _ = painted(QColor(0, 0, 255))
+        SaveDoc(other, path)  # "Сохранить как" другого документа поверх
+        self.assertNotEqual(saved_digest(path), expected)
+        SaveDoc(first, path)  # слой не менялся, но его запись в файле уже чужая
+        self.assertEqual(saved_digest(path), expected)
+        for doc in (first, other):
+            doc.strokes.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
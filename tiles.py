@@ -0,0 +1,350 @@
+"""
+Тайловое хранилище пикселей для Image-слоёв
+"""
+
+import math
+import hashlib
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен: без него всё рисуется через QPainter
+    np = None
+
+from PyQt6.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+from PyQt6.QtGui import QImage, QPainter
+from PyQt6.QtCore import Qt, QRect, QRectF
+
+TILE_SIZE = 256
+
+# Точность пикселей слоя: 8 бит на канал - быстрый вариант по умолчанию
+PRECISIONS = {
+    8: QImage.Format.Format_ARGB32_Premultiplied,
+    16: QImage.Format.Format_RGBA64_Premultiplied,
+}
+DEFAULT_PRECISION = 8
+TILE_FORMAT = PRECISIONS[DEFAULT_PRECISION]
+
+# Форматы, которые умеет NumPy-путь: тип канала и порядок каналов в памяти
+ARRAY_FORMATS = {
+    QImage.Format.Format_ARGB32_Premultiplied: ("uint8", "BGRA"),
+    QImage.Format.Format_RGBA8888_Premultiplied: ("uint8", "RGBA"),
+    QImage.Format.Format_RGBA64_Premultiplied: ("uint16", "RGBA"),
+}
+
+
+def precision_of(image: QImage) -> int:
+    """Подходящая точность для изображения (16 бит, если в нём больше 8 бит на канал)"""
+    return 16 if image.depth() > 32 else 8
+
+
+def is_blank(image: QImage) -> bool:
+    """Полностью прозрачный ли тайл (в premultiplied-форматах это одни нули)"""
+    size = image.sizeInBytes()
+    bits = image.constBits()
+    bits.setsize(size)
+    return bits.asstring() == bytes(size)
+
+
+def image_array(image: QImage, readonly=False):
+    """
+    NumPy-представление буфера QImage формы (h, w, 4) без копирования.
+    Порядок каналов - см. ARRAY_FORMATS. readonly=True - только чтение,
+    общий с другими копиями буфер при этом не отделяется.
+    """
+    dtype = np.dtype(ARRAY_FORMATS[image.format()][0])
+    bits = image.constBits() if readonly else image.bits()
+    bits.setsize(image.sizeInBytes())
+    rows = np.frombuffer(bits, dtype).reshape(image.height(), image.bytesPerLine() // dtype.itemsize)
+    return rows[:, :image.width() * 4].reshape(image.height(), image.width(), 4)
+
+
+class TileSurface:
+    """
+    Разреженная поверхность слоя.
+    Холст делится на тайлы TILE_SIZE x TILE_SIZE, тайл создаётся при первой
+    записи в него, пустые тайлы не хранятся вовсе.
+
+    Для мелкого масштаба держится пирамида уменьшенных копий (уровень n -
+    в 2**n раз меньше). Уровни строятся лениво, только для тех тайлов,
+    которые реально рисуются; touch() после записи в тайлы помечает
+    устаревшими только их предков на каждом уровне.
+    """
+    def __init__(self, width, height, fmt=TILE_FORMAT):
+        self.width = width
+        self.height = height
+        self.format = fmt
+        self.tiles = {}  # (tx, ty) -> QImage
+        self.mips = {}  # уровень -> {(tx, ty): QImage}
+        self.mips_valid = {}  # уровень -> ключи, чьи копии актуальны (нет в mips - пустой тайл)
+        self.revision = 0  # растёт при каждом изменении пикселей (touch, convert, release)
+        # Штрихи растеризуются в фоновом потоке, а рисуются в GUI - общий замок
+        self.lock = threading.RLock()
+
+    @classmethod
+    def from_image(cls, image: QImage, fmt=TILE_FORMAT):
+        """Нарезает изображение на тайлы, пропуская пустые"""
+        surface = cls(image.width(), image.height(), fmt)
+        if image.format() != fmt:  # конвертируем, только если формат другой
+            image = image.convertToFormat(fmt)
+        for key in surface.keys_in_rect(QRect(0, 0, surface.width, surface.height)):
+            tile = image.copy(surface.tile_rect(key))
+            if not is_blank(tile):
+                surface.tiles[key] = tile
+        return surface
+
+    def snapshot(self):
+        """
+        Неизменяемая копия поверхности для чтения в другом потоке.
+        Тайлы - общие копии QImage: пиксели не копируются, пока слой не
+        начнут менять (тогда QImage сам отделит свою копию).
+        """
+        with self.lock:
+            copy = TileSurface(self.width, self.height, self.format)
+            copy.tiles = {key: QImage(tile) for key, tile in self.tiles.items()}
+        return copy
+
+    def convert(self, fmt):
+        """Переводит все тайлы в другой формат пикселей"""
+        with self.lock:
+            if fmt == self.format:
+                return
+            self.format = fmt
+            for key, tile in self.tiles.items():
+                self.tiles[key] = tile.convertToFormat(fmt)
+            self.mips.clear()
+            self.mips_valid.clear()
+            self.revision += 1
+
+    def release(self):
+        """Освобождает все тайлы и пирамиду (слой заменён другим)"""
+        with self.lock:
+            self.tiles.clear()
+            self.mips.clear()
+            self.mips_valid.clear()
+            self.revision += 1
+
+    def touch(self, keys):
+        """Тайлы keys изменились: устаревают их уменьшенные копии на всех уровнях"""
+        with self.lock:
+            self.revision += 1
+            for level, valid in self.mips_valid.items():
+                for tx, ty in keys:
+                    valid.discard((tx >> level, ty >> level))
+
+    def digest(self) -> str:
+        """Хэш содержимого (формат, размер и пиксели всех тайлов)"""
+        h = hashlib.blake2b(digest_size=20)
+        h.update(f"{self.format.value}:{self.width}x{self.height}".encode())
+        with self.lock:
+            tiles = sorted((key, QImage(tile)) for key, tile in self.tiles.items())
+        for (tx, ty), tile in tiles:
+            bits = tile.constBits()
+            bits.setsize(tile.sizeInBytes())
+            h.update(f"{tx},{ty}".encode())
+            h.update(bits)
+        return h.hexdigest()
+
+    def rect(self) -> QRect:
+        return QRect(0, 0, self.width, self.height)
+
+    def level_rect(self, level=0) -> QRect:
+        """Размер уровня пирамиды (уровень 0 - сам слой)"""
+        scale = 1 << level
+        return QRect(0, 0, math.ceil(self.width / scale), math.ceil(self.height / scale))
+
+    def max_level(self) -> int:
+        """Уровень, на котором весь слой помещается в один тайл"""
+        return max(0, math.ceil(math.log2(max(self.width, self.height, 1) / TILE_SIZE)))
+
+    def tile_rect(self, key, level=0) -> QRect:
+        """Прямоугольник тайла в координатах слоя (крайние тайлы обрезаны по холсту)"""
+        tx, ty = key
+        x, y = tx * TILE_SIZE, ty * TILE_SIZE
+        size = self.level_rect(level)
+        return QRect(x, y, min(TILE_SIZE, size.width() - x), min(TILE_SIZE, size.height() - y))
+
+    def keys_in_rect(self, rect, level=0) -> list:
+        """Ключи всех тайлов (в том числе несуществующих), пересекающих rect"""
+        rect = QRectF(rect).toAlignedRect().intersected(self.level_rect(level))
+        if rect.isEmpty():
+            return []
+        return [(tx, ty)
+                for ty in range(rect.top() // TILE_SIZE, rect.bottom() // TILE_SIZE + 1)
+                for tx in range(rect.left() // TILE_SIZE, rect.right() // TILE_SIZE + 1)]
+
+    def tile(self, key, create=False):
+        """Возвращает тайл; при create=True создаёт прозрачный, если его ещё нет"""
+        tile = self.tiles.get(key)
+        if tile is None and create:
+            r = self.tile_rect(key)
+            tile = QImage(r.width(), r.height(), self.format)
+            tile.fill(Qt.GlobalColor.transparent)
+            self.tiles[key] = tile
+        return tile
+
+    def compact(self, keys=None):
+        """Выбрасывает ставшие пустыми тайлы (например, после ластика)"""
+        with self.lock:
+            for key in list(self.tiles if keys is None else keys):
+                tile = self.tiles.get(key)
+                if tile is not None and is_blank(tile):
+                    del self.tiles[key]
+
+    def mip_tile(self, level, key):
+        """Тайл уровня level, при необходимости собранный из четырёх тайлов уровнем ниже"""
+        if level == 0:
+            return self.tiles.get(key)
+        tiles = self.mips.setdefault(level, {})
+        valid = self.mips_valid.setdefault(level, set())
+        if key not in valid:
+            tiles.pop(key, None)
+            tx, ty = key
+            rect = self.tile_rect(key, level)
+            tile = None
+            for dy in (0, 1):
+                for dx in (0, 1):
+                    child_key = (tx * 2 + dx, ty * 2 + dy)
+                    if not self.tile_rect(child_key, level - 1).isValid():
+                        continue
+                    child = self.mip_tile(level - 1, child_key)
+                    if child is None:
+                        continue
+                    if tile is None:
+                        tile = QImage(rect.width(), rect.height(), self.format)
+                        tile.fill(Qt.GlobalColor.transparent)
+                        painter = QPainter(tile)
+                        # при уменьшении ровно вдвое билинейная выборка = среднее 2x2
+                        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+                        painter.scale(0.5, 0.5)
+                    painter.drawImage(dx * TILE_SIZE, dy * TILE_SIZE, child)
+            if tile is not None:
+                painter.end()
+                tiles[key] = tile
+            valid.add(key)
+        return tiles.get(key)
+
+    def paint(self, painter: QPainter, rect=None, level=0):
+        """
+        Рисует существующие тайлы, попадающие в rect, в координатах слоя.
+        level > 0 - из уменьшенной копии (для мелкого масштаба).
+        """
+        # Под замком только собираем общие копии тайлов, рисуем без него:
+        # поток кисти и другие потоки сведения не ждут, пока идёт отрисовка
+        with self.lock:
+            if level == 0:
+                keys = list(self.tiles) if rect is None else self.keys_in_rect(rect)
+                tiles = [(self.tile_rect(key).topLeft(), QImage(self.tiles[key]))
+                         for key in keys if key in self.tiles]
+            else:
+                area = self.rect() if rect is None else QRectF(rect)
+                scale = 1 << level
+                area = QRectF(area.x() / scale, area.y() / scale, area.width() / scale, area.height() / scale)
+                tiles = []
+                for key in self.keys_in_rect(area, level):
+                    tile = self.mip_tile(level, key)
+                    if tile is not None:
+                        tiles.append((self.tile_rect(key, level).topLeft(), QImage(tile)))
+
+        if level:
+            painter.save()
+            painter.scale(1 << level, 1 << level)
+        for pos, tile in tiles:
+            painter.drawImage(pos, tile)
+        if level:
+            painter.restore()
+
+    def level_for(self, zoom) -> int:
+        """Уровень пирамиды для масштаба zoom: самый мелкий, не меньше экрана"""
+        if zoom >= 1:
+            return 0
+        return min(self.max_level(), int(math.floor(math.log2(1 / zoom))))
+
+    def to_image(self, rect=None, fmt=None) -> QImage:
+        """Собирает тайлы в одно изображение (целиком или область rect)"""
+        rect = self.rect() if rect is None else QRectF(rect).toAlignedRect()
+        image = QImage(rect.width(), rect.height(), fmt or self.format)
+        image.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(image)
+        painter.translate(-rect.x(), -rect.y())
+        self.paint(painter, rect)
+        painter.end()
+        return image
+
+    def memory(self) -> int:
+        """Сколько байт занимают пиксели поверхности"""
+        with self.lock:
+            tiles = list(self.tiles.values())
+            for level in self.mips.values():
+                tiles.extend(level.values())
+            return sum(tile.sizeInBytes() for tile in tiles)
+
+
+class TiledItem(QGraphicsItem):
+    """
+    Элемент сцены, рисующий TileSurface (только видимые тайлы).
+    Во время штриха поверх слоя показывается буфер штриха wet: обычные
+    мазки рисуются над тайлом, мазки ластика вычитаются из его копии.
+    При мелком масштабе тайлы берутся из пирамиды слоя, так что работа
+    пропорциональна пикселям экрана, а не слоя.
+    """
+    def __init__(self, surface: TileSurface):
+        super().__init__()
+        self.surface = surface
+        self.wet = None
+        self.wet_erase = False
+        self.composition = QPainter.CompositionMode.CompositionMode_SourceOver  # режим наложения слоя
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+
+    def set_surface(self, surface: TileSurface):
+        self.prepareGeometryChange()
+        self.surface = surface
+        self.update()
+
+    def boundingRect(self) -> QRectF:
+        return QRectF(0, 0, self.surface.width, self.surface.height)
+
+    def paint(self, painter, option, widget=None):
+        painter.save()
+        painter.setCompositionMode(self.composition)
+        self._paint(painter, option)
+        painter.restore()
+
+    def _paint(self, painter, option):
+        wet = self.wet
+        if wet is None:
+            zoom = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+            level = self.surface.level_for(zoom)
+            if level:
+                painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+            self.surface.paint(painter, option.exposedRect, level)
+            return
+
+        with self.surface.lock, wet.lock:
+            for key in self.surface.keys_in_rect(option.exposedRect):
+                tile = self.surface.tiles.get(key)
+                stroke = wet.tiles.get(key)
+                origin = self.surface.tile_rect(key).topLeft()
+                if stroke is not None and self.wet_erase:
+                    if tile is None:
+                        continue
+                    tile = tile.copy()
+                    tile_painter = QPainter(tile)
+                    tile_painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_DestinationOut)
+                    tile_painter.drawImage(0, 0, stroke)
+                    tile_painter.end()
+                    stroke = None
+                elif stroke is not None and self.composition != QPainter.CompositionMode.CompositionMode_SourceOver:
+                    # В особом режиме штрих сначала ложится на тайл, а уже потом накладывается
+                    if tile is None:
+                        tile = QImage(stroke)
+                    else:
+                        tile = tile.copy()
+                        tile_painter = QPainter(tile)
+                        tile_painter.drawImage(0, 0, stroke)
+                        tile_painter.end()
+                    stroke = None
+                if tile is not None:
+                    painter.drawImage(origin, tile)
+                if stroke is not None:
+                    painter.drawImage(origin, stroke)
@@ -3,8 +3,30 @@ import math
 from PyQt6 import uic
 from PyQt6.QtWidgets import (QDialog, QTextEdit, QFontComboBox, QSpinBox,
                              QColorDialog, QPushButton, QMainWindow, QTextBrowser,
-                             QVBoxLayout, QWidget)
-from PyQt6.QtCore import Qt
+                             QVBoxLayout, QHBoxLayout, QWidget, QComboBox, QLabel,
+                             QTableWidget, QTableWidgetItem, QDialogButtonBox)
+from PyQt6.QtCore import Qt, QRect
+
+from tiles import PRECISIONS, DEFAULT_PRECISION
+from blend import BLEND_NAMES
+from export import Slice
+
+
+def precision_box(current):
+    """Выпадающий список глубины цвета (8/16 бит на канал)"""
+    box = QComboBox()
+    for bits in PRECISIONS:
+        box.addItem(f"{bits} бит", bits)
+    box.setCurrentIndex(box.findData(current))
+    return box
+
+def blend_box(current):
+    """Выпадающий список режимов наложения слоя"""
+    box = QComboBox()
+    for mode, title in BLEND_NAMES.items():
+        box.addItem(title, mode)
+    box.setCurrentIndex(box.findData(current))
+    return box
 
 class AboutForm(QMainWindow):
     def __init__(self, parent=None):
@@ -62,6 +84,12 @@ class SecondForm(QDialog):
 
         self.comboBox.addItems(["White", "Transparent", "Red", "Black"])
 
+        # Глубина цвета новых слоёв документа
+        self.precisionBox = precision_box(DEFAULT_PRECISION)
+        row = self.gridLayout.rowCount()
+        self.gridLayout.addWidget(QLabel("Глубина цвета"), row, 0)
+        self.gridLayout.addWidget(self.precisionBox, row, 1)
+
     def on_spinbox_value_changed(self, value):
         width = self.spinBox.value()
         height = self.spinBox_2.value()
@@ -103,7 +131,8 @@ class SecondForm(QDialog):
             "name": self.lineEdit.text() or "Безымянный проект",
             "width": self.spinBox.value(),
             "height": self.spinBox_2.value(),
-            "background": self.comboBox.currentText()
+            "background": self.comboBox.currentText(),
+            "precision": self.precisionBox.currentData()
         }
     
     
@@ -141,6 +170,16 @@ class SettingsForm(QDialog):
             self.button.clicked.connect(self.showDialog)
             self.gridLayout_5.addWidget(self.button, 2, 0)
 
+        if self.layer.type == "Image":
+            self.precisionBox = precision_box(self.layer.precision)
+            row = self.gridLayout.rowCount()
+            self.gridLayout.addWidget(QLabel("Глубина цвета"), row, 0)
+            self.gridLayout.addWidget(self.precisionBox, row, 1)
+
+        self.blendBox = blend_box(self.layer.blend_mode)
+        row = self.gridLayout.rowCount()
+        self.gridLayout.addWidget(QLabel("Режим наложения"), row, 0)
+        self.gridLayout.addWidget(self.blendBox, row, 1)
 
         # связываем кнопки
         self.buttonBox.accepted.connect(self.accept)
@@ -181,7 +220,8 @@ class SettingsForm(QDialog):
             "visible": self.checkBox.isChecked(),
             "locked": self.checkBox_2.isChecked(),
             "opacity": self.horizontalSlider.value(),
-            "scale": self.spinBox.value()
+            "scale": self.spinBox.value(),
+            "blend_mode": self.blendBox.currentData()
         }
 
         if self.layer.type == "Text":
@@ -191,6 +231,9 @@ class SettingsForm(QDialog):
             out["font"] = font
             out["color"] = self.col
 
+        if self.layer.type == "Image":
+            out["precision"] = self.precisionBox.currentData()
+
         return out
 
 class NewLayerForm(QDialog):
@@ -213,4 +256,66 @@ class NewLayerForm(QDialog):
             "name": self.lineEdit.text() or self.name,
             "opacity": self.spinBox.value(),
             "background": self.comboBox.currentText()
-        }
\ No newline at end of file
+        }
+
+class SliceForm(QDialog):
+    """Список срезов документа: имя и область в пикселях холста"""
+    COLUMNS = ["Имя", "X", "Y", "Ширина", "Высота"]
+
+    def __init__(self, parent=None, slices=(), width=1280, height=720):
+        super().__init__(parent)
+        self.setWindowTitle("Срезы")
+        self.resize(520, 360)
+        self.canvas = QRect(0, 0, width, height)
+
+        layout = QVBoxLayout(self)
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.table)
+
+        buttons = QHBoxLayout()
+        self.addButton = QPushButton("Добавить")
+        self.addButton.clicked.connect(lambda: self.add_row(f"slice_{self.table.rowCount() + 1}", self.canvas))
+        self.removeButton = QPushButton("Удалить")
+        self.removeButton.clicked.connect(self.remove_row)
+        buttons.addWidget(self.addButton)
+        buttons.addWidget(self.removeButton)
+        buttons.addStretch()
+        layout.addLayout(buttons)
+
+        self.buttonBox = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        self.buttonBox.accepted.connect(self.accept)
+        self.buttonBox.rejected.connect(self.reject)
+        layout.addWidget(self.buttonBox)
+
+        for item in slices:
+            self.add_row(item.name, item.rect)
+
+    def add_row(self, name, rect):
+        row = self.table.rowCount()
+        self.table.insertRow(row)
+        self.table.setItem(row, 0, QTableWidgetItem(name))
+        limits = [(0, self.canvas.width() - 1), (0, self.canvas.height() - 1),
+                  (1, self.canvas.width()), (1, self.canvas.height())]
+        values = [rect.x(), rect.y(), rect.width(), rect.height()]
+        for column, ((low, high), value) in enumerate(zip(limits, values), start=1):
+            box = QSpinBox()
+            box.setRange(low, high)
+            box.setValue(value)
+            self.table.setCellWidget(row, column, box)
+
+    def remove_row(self):
+        row = self.table.currentRow()
+        if row >= 0:
+            self.table.removeRow(row)
+
+    def get_values(self):
+        """Возвращает срезы списком export.Slice"""
+        out = []
+        for row in range(self.table.rowCount()):
+            item = self.table.item(row, 0)
+            name = item.text() if item is not None and item.text() else f"slice_{row + 1}"
+            x, y, w, h = (self.table.cellWidget(row, column).value() for column in range(1, 5))
+            out.append(Slice(name, QRect(x, y, w, h)))
+        return out
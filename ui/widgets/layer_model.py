@@ -0,0 +1,327 @@
+import weakref
+
+from PyQt6.QtWidgets import QListView, QStyledItemDelegate, QStyle, QStyleOptionViewItem, QAbstractItemView
+from PyQt6.QtCore import (Qt, QAbstractListModel, QModelIndex, QRect, QSize, QEvent, QObject,
+                          QRunnable, QThreadPool, QTimer, pyqtSignal)
+from PyQt6.QtGui import QPixmap, QFont, QImage, QBrush, QPainter
+
+from layer import checker_image
+
+THUMB_SIZE = QSize(32, 32)
+ROW_HEIGHT = 44
+THUMB_DELAY = 150  # мс тишины после изменения слоя до пересчёта миниатюры
+
+
+class ThumbnailSignals(QObject):
+    # (слой, поколение, картинка) - из фонового потока в GUI
+    done = pyqtSignal(object, int, QImage)
+
+
+class ThumbnailJob(QRunnable):
+    """Рисует миниатюру Image-слоя по снимку тайлов в пуле потоков"""
+    def __init__(self, layer, generation, surface, signals):
+        super().__init__()
+        self.layer = layer
+        self.generation = generation
+        self.surface = surface
+        self.signals = signals
+
+    def run(self):
+        image = self.layer.preview_image(THUMB_SIZE, self.surface)
+        self.signals.done.emit(self.layer, self.generation, image)
+
+
+class LayerListModel(QAbstractListModel):
+    """
+    Слои документа сверху вниз (без шахматного фона).
+    Строки не хранят виджетов: всё рисует делегат, миниатюры кэшируются
+    по слою (для всех открытых документов, переключение вкладок их не
+    трогает) и сбрасываются только сигналами об изменении этого слоя.
+    Миниатюры Image-слоёв пересчитываются в пуле потоков по снимку тайлов:
+    не чаще раза в THUMB_DELAY мс и не во время штриха; пока считается
+    новая, показывается старая.
+    """
+    LayerRole = Qt.ItemDataRole.UserRole
+    LockedRole = Qt.ItemDataRole.UserRole + 1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.doc = None
+        self.layers = []
+        # Слои закрытых документов сами уходят из кэша вместе со слоями
+        self.thumbnails = weakref.WeakKeyDictionary()  # layer -> QPixmap
+        self.stale = set()  # слои текущего документа, чьи миниатюры устарели
+        self.generations = weakref.WeakKeyDictionary()  # layer -> номер последнего изменения
+        self.watched = weakref.WeakSet()  # LayerManager, за правками которых следим
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+        self.signals = ThumbnailSignals(self)
+        self.signals.done.connect(self.on_thumbnail)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(THUMB_DELAY)
+        self.timer.timeout.connect(self.render_stale)
+
+    def set_document(self, doc):
+        if doc is self.doc:
+            return
+        if self.doc is not None:
+            self.doc.layers.layersChanged.disconnect(self.refresh)
+            self.doc.layers.layerUpdated.disconnect(self.on_layer_updated)
+        # Отложенные пересчёты ушедшего документа - просто сброс, посчитаются при возврате
+        for layer in self.stale:
+            self.thumbnails.pop(layer, None)
+        self.stale.clear()
+        self.doc = doc
+        if doc is not None:
+            doc.layers.layersChanged.connect(self.refresh)
+            doc.layers.layerUpdated.connect(self.on_layer_updated)
+            # Правки слоёв ловим и в фоновых вкладках - их миниатюры остаются в кэше
+            if doc.layers not in self.watched:
+                self.watched.add(doc.layers)
+                doc.layers.layerChanged.connect(self.on_layer_changed)
+        self.refresh()
+
+    def refresh(self):
+        """Состав или порядок слоёв изменился"""
+        self.beginResetModel()
+        if self.doc is None:
+            self.layers = []
+        else:
+            self.layers = [layer for layer in reversed(self.doc.layers._layers)
+                           if layer is not self.doc.bg_layer]
+        self.stale &= set(self.layers)
+        self.endResetModel()
+
+    def on_layer_changed(self, layer, rect=None):
+        """Пиксели или вид слоя изменились - миниатюру пересоздать (с задержкой)"""
+        # результаты, запущенные до этого изменения, будут отброшены
+        self.generations[layer] = self.generations.get(layer, 0) + 1
+        if layer not in self.layers:
+            # слой фоновой вкладки (или убранный) - пересчитается, когда его покажут
+            self.thumbnails.pop(layer, None)
+            return
+        self.stale.add(layer)
+        self.timer.start()
+
+    def on_layer_updated(self, layer):
+        """Изменилось имя или блокировка - перерисовать строку"""
+        if layer in self.layers:
+            index = self.index(self.layers.index(layer))
+            self.dataChanged.emit(index, index)
+
+    def thumbnail(self, layer) -> QPixmap:
+        pixmap = self.thumbnails.get(layer)
+        if pixmap is None:
+            if layer.type == "Image":
+                # первая миниатюра тоже в фоне, пока - пустая клетка
+                pixmap = placeholder()
+                self.thumbnails[layer] = pixmap
+                self.request(layer)
+            else:
+                pixmap = layer.get_preview(THUMB_SIZE)
+                self.thumbnails[layer] = pixmap
+        return pixmap
+
+    def render_stale(self):
+        """Пересчитывает устаревшие миниатюры, если штрих не идёт"""
+        if self.doc is not None and not self.doc.strokes.idle():
+            self.timer.start()
+            return
+        stale, self.stale = self.stale, set()
+        for layer in stale:
+            if layer not in self.layers:
+                continue
+            if layer.type == "Image":
+                self.request(layer)
+            else:
+                # Solid и Text рисуются мгновенно и используют QPixmap - только в GUI
+                self.thumbnails[layer] = layer.get_preview(THUMB_SIZE)
+                self.on_layer_updated(layer)
+
+    def request(self, layer):
+        generation = self.generations.setdefault(layer, 0)
+        self.pool.start(ThumbnailJob(layer, generation, layer.surface.snapshot(), self.signals))
+
+    def on_thumbnail(self, layer, generation, image):
+        if generation != self.generations.get(layer) or layer not in self.layers:
+            return  # слой успел измениться или исчезнуть
+        self.thumbnails[layer] = QPixmap.fromImage(image)
+        self.on_layer_updated(layer)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.layers)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        layer = self.layers[index.row()]
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            return layer.name
+        if role == Qt.ItemDataRole.CheckStateRole:
+            return Qt.CheckState.Checked if layer.visible else Qt.CheckState.Unchecked
+        if role == Qt.ItemDataRole.DecorationRole:
+            return self.thumbnail(layer)
+        if role == self.LockedRole:
+            return layer.locked
+        if role == self.LayerRole:
+            return layer
+        return None
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if not index.isValid():
+            return False
+        layer = self.layers[index.row()]
+        if role == Qt.ItemDataRole.EditRole:
+            name = str(value).strip()
+            if not name or name == layer.name:
+                return False
+            layer.set_name(name)
+        elif role == Qt.ItemDataRole.CheckStateRole:
+            layer.set_visible(Qt.CheckState(value) == Qt.CheckState.Checked)
+        else:
+            return False
+        self.dataChanged.emit(index, index)
+        return True
+
+    def flags(self, index):
+        flags = super().flags(index)
+        if index.isValid():
+            flags |= Qt.ItemFlag.ItemIsEditable | Qt.ItemFlag.ItemIsUserCheckable
+        return flags
+
+
+def placeholder() -> QPixmap:
+    """Миниатюра-заглушка: шахматный фон без содержимого"""
+    image = QImage(THUMB_SIZE, QImage.Format.Format_ARGB32_Premultiplied)
+    painter = QPainter(image)
+    painter.fillRect(image.rect(), QBrush(checker_image()))
+    painter.end()
+    return QPixmap.fromImage(image)
+
+
+class LayerDelegate(QStyledItemDelegate):
+    """Рисует строку слоя: видимость, миниатюра, имя, замок"""
+    settingsRequested = pyqtSignal(int)  # двойной клик мимо имени
+
+    _icons = {}
+
+    @classmethod
+    def icon(cls, name, height):
+        """SVG-иконки грузятся один раз на всё приложение"""
+        key = (name, height)
+        if key not in cls._icons:
+            cls._icons[key] = QPixmap(f"ui\\icons\\{name}.svg").scaledToHeight(height)
+        return cls._icons[key]
+
+    @staticmethod
+    def rects(rect: QRect):
+        """Области строки: глаз, миниатюра, имя, замок"""
+        top = rect.top() + (rect.height() - THUMB_SIZE.height()) // 2
+        eye = QRect(rect.left() + 8, rect.top() + (rect.height() - 16) // 2, 16, 16)
+        thumb = QRect(eye.right() + 9, top, THUMB_SIZE.width(), THUMB_SIZE.height())
+        lock = QRect(rect.right() - 24, rect.top() + (rect.height() - 16) // 2, 16, 16)
+        name = QRect(thumb.right() + 9, rect.top(), lock.left() - thumb.right() - 17, rect.height())
+        return eye, thumb, name, lock
+
+    def paint(self, painter, option, index):
+        opt = QStyleOptionViewItem(option)
+        self.initStyleOption(opt, index)
+        style = opt.widget.style() if opt.widget else None
+        if style is not None:
+            style.drawPrimitive(QStyle.PrimitiveElement.PE_PanelItemViewItem, opt, painter, opt.widget)
+
+        eye, thumb, name, lock = self.rects(option.rect)
+        painter.save()
+        if index.data(Qt.ItemDataRole.CheckStateRole) == Qt.CheckState.Checked:
+            painter.drawPixmap(eye, self.icon("eye", 16))
+        else:
+            painter.setPen(option.palette.mid().color())
+            painter.fillRect(eye, option.palette.base())
+            painter.drawRect(eye.adjusted(0, 0, -1, -1))
+
+        painter.drawPixmap(thumb.topLeft(), index.data(Qt.ItemDataRole.DecorationRole))
+
+        locked = index.data(LayerListModel.LockedRole)
+        font = QFont(option.font)
+        font.setItalic(bool(locked))
+        painter.setFont(font)
+        painter.setPen(option.palette.text().color())
+        text = option.fontMetrics.elidedText(index.data(), Qt.TextElideMode.ElideRight, name.width())
+        painter.drawText(name, Qt.AlignmentFlag.AlignVCenter | Qt.AlignmentFlag.AlignLeft, text)
+        if locked:
+            painter.drawPixmap(lock.topLeft(), self.icon("lock", 13))
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        return QSize(option.rect.width(), ROW_HEIGHT)
+
+    def editorEvent(self, event, model, option, index):
+        eye, thumb, name, lock = self.rects(option.rect)
+        if event.type() == QEvent.Type.MouseButtonRelease and event.button() == Qt.MouseButton.LeftButton:
+            if eye.contains(event.position().toPoint()):
+                visible = index.data(Qt.ItemDataRole.CheckStateRole) == Qt.CheckState.Checked
+                state = Qt.CheckState.Unchecked if visible else Qt.CheckState.Checked
+                return model.setData(index, state.value, Qt.ItemDataRole.CheckStateRole)
+        elif event.type() == QEvent.Type.MouseButtonDblClick:
+            pos = event.position().toPoint()
+            if eye.contains(pos):
+                return True
+            if not name.contains(pos):
+                self.settingsRequested.emit(index.row())
+                return True
+        return super().editorEvent(event, model, option, index)
+
+    def updateEditorGeometry(self, editor, option, index):
+        editor.setGeometry(self.rects(option.rect)[2])
+
+
+class LayerListView(QListView):
+    """
+    Список слоёв на модели.
+    Повторяет нужную часть API QListWidget (currentRow, setCurrentRow, count)
+    и сохраняет выделенный слой при перестройке модели.
+    """
+    settingsRequested = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setModel(LayerListModel(self))
+        delegate = LayerDelegate(self)
+        delegate.settingsRequested.connect(self.settingsRequested)
+        self.setItemDelegate(delegate)
+        self.setUniformItemSizes(True)  # высота строк одна - без обхода всех строк
+        self.setMouseTracking(True)
+        self.setEditTriggers(QAbstractItemView.EditTrigger.DoubleClicked |
+                             QAbstractItemView.EditTrigger.EditKeyPressed)
+
+        self._current = None
+        self.model().modelAboutToBeReset.connect(self._remember_current)
+        self.model().modelReset.connect(self._restore_current)
+
+    def set_document(self, doc):
+        self.model().set_document(doc)
+
+    def currentRow(self):
+        return self.currentIndex().row()
+
+    def setCurrentRow(self, row):
+        self.setCurrentIndex(self.model().index(row))
+
+    def count(self):
+        return self.model().rowCount()
+
+    def current_layer(self):
+        return self.currentIndex().data(LayerListModel.LayerRole)
+
+    def _remember_current(self):
+        self._current = self.current_layer()
+
+    def _restore_current(self):
+        layers = self.model().layers
+        if self._current in layers:
+            self.setCurrentRow(layers.index(self._current))
+        elif layers:
+            self.setCurrentRow(0)
+        self._current = None